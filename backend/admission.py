@@ -0,0 +1,257 @@
+"""
+Per-user fair queuing and admission control for the query pipeline.
+Keeps a single anon_user_id from monopolising LLM throughput:
+
+- each user has a token bucket of questions (QUERY_USER_RATE_PER_MIN,
+  QUERY_USER_BURST) and a cap on concurrent questions (QUERY_MAX_PER_USER)
+- at most QUERY_MAX_IN_FLIGHT questions run the pipeline at once; the rest
+  wait in a weighted fair queue ordered by virtual finish time, so a heavy
+  user's backlog cannot starve everyone else
+- when the estimated queue wait exceeds QUERY_QUEUE_TARGET seconds, new
+  work is shed immediately with 429 + Retry-After instead of queueing
+- background work (cache pre-warming) only gets a slot when nobody is
+  queued and at most half the slots are busy, so it never delays students
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+QUERY_MAX_IN_FLIGHT = int(os.getenv("QUERY_MAX_IN_FLIGHT", "16"))
+QUERY_MAX_PER_USER = int(os.getenv("QUERY_MAX_PER_USER", "2"))
+QUERY_USER_RATE_PER_MIN = float(os.getenv("QUERY_USER_RATE_PER_MIN", "10"))
+QUERY_USER_BURST = float(os.getenv("QUERY_USER_BURST", "5"))
+QUERY_QUEUE_TARGET = float(os.getenv("QUERY_QUEUE_TARGET", "10"))
+
+# Forget idle users after this long so the per-user tables stay small
+USER_IDLE_SECONDS = 600
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; the client should retry later."""
+
+    def __init__(self, reason: str, retry_after: float, overload: bool = False):
+        super().__init__(f"{reason} (retry after {retry_after:.1f}s)")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        # True when shed because the whole server is busy (not this user)
+        self.overload = overload
+
+
+class UserState:
+    def __init__(self, now: float, burst: float):
+        self.tokens = burst
+        self.updated = now
+        self.active = 0  # queued + running
+        self.last_finish = 0.0  # virtual finish tag of the user's last request
+
+
+class Ticket:
+    """An admitted request; release() is idempotent."""
+
+    def __init__(self, scheduler: "FairQueueScheduler", user_id: str, waited: float):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.waited = waited
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._finish(self)
+
+
+class FairQueueScheduler:
+    """Async admission controller; use `async with scheduler.admit(user):`."""
+
+    def __init__(
+        self,
+        max_in_flight: int = QUERY_MAX_IN_FLIGHT,
+        max_per_user: int = QUERY_MAX_PER_USER,
+        rate_per_min: float = QUERY_USER_RATE_PER_MIN,
+        burst: float = QUERY_USER_BURST,
+        queue_target: float = QUERY_QUEUE_TARGET,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.queue_target = queue_target
+
+        self.users = {}
+        self.queue = []  # heap of (finish_tag, seq, future)
+        self.seq = itertools.count()
+        self.virtual_time = 0.0
+        self.in_flight = 0
+
+        self.service_time = 2.0  # EWMA of seconds per admitted request
+        self.queue_waits = deque(maxlen=1000)
+        self.counters = {
+            "admitted": 0,
+            "rejected_user_rate": 0,
+            "rejected_user_concurrency": 0,
+            "shed_overload": 0,
+            "admitted_background": 0,
+        }
+
+    def _user(self, user_id: str, now: float) -> UserState:
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = UserState(now, self.burst)
+            if len(self.users) > 10000:
+                self._forget_idle(now)
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        return state
+
+    def _forget_idle(self, now: float):
+        idle = [
+            uid
+            for uid, s in self.users.items()
+            if s.active == 0 and now - s.updated > USER_IDLE_SECONDS
+        ]
+        for uid in idle:
+            del self.users[uid]
+
+    def estimated_wait(self) -> float:
+        """Expected seconds a new request would wait for a slot."""
+        if self.in_flight < self.max_in_flight:
+            return 0.0
+        return (len(self.queue) + 1) * self.service_time / self.max_in_flight
+
+    def _check(self, user_id: str, state: UserState):
+        if state.active >= self.max_per_user:
+            self.counters["rejected_user_concurrency"] += 1
+            raise AdmissionRejected("Too many questions in progress", self.service_time)
+        if state.tokens < 1:
+            self.counters["rejected_user_rate"] += 1
+            raise AdmissionRejected(
+                "Question rate limit reached", (1 - state.tokens) / self.rate
+            )
+        wait = self.estimated_wait()
+        if wait > self.queue_target:
+            self.counters["shed_overload"] += 1
+            raise AdmissionRejected("Server is busy", wait, overload=True)
+
+    async def _acquire(self, user_id: str, weight: float) -> float:
+        now = time.monotonic()
+        state = self._user(user_id, now)
+        self._check(user_id, state)
+        state.tokens -= 1
+        state.active += 1
+
+        # Weighted fair queuing: a user's next request finishes (virtually)
+        # one service unit after their previous one, scaled by weight.
+        start_tag = max(self.virtual_time, state.last_finish)
+        finish_tag = start_tag + 1.0 / weight
+        state.last_finish = finish_tag
+
+        if self.in_flight < self.max_in_flight and not self.queue:
+            # Served straight away: advance virtual time so earlier heavy use
+            # is not held against this user once queueing starts
+            self.virtual_time = max(self.virtual_time, start_tag)
+            self.in_flight += 1
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (finish_tag, next(self.seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            state.active -= 1
+            if future.done() and not future.cancelled():
+                # We were handed a slot just as the caller went away
+                self._release_slot()
+            else:
+                self.queue = [e for e in self.queue if e[2] is not future]
+                heapq.heapify(self.queue)
+            raise
+        return time.monotonic() - now
+
+    def _release_slot(self):
+        while self.queue:
+            finish_tag, _, future = heapq.heappop(self.queue)
+            if future.cancelled():
+                continue
+            self.virtual_time = finish_tag
+            future.set_result(None)
+            return  # slot handed over, in_flight unchanged
+        self.in_flight -= 1
+
+    async def acquire(self, user_id: str, weight: float = 1.0) -> "Ticket":
+        """
+        Wait for a pipeline slot for user_id.
+        Raises AdmissionRejected straight away if the user is over their
+        limits or the queue is already past the latency target.
+        """
+        waited = await self._acquire(user_id, weight)
+        self.counters["admitted"] += 1
+        self.queue_waits.append(waited)
+        return Ticket(self, user_id, waited)
+
+    def acquire_background(self, user_id: str) -> "Ticket":
+        """
+        A slot for work nobody is waiting on, granted only while the
+        pipeline has spare capacity; raises AdmissionRejected otherwise.
+        Bypasses the per-user limits, the caller paces itself.
+        """
+        if self.queue or self.in_flight >= max(1, self.max_in_flight // 2):
+            raise AdmissionRejected("Server is busy", self.service_time, overload=True)
+        self.in_flight += 1
+        self._user(user_id, time.monotonic()).active += 1
+        self.counters["admitted_background"] += 1
+        return Ticket(self, user_id, 0.0)
+
+    async def wait_background(self, user_id: str, timeout: float) -> "Ticket":
+        """acquire_background, retrying for up to timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.acquire_background(user_id)
+            except AdmissionRejected as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def _finish(self, ticket: "Ticket"):
+        elapsed = time.monotonic() - ticket.started
+        self.service_time = 0.9 * self.service_time + 0.1 * elapsed
+        self.users[ticket.user_id].active -= 1
+        self._release_slot()
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, weight: float = 1.0):
+        ticket = await self.acquire(user_id, weight)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        waits = sorted(self.queue_waits)
+
+        def pct(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "active_users": sum(1 for s in self.users.values() if s.active),
+            "service_time_ms": round(1000 * self.service_time, 1),
+            "estimated_wait_ms": round(1000 * self.estimated_wait(), 1),
+            "queue_wait_ms": {
+                "p50": round(1000 * pct(0.50), 1),
+                "p95": round(1000 * pct(0.95), 1),
+                "max": round(1000 * waits[-1], 1) if waits else 0,
+            },
+        }
+
+
+scheduler = FairQueueScheduler()
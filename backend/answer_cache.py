@@ -0,0 +1,200 @@
+"""
+Answer cache for /api/query and /api/query/stream.
+Answers are keyed on (corpus version, ITS mode, normalized question), so a
+re-ingest or PDF delete (new corpus version, see index_versions.py) makes
+old entries unreachable instead of serving stale answers. SQLite-backed,
+so every uvicorn worker on the host shares it and it survives restarts.
+Entries record whether they came from a live request or from pre-warming
+(prewarm.py), and how often they were hit afterwards.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "answer_cache.db")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "20000"))
+
+# Expired/excess rows are pruned every this many writes
+PRUNE_EVERY = 200
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation don't make a new question."""
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+
+def cache_key(question: str, mode: str, corpus_version: str) -> str:
+    return f"{corpus_version}|{mode}|{normalize_question(question)}"
+
+
+class AnswerCache:
+    def __init__(self, path: str = ANSWER_CACHE_DB):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # A lost cache write after a crash is harmless; skip the fsyncs
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.counters = {"lookups": 0, "hits": 0, "stores": 0}
+        with self.lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    question TEXT,
+                    mode TEXT,
+                    corpus_version TEXT,
+                    answer TEXT,
+                    citations TEXT,
+                    source TEXT,
+                    created REAL,
+                    hits INTEGER DEFAULT 0,
+                    last_hit REAL
+                )
+                """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_answers_corpus "
+                "ON answers(corpus_version, source)"
+            )
+            self.conn.commit()
+
+    def get(self, question: str, mode: str, corpus_version: str) -> Optional[dict]:
+        key = cache_key(question, mode, corpus_version)
+        try:
+            with self.lock:
+                self.counters["lookups"] += 1
+                row = self.conn.execute(
+                    "SELECT answer, citations, source FROM answers "
+                    "WHERE key = ? AND created > ?",
+                    (key, time.time() - ANSWER_CACHE_TTL),
+                ).fetchone()
+                if row is None:
+                    return None
+                self.counters["hits"] += 1
+                self.conn.execute(
+                    "UPDATE answers SET hits = hits + 1, last_hit = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error("Answer cache lookup failed: %s", e)
+            return None
+        return {"answer": row[0], "citations": json.loads(row[1]), "source": row[2]}
+
+    def put(
+        self,
+        question: str,
+        mode: str,
+        corpus_version: str,
+        answer: str,
+        citations: list,
+        source: str = "live",
+    ):
+        key = cache_key(question, mode, corpus_version)
+        try:
+            with self.lock:
+                # Keep the original row (and its hit count) if one exists
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO answers (key, question, mode, "
+                    "corpus_version, answer, citations, source, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        question,
+                        mode,
+                        corpus_version,
+                        answer,
+                        json.dumps(citations),
+                        source,
+                        time.time(),
+                    ),
+                )
+                self.conn.commit()
+                self.counters["stores"] += 1
+                self.writes += 1
+                if self.writes % PRUNE_EVERY == 0:
+                    self._prune()
+        except sqlite3.Error as e:
+            logging.error("Answer cache store failed: %s", e)
+
+    def contains(self, question: str, mode: str, corpus_version: str) -> bool:
+        key = cache_key(question, mode, corpus_version)
+        with self.lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM answers WHERE key = ? AND created > ?",
+                    (key, time.time() - ANSWER_CACHE_TTL),
+                ).fetchone()
+                is not None
+            )
+
+    def _prune(self):
+        self.conn.execute(
+            "DELETE FROM answers WHERE created <= ?",
+            (time.time() - ANSWER_CACHE_TTL,),
+        )
+        self.conn.execute(
+            "DELETE FROM answers WHERE key NOT IN (SELECT key FROM answers "
+            "ORDER BY COALESCE(last_hit, created) DESC LIMIT ?)",
+            (ANSWER_CACHE_MAX_ENTRIES,),
+        )
+        self.conn.commit()
+
+    def popular_questions(self, course_id: str, limit: int) -> list:
+        """Most-hit live questions ever asked in a course (any corpus version)."""
+        prefix = f"{course_id}@"
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT question, SUM(hits) + COUNT(*) AS asked FROM answers "
+                "WHERE source = 'live' AND substr(corpus_version, 1, ?) = ? "
+                "GROUP BY LOWER(question) ORDER BY asked DESC LIMIT ?",
+                # A prefix match; LIKE would read "_" in course ids as a wildcard
+                (len(prefix), prefix, limit),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def prewarmed_questions(self, corpus_version: str, mode: str) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT question FROM answers "
+                "WHERE corpus_version = ? AND mode = ? AND source = 'prewarm' "
+                "ORDER BY created",
+                (corpus_version, mode),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def stats(self) -> dict:
+        """Hit counts, split by where the entry came from."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT source, COUNT(*), SUM(hits > 0), COALESCE(SUM(hits), 0) "
+                "FROM answers GROUP BY source"
+            ).fetchall()
+            counters = dict(self.counters)
+        by_source = {
+            source: {
+                "entries": entries,
+                "entries_hit": hit or 0,
+                "hits": hits,
+                "hit_entry_share": round((hit or 0) / entries, 3) if entries else 0,
+            }
+            for source, entries, hit, hits in rows
+        }
+        return {
+            **counters,
+            "hit_rate": (
+                round(counters["hits"] / counters["lookups"], 3)
+                if counters["lookups"]
+                else 0
+            ),
+            "by_source": by_source,
+        }
+
+
+answer_cache = AnswerCache() if ANSWER_CACHE else None
@@ -0,0 +1,53 @@
+"""
+Course-wide background runs started after an ingest: answer cache
+pre-warming (prewarm.py) and summary builds (summaries.py). Each kind
+keeps one run per course at a time, waits for background admission slots
+so students' questions go first, and remembers how each course's last
+run went for /api/metrics.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, List
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import Ticket, scheduler
+
+# A run gives up after waiting this long for spare capacity in one go
+BUSY_TIMEOUT = 600
+
+
+class BackgroundRuns:
+    def __init__(self, user_id: str):
+        self.user_id = user_id  # admission user id of the runs
+        # course_id -> asyncio.Task of the latest run (kept so it isn't collected)
+        self.tasks = {}
+        # course_id -> summary of the last finished run
+        self.last = {}
+
+    def start(self, course_id: str, run: Callable[[str], Awaitable]) -> bool:
+        """
+        run(course_id) in the background on the current event loop; False
+        if the course already has a run going.
+        """
+        task = self.tasks.get(course_id)
+        if task and not task.done():
+            return False
+        self.tasks[course_id] = asyncio.create_task(run(course_id))
+        return True
+
+    def running(self) -> List[str]:
+        return sorted(c for c, task in self.tasks.items() if not task.done())
+
+    async def admit(self) -> Ticket:
+        """A background pipeline slot; AdmissionRejected after BUSY_TIMEOUT."""
+        return await scheduler.wait_background(self.user_id, BUSY_TIMEOUT)
+
+    @staticmethod
+    async def superseded(course_id: str, corpus_version: str) -> bool:
+        """Re-ingested since the run started; that ingest starts its own run."""
+        from rag_engine import get_corpus_version
+
+        return await run_in_threadpool(get_corpus_version, course_id) != (
+            corpus_version
+        )
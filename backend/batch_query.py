@@ -0,0 +1,129 @@
+"""
+Batch questions for instructors and evaluation runs (POST /api/query/batch).
+Answers a list of questions the way /api/query would, but
+  - embeds all of them in batched model calls and searches the course once
+    for the whole list (rag_engine.retrieve_batch),
+  - runs LLM synthesis BATCH_CONCURRENCY questions at a time, each on a
+    background admission slot so students' questions go first, and
+  - yields results in completion order, tagged with the question's index.
+Nothing is written to the conversations table or the answer cache.
+"""
+
+import asyncio
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import scheduler
+from its import apply_its_mode, normalize_mode
+from model_router import base_route
+from prompts import SYSTEM_PROMPT
+from rag_engine import (
+    EXCERPT_TOP_K,
+    answer_from_nodes,
+    format_excerpts,
+    retrieve_batch,
+    route_for_nodes,
+)
+
+# LLM calls one batch keeps in flight
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# A question fails when no pipeline slot frees up within this many seconds
+BATCH_BUSY_TIMEOUT = float(os.getenv("BATCH_BUSY_TIMEOUT", "300"))
+
+# Admission user id for batch queries
+BATCH_USER = "__batch__"
+
+
+async def run_batch(
+    questions: List[str],
+    mode: str = "direct",
+    course_id: Optional[str] = None,
+    response_type: str = "answer",
+) -> AsyncIterator[dict]:
+    """
+    Yields one {"type": "result" | "error", "index": ...} dict per question,
+    then {"type": "done", ...}.
+    """
+    started = time.perf_counter()
+    mode = normalize_mode(mode)
+    top_k = EXCERPT_TOP_K if response_type == "excerpts" else base_route(mode).top_k
+    try:
+        node_lists = await run_in_threadpool(
+            retrieve_batch, questions, top_k, course_id
+        )
+    except Exception as e:
+        print(f"[BATCH] Retrieval failed: {e}")
+        yield {"type": "error", "message": f"Retrieval failed: {e}"}
+        return
+    print(
+        f"[BATCH] Retrieved {len(questions)} questions in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(index: int, question: str, nodes: list) -> dict:
+        async with semaphore:
+            answer_started = time.perf_counter()
+            try:
+                if response_type == "excerpts":
+                    # Citation page lookups can open the PDFs
+                    result = await run_in_threadpool(
+                        format_excerpts, nodes[:EXCERPT_TOP_K], answer_started
+                    )
+                else:
+                    ticket = await scheduler.wait_background(
+                        BATCH_USER, BATCH_BUSY_TIMEOUT
+                    )
+                    try:
+                        result = await run_in_threadpool(
+                            answer_from_nodes,
+                            apply_its_mode(question, mode),
+                            SYSTEM_PROMPT,
+                            nodes,
+                            route_for_nodes(mode, nodes),
+                            answer_started,
+                        )
+                    finally:
+                        ticket.release()
+            except Exception as e:
+                print(f"[BATCH] Question {index} failed: {e}")
+                return {"type": "error", "index": index, "message": str(e)}
+
+        line = {
+            "type": "result",
+            "index": index,
+            "question": question,
+            "answer": result["answer"],
+            "citations": result["citations"],
+            "route": result["route"],
+            "latency_ms": round(1000 * (time.perf_counter() - answer_started), 1),
+        }
+        if result.get("degraded"):
+            line["degraded"] = result["degraded"]
+        return line
+
+    tasks = [
+        asyncio.create_task(answer(i, question, nodes))
+        for i, (question, nodes) in enumerate(zip(questions, node_lists))
+    ]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            failed += line["type"] == "error"
+            yield line
+    finally:
+        # The client went away: don't keep spending LLM calls on it
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "type": "done",
+        "count": len(questions),
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,819 @@
+"""
+Offline benchmark harness for the RAG pipeline.
+Runs ingestion, chunking, embedding, retrieval, full query, citation lookup,
+history DB, multi-worker, vector-backend and multi-course scenarios against a
+synthetic corpus with the fake LLM from fake_llm.py, so no Groq key or network
+access is needed.
+Results are written as JSON and can be compared against a previous run to
+catch regressions between commits.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --scenarios ingest,query --embed fake
+    python benchmark.py --output bench_results/baseline.json
+    python benchmark.py --compare bench_results/baseline.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from synthetic_corpus import TOPICS, generate_corpus
+
+QUESTIONS = [
+    "What is the main topic of the lecture?",
+    "Can you explain the key concepts?",
+    "What are the important points to remember?",
+    "How does this relate to previous topics?",
+    "Can you summarize the material?",
+] + [f"How do {topic.lower()} work?" for topic in TOPICS]
+
+SCENARIOS: Dict[str, Callable] = {}
+
+
+def scenario(name: str):
+    """Register a benchmark scenario under `name`."""
+
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+
+    return register
+
+
+def summarize(samples_ms: List[float], prefix: str = "") -> Dict[str, float]:
+    """Mean and tail percentiles for a list of latencies in milliseconds."""
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {
+        f"{prefix}mean_ms": round(statistics.fmean(ordered), 3),
+        f"{prefix}p50_ms": round(pct(0.50), 3),
+        f"{prefix}p95_ms": round(pct(0.95), 3),
+        f"{prefix}p99_ms": round(pct(0.99), 3),
+    }
+
+
+def timed(func, *args, **kwargs):
+    """Run func and return (result, elapsed milliseconds)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+class BenchContext:
+    """Shared state between scenarios of one run."""
+
+    def __init__(self, args, workdir: Path):
+        self.args = args
+        self.workdir = workdir
+        self.ingested = False
+
+    def ensure_ingested(self):
+        if self.ingested:
+            return
+        run_ingest(self)
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+
+@scenario("ingest")
+def run_ingest(ctx: BenchContext) -> Dict[str, float]:
+    import rag_engine
+
+    pdf_dir = Path(rag_engine.PDF_UPLOAD_DIR)
+    generate_corpus(pdf_dir, ctx.args.docs, ctx.args.pages)
+
+    result, elapsed_ms = timed(rag_engine.ingest_pdfs)
+    if result.get("status") != "success":
+        raise RuntimeError(f"Ingestion failed: {result}")
+    ctx.ingested = True
+
+    chunks = rag_engine.get_index_stats().get("document_count", 0)
+    pages = ctx.args.docs * ctx.args.pages
+    seconds = elapsed_ms / 1000
+    return {
+        "docs": ctx.args.docs,
+        "pages": pages,
+        "chunks": chunks,
+        "total_seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 2),
+        "chunks_per_sec": round(chunks / seconds, 2),
+    }
+
+
+@scenario("retrieval")
+def run_retrieval(ctx: BenchContext) -> Dict[str, float]:
+    import chromadb
+    from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    import rag_engine  # noqa: F401 - configures Settings.embed_model
+
+    client = chromadb.EphemeralClient()
+    metrics = {}
+    for docs in ctx.args.corpus_sizes:
+        corpus_dir = ctx.workdir / f"retrieval_{docs}"
+        generate_corpus(corpus_dir, docs, ctx.args.pages, seed=docs)
+        collection = client.get_or_create_collection(f"bench_{docs}")
+        storage = StorageContext.from_defaults(
+            vector_store=ChromaVectorStore(chroma_collection=collection)
+        )
+        index = VectorStoreIndex.from_documents(
+            SimpleDirectoryReader(str(corpus_dir)).load_data(),
+            storage_context=storage,
+        )
+        retriever = index.as_retriever(similarity_top_k=ctx.args.top_k)
+
+        samples = []
+        for i in range(ctx.args.iterations):
+            _, ms = timed(retriever.retrieve, QUESTIONS[i % len(QUESTIONS)])
+            samples.append(ms)
+
+        metrics[f"docs_{docs}_chunks"] = collection.count()
+        metrics.update(summarize(samples, prefix=f"docs_{docs}_"))
+    return metrics
+
+
+def synthetic_vectors(count: int, dim: int, seed: int):
+    """Clustered unit vectors (one cluster per fake file), in 5k batches."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((200, dim)).astype(np.float32)
+    # Chroma rejects batches above ~5.4k
+    for start in range(0, count, 5000):
+        size = min(5000, count - start)
+        files = rng.integers(0, len(centroids), size)
+        vectors = centroids[files] + 0.8 * rng.standard_normal((size, dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield start, vectors.astype(np.float32), files
+
+
+@scenario("vector_backends")
+def run_vector_backends(ctx: BenchContext) -> Dict[str, float]:
+    """Chroma vs. the mmap'd flat store on synthetic 384-dim vectors."""
+    import chromadb
+    import numpy as np
+    from llama_index.core.schema import TextNode
+    from llama_index.core.vector_stores.types import (
+        MetadataFilter,
+        MetadataFilters,
+        VectorStoreQuery,
+    )
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    from flat_store import FlatVectorStore
+
+    dim, metrics = 384, {}
+    for count in ctx.args.vector_counts:
+        queries = np.concatenate(
+            [v[:5] for _, v, _ in synthetic_vectors(count, dim, seed=count)]
+        )[: ctx.args.iterations]
+        queries += 0.05 * np.random.default_rng(0).standard_normal(queries.shape)
+
+        stores = {
+            "chroma": lambda path: ChromaVectorStore(
+                chroma_collection=chromadb.PersistentClient(
+                    path=str(path)
+                ).get_or_create_collection("bench")
+            ),
+            "flat": lambda path: FlatVectorStore(str(path)),
+        }
+        results = {}
+        for name, make_store in stores.items():
+            path = ctx.workdir / f"vectors_{name}_{count}"
+            store = make_store(path)
+
+            start = time.perf_counter()
+            for offset, vectors, files in synthetic_vectors(count, dim, seed=count):
+                store.add(
+                    [
+                        TextNode(
+                            id_=f"chunk-{offset + i}",
+                            text=f"chunk {offset + i}",
+                            metadata={"file_name": f"lecture-{f}.pdf"},
+                            embedding=vector.tolist(),
+                        )
+                        for i, (vector, f) in enumerate(zip(vectors, files))
+                    ]
+                )
+            build_seconds = time.perf_counter() - start
+
+            samples, filtered, ids = [], [], []
+            file_filter = MetadataFilters(
+                filters=[MetadataFilter(key="file_name", value="lecture-7.pdf")]
+            )
+            for vector in queries:
+                query = VectorStoreQuery(
+                    query_embedding=vector.tolist(), similarity_top_k=ctx.args.top_k
+                )
+                result, ms = timed(store.query, query)
+                samples.append(ms)
+                ids.append(set(result.ids))
+                query.filters = file_filter
+                filtered.append(timed(store.query, query)[1])
+            results[name] = ids
+
+            label = f"{name}_{count}_"
+            disk = sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+            metrics[f"{label}build_seconds"] = round(build_seconds, 2)
+            metrics[f"{label}disk_mb"] = round(disk / 2**20, 1)
+            metrics.update(summarize(samples, prefix=label))
+            metrics.update(summarize(filtered, prefix=f"{label}filtered_"))
+
+        # The flat store is exact, so this is HNSW's recall@k
+        overlap = [
+            len(c & f) / len(f) for c, f in zip(results["chroma"], results["flat"])
+        ]
+        metrics[f"chroma_{count}_recall_at_k"] = round(statistics.fmean(overlap), 4)
+    return metrics
+
+
+# Opens one collection in a fresh process and queries it; prints the RSS
+# growth in MB, i.e. what loading that collection's HNSW index costs
+COLLECTION_MEMORY_PROBE = """
+import os, sys
+import chromadb, numpy as np
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+collection = chromadb.PersistentClient(path=sys.argv[1]).get_collection(sys.argv[2])
+before = rss_mb()
+queries = np.random.default_rng(0).standard_normal((20, int(sys.argv[3])))
+collection.query(query_embeddings=queries.tolist(), n_results=10)
+print(rss_mb() - before)
+"""
+
+
+@scenario("courses")
+def run_courses(ctx: BenchContext) -> Dict[str, float]:
+    """
+    Per-course collections vs. every course in one collection (searched
+    unfiltered, as before namespaces, or with a course_id filter).
+    """
+    import chromadb
+
+    dim, count = 384, ctx.args.course_chunks
+    path = ctx.workdir / "courses_chroma"
+    client = chromadb.PersistentClient(path=str(path))
+    merged = client.get_or_create_collection("merged")
+    queries = []
+    for course in range(ctx.args.courses):
+        collection = client.get_or_create_collection(f"course_{course}")
+        for offset, vectors, files in synthetic_vectors(count, dim, seed=course):
+            ids = [f"c{course}-{offset + i}" for i in range(len(vectors))]
+            for target, metadata in (
+                (collection, [{"file": int(f)} for f in files]),
+                (merged, [{"file": int(f), "course": course} for f in files]),
+            ):
+                target.add(ids=ids, embeddings=vectors, metadatas=metadata)
+            if course == 0 and offset == 0:
+                queries = vectors[: ctx.args.iterations]
+
+    course_collection = client.get_collection("course_0")
+    timings = {
+        "merged_": lambda q: merged.query(query_embeddings=[q], n_results=10),
+        "merged_filtered_": lambda q: merged.query(
+            query_embeddings=[q], n_results=10, where={"course": 0}
+        ),
+        "per_course_": lambda q: course_collection.query(
+            query_embeddings=[q], n_results=10
+        ),
+    }
+    metrics = {"courses": ctx.args.courses, "chunks_per_course": count}
+    for label, run in timings.items():
+        run(queries[0])  # load the segment before timing
+        metrics.update(summarize([timed(run, q)[1] for q in queries], prefix=label))
+
+    for label, name in (("merged", "merged"), ("per_course", "course_0")):
+        probe = subprocess.run(
+            [sys.executable, "-c", COLLECTION_MEMORY_PROBE, str(path), name, str(dim)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        metrics[f"{label}_load_rss_mb"] = round(float(probe.stdout.split()[-1]), 1)
+    return metrics
+
+
+@scenario("chunking")
+def run_chunking(ctx: BenchContext) -> Dict[str, float]:
+    """Chunks, embedded text and ingest time: SentenceSplitter vs page-aware."""
+    import chromadb
+    from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex
+    from llama_index.core.schema import MetadataMode
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    import rag_engine  # noqa: F401 - configures Settings.embed_model
+    from pdf_chunking import make_node_parser
+
+    corpus_dir = ctx.args.corpus_dir
+    if corpus_dir is None:
+        corpus_dir = ctx.workdir / "chunking"
+        generate_corpus(
+            corpus_dir,
+            ctx.args.docs,
+            ctx.args.pages,
+            short_slides=ctx.args.short_slides,
+        )
+
+    client = chromadb.EphemeralClient()
+    metrics = {}
+    for kind in ("sentences", "pages"):
+        start = time.perf_counter()
+        documents = SimpleDirectoryReader(str(corpus_dir)).load_data()
+        nodes = make_node_parser(kind).get_nodes_from_documents(documents)
+        collection = client.get_or_create_collection(f"chunking_{kind}")
+        VectorStoreIndex(
+            nodes,
+            storage_context=StorageContext.from_defaults(
+                vector_store=ChromaVectorStore(chroma_collection=collection)
+            ),
+        )
+        metrics[f"{kind}_ingest_seconds"] = round(time.perf_counter() - start, 3)
+        metrics[f"{kind}_chunks"] = len(nodes)
+        metrics[f"{kind}_embedded_kchars"] = round(
+            sum(len(n.get_content(metadata_mode=MetadataMode.EMBED)) for n in nodes)
+            / 1000,
+            1,
+        )
+
+    for key in ("chunks", "embedded_kchars", "ingest_seconds"):
+        metrics[f"{key}_reduction"] = round(
+            1 - metrics[f"pages_{key}"] / metrics[f"sentences_{key}"], 3
+        )
+    return metrics
+
+
+@scenario("embedding")
+def run_embedding(ctx: BenchContext) -> Dict[str, float]:
+    """Query latency and batch throughput of the configured embedding model."""
+    import random
+
+    from llama_index.core import Settings
+
+    import rag_engine  # noqa: F401 - configures Settings.embed_model
+    from synthetic_corpus import make_lecture
+
+    model = Settings.embed_model
+    rng = random.Random(0)
+    chunks = [
+        "\n".join(page)
+        for number in range(1, 11)
+        for page in make_lecture(rng, number, ctx.args.pages)
+    ]
+
+    model.get_query_embedding(QUESTIONS[0])  # warm-up
+    samples = []
+    for i in range(ctx.args.iterations):
+        _, ms = timed(model.get_query_embedding, QUESTIONS[i % len(QUESTIONS)])
+        samples.append(ms)
+
+    _, batch_ms = timed(model.get_text_embedding_batch, chunks)
+    metrics = summarize(samples, prefix="query_")
+    metrics["chunks_per_sec"] = round(1000 * len(chunks) / batch_ms, 2)
+    return metrics
+
+
+@scenario("query")
+def run_query(ctx: BenchContext) -> Dict[str, float]:
+    import rag_engine
+    from prompts import SYSTEM_PROMPT
+
+    ctx.ensure_ingested()
+    samples = []
+    citations = 0
+    for i in range(ctx.args.iterations):
+        result, ms = timed(
+            rag_engine.query_rag, QUESTIONS[i % len(QUESTIONS)], SYSTEM_PROMPT
+        )
+        samples.append(ms)
+        citations += len(result["citations"])
+
+    metrics = summarize(samples)
+    metrics["citations_per_query"] = round(citations / len(samples), 2)
+    metrics["queries_per_sec"] = round(1000 * len(samples) / sum(samples), 2)
+    return metrics
+
+
+@scenario("excerpts")
+def run_excerpts(ctx: BenchContext) -> Dict[str, float]:
+    import rag_engine
+
+    ctx.ensure_ingested()
+    samples = []
+    for i in range(ctx.args.iterations):
+        _, ms = timed(rag_engine.excerpt_query, QUESTIONS[i % len(QUESTIONS)])
+        samples.append(ms)
+
+    metrics = summarize(samples)
+    metrics["queries_per_sec"] = round(1000 * len(samples) / sum(samples), 2)
+    return metrics
+
+
+@scenario("citations")
+def run_citations(ctx: BenchContext) -> Dict[str, float]:
+    import pypdf
+
+    import rag_engine
+
+    pdf_dir = ctx.workdir / "citations"
+    pdf_path = generate_corpus(pdf_dir, 1, ctx.args.pages)[0]
+    with open(pdf_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        page_texts = [page.extract_text() for page in reader.pages]
+
+    metrics = {"pages": len(page_texts)}
+    positions = {"first": 0, "middle": len(page_texts) // 2, "last": -1}
+    for label, page in positions.items():
+        # Skip the repeated header so the snippet is unique to this page
+        snippet = page_texts[page].split("\n", 1)[-1]
+        samples = []
+        for _ in range(ctx.args.iterations):
+            _, ms = timed(rag_engine.get_accurate_page_number, str(pdf_path), snippet)
+            samples.append(ms)
+        metrics.update(summarize(samples, prefix=f"{label}_page_"))
+    return metrics
+
+
+@scenario("history")
+def run_history(ctx: BenchContext) -> Dict[str, float]:
+    import db
+
+    writes = ctx.args.iterations * 10
+    users = [f"bench_user_{i}" for i in range(50)]
+
+    start = time.perf_counter()
+    for i in range(writes):
+        db.save_message(users[i % len(users)], "user", f"question {i}", "socratic")
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(writes):
+        db.get_history(users[i % len(users)])
+    read_seconds = time.perf_counter() - start
+
+    # Mixed read/write load from several threads, like concurrent requests
+    errors = []
+
+    def worker(thread_id):
+        try:
+            for i in range(ctx.args.iterations):
+                user = users[(thread_id + i) % len(users)]
+                db.get_history(user)
+                db.save_message(user, "assistant", f"answer {i}", "socratic")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=worker, args=(t,)) for t in range(ctx.args.threads)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    mixed_seconds = time.perf_counter() - start
+    mixed_ops = 2 * ctx.args.iterations * ctx.args.threads
+
+    return {
+        "writes_per_sec": round(writes / write_seconds, 1),
+        "reads_per_sec": round(writes / read_seconds, 1),
+        "mixed_ops_per_sec": round(mixed_ops / mixed_seconds, 1),
+        "mixed_errors": len(errors),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(check: Callable[[], bool], timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Timed out waiting for benchmark subprocess")
+
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of pid and all its descendants (Linux /proc only)."""
+    children = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+        except (OSError, IndexError):
+            continue
+
+    total_kb, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            for line in Path(f"/proc/{current}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+def post_json(url: str, payload: dict) -> dict:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+@scenario("workers")
+def run_workers(ctx: BenchContext) -> Dict[str, float]:
+    """
+    RSS and retrieval throughput of uvicorn with 1/2/4 workers, each worker
+    holding its own index ("local") vs. all of them using index_service.py
+    ("shared").
+    """
+    ctx.ensure_ingested()
+    backend_dir = Path(__file__).resolve().parent
+    requests_total = ctx.args.iterations * ctx.args.threads
+    metrics = {}
+
+    for mode in ("local", "shared"):
+        for workers in ctx.args.worker_counts:
+            env = dict(os.environ, QUERY_USER_BURST="1000")
+            procs = []
+            try:
+                if mode == "shared":
+                    address = str(ctx.workdir / "index.sock")
+                    env["INDEX_SERVICE"] = address
+                    procs.append(
+                        subprocess.Popen(
+                            [sys.executable, "index_service.py", "--address", address],
+                            cwd=backend_dir,
+                            env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                        )
+                    )
+                    wait_for(lambda: Path(address).exists())
+
+                port = free_port()
+                base = f"http://127.0.0.1:{port}"
+                procs.append(
+                    subprocess.Popen(
+                        [
+                            sys.executable,
+                            "-m",
+                            "uvicorn",
+                            "main:app",
+                            "--port",
+                            str(port),
+                            "--workers",
+                            str(workers),
+                            "--log-level",
+                            "warning",
+                        ],
+                        cwd=backend_dir,
+                        env=env,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                )
+                wait_for(lambda: urllib.request.urlopen(f"{base}/health").status == 200)
+
+                def ask(i):
+                    payload = {
+                        "question": QUESTIONS[i % len(QUESTIONS)],
+                        "mode": "direct",
+                        "anon_user_id": f"bench-{i % 64}",
+                        "response_type": "excerpts",
+                    }
+                    return timed(post_json, f"{base}/api/query", payload)[1]
+
+                # Warm every worker before measuring
+                for i in range(4 * workers):
+                    ask(i)
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(ctx.args.threads) as pool:
+                    samples = list(pool.map(ask, range(requests_total)))
+                seconds = time.perf_counter() - start
+
+                label = f"{mode}_{workers}w_"
+                metrics[f"{label}rss_mb"] = sum(tree_rss_mb(p.pid) for p in procs)
+                metrics[f"{label}queries_per_sec"] = round(requests_total / seconds, 2)
+                metrics.update(summarize(samples, prefix=label))
+            finally:
+                for proc in reversed(procs):
+                    proc.terminate()
+                    proc.wait(timeout=30)
+    return metrics
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+
+def git_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compare two result files metric by metric.
+    Metrics ending in _ms/_seconds are lower-is-better, _per_sec higher-is-better;
+    anything else is informational.
+
+    Returns:
+        List of human-readable regression descriptions
+    """
+    regressions = []
+    for name, metrics in current["results"].items():
+        base_metrics = baseline.get("results", {}).get(name, {})
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not base:
+                continue
+            if metric.endswith(("_ms", "_seconds")) and value > base * (1 + tolerance):
+                change = (value - base) / base
+            elif metric.endswith("_per_sec") and value < base * (1 - tolerance):
+                change = (base - value) / base
+            else:
+                continue
+            regressions.append(
+                f"{name}.{metric}: {base} -> {value} ({change:+.0%} worse)"
+            )
+    return regressions
+
+
+def configure_env(args, workdir: Path):
+    """Point the backend modules at the scratch directory before importing them."""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["EMBED_PROVIDER"] = args.embed
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SEC"] = str(args.llm_tokens_per_sec)
+    os.environ["USE_S3"] = "false"
+    os.environ["CHROMA_PATH"] = str(workdir / "chroma_db")
+    os.environ["FLAT_INDEX_PATH"] = str(workdir / "flat_index")
+    os.environ["PDF_UPLOAD_DIR"] = str(workdir / "uploaded_pdfs")
+    os.environ["CONVERSATIONS_DB"] = str(workdir / "conversations.db")
+    os.environ["ANSWER_CACHE_DB"] = str(workdir / "answer_cache.db")
+    os.environ["SUMMARY_DB"] = str(workdir / "summaries.db")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark suite")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--docs", type=int, default=10, help="PDFs to ingest")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per PDF")
+    parser.add_argument(
+        "--corpus-sizes",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[5, 20, 80],
+        help="Document counts for the retrieval scenario",
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--vector-counts",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[10000, 100000, 1000000],
+        help="Chunk counts for the vector_backends scenario",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        type=Path,
+        help="Real PDFs for the chunking scenario (default: synthetic slides)",
+    )
+    parser.add_argument(
+        "--short-slides",
+        type=float,
+        default=0.3,
+        help="Share of one-sentence slides in the chunking scenario's corpus",
+    )
+    parser.add_argument(
+        "--courses", type=int, default=8, help="Courses for the courses scenario"
+    )
+    parser.add_argument(
+        "--course-chunks",
+        type=int,
+        default=10000,
+        help="Chunks per course for the courses scenario",
+    )
+    parser.add_argument(
+        "--worker-counts",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[1, 2, 4],
+        help="uvicorn worker counts for the workers scenario",
+    )
+    parser.add_argument(
+        "--embed",
+        choices=["huggingface", "onnx", "fake"],
+        default="huggingface",
+        help="Embedding model (huggingface needs the model cached locally)",
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--workdir", type=Path, help="Scratch dir (default: temp)")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON to compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    selected = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in selected if s not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="tutorbot_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    configure_env(args, workdir)
+
+    ctx = BenchContext(args, workdir)
+    results = {}
+    for name in selected:
+        print(f"[BENCH] Running {name}...")
+        results[name] = SCENARIOS[name](ctx)
+        print(f"[BENCH] {name}: {json.dumps(results[name])}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()
+            },
+        },
+        "results": results,
+    }
+
+    output = args.output or (
+        Path("bench_results") / f"{time.strftime('%Y%m%d-%H%M%S')}-{git_commit()}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"[BENCH] Results written to {output}")
+
+    if args.compare:
+        regressions = compare(
+            report, json.loads(args.compare.read_text()), args.tolerance
+        )
+        if regressions:
+            print(f"[BENCH] {len(regressions)} regression(s) vs {args.compare}:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"[BENCH] No regressions vs {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
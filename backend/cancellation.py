@@ -0,0 +1,211 @@
+"""
+Cancellation of abandoned queries.
+A student who closes the tab or re-asks before the answer arrives used to
+cost a full Groq generation, a citation scan and a SQLite write nobody
+would read. Each /api/query and /api/query/stream request now gets a
+CancelToken that is cancelled when:
+  - the client disconnects ("disconnect"), seen by watching the ASGI
+    receive channel while the request runs
+  - the same anon_user_id asks a new question ("superseded")
+The token is carried in a contextvar, so the threadpool code of the
+pipeline sees it without extra arguments. Cancellation is checked:
+  - while waiting for admission or LlamaCloud (the awaiting task is
+    cancelled, see until_cancelled)
+  - before retrieval, before the LLM call and before the citation scan
+    (checkpoint())
+  - while queued for LLM rate-limit budget and between generated chunks
+    (llm_dispatch.py), which closes the Groq stream so generation stops
+Cancelled queries skip their history and answer cache writes. Counts,
+where queries stopped and the estimated tokens saved are in /api/metrics.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional
+
+CANCEL_QUERIES = os.getenv("CANCEL_QUERIES", "true").lower() == "true"
+# A new question from the same anon_user_id cancels the one still running
+CANCEL_SUPERSEDED = os.getenv("CANCEL_SUPERSEDED", "true").lower() == "true"
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint once the query's token has been cancelled."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Query cancelled ({reason})")
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Set once, from the event loop; read from any thread.
+    `stage` is the first checkpoint that stopped the query.
+    """
+
+    def __init__(self, registry: "ActiveQueries", user_id: str):
+        self.registry = registry
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.reason: Optional[str] = None
+        self.stage: Optional[str] = None
+        self.finished = False
+        self.callbacks: List[Callable[[], None]] = []
+        self.watcher: Optional[asyncio.Task] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self, reason: str):
+        if self.finished or self.cancelled:
+            return
+        self.reason = reason
+        self.event.set()
+        self.registry.count(reason)
+        for callback in self.callbacks:
+            callback()
+
+    def stop(self, stage: str, tokens: int = 0):
+        """Record where the query stopped and the LLM tokens it didn't use."""
+        self.registry.stopped(None if self.stage else stage, tokens)
+        self.stage = self.stage or stage
+
+    def wait(self, seconds: float) -> bool:
+        return self.event.wait(seconds)
+
+
+current: ContextVar[Optional[CancelToken]] = ContextVar("cancel_token", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return current.get()
+
+
+def checkpoint(stage: str, tokens: int = 0):
+    """
+    Raise Cancelled if the current query was abandoned. `tokens` is the
+    LLM usage skipped by stopping here, for the tokens_saved metric.
+    """
+    token = current.get()
+    if token is not None and token.cancelled:
+        token.stop(stage, tokens)
+        raise Cancelled(token.reason)
+
+
+def wait_cancelled(seconds: float) -> bool:
+    """
+    Sleep for up to seconds; True (early) if the current query was
+    cancelled meanwhile. A plain sleep outside a query.
+    """
+    token = current.get()
+    if token is None:
+        time.sleep(seconds)
+        return False
+    return token.wait(seconds)
+
+
+async def until_cancelled(
+    token: CancelToken, awaitable: Awaitable, stage: Optional[str] = None
+):
+    """
+    Await awaitable, but give up as soon as the token is cancelled: the
+    awaiting task is cancelled (leaving the admission queue, dropping the
+    LlamaCloud request) and Cancelled is raised. `stage` names what was
+    being waited for; leave it out when the work runs in threads, whose
+    own checkpoints say where they stopped.
+    """
+    task = asyncio.ensure_future(awaitable)
+    if token.cancelled:
+        task.cancel()
+    token.callbacks.append(task.cancel)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not token.cancelled:
+            raise
+        if stage:
+            token.stop(stage)
+        raise Cancelled(token.reason) from None
+    finally:
+        token.callbacks.remove(task.cancel)
+
+
+async def watch_disconnect(request, token: CancelToken):
+    # The body has been read by now, so the next message only arrives
+    # when the client goes away
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            token.cancel("disconnect")
+            return
+
+
+class ActiveQueries:
+    """The running query of each anon_user_id, and cancellation metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}  # anon_user_id -> CancelToken
+        self.counters = {
+            "cancelled": 0,
+            "disconnect": 0,
+            "superseded": 0,
+            "tokens_saved": 0,
+            "llm_aborted": 0,
+            "writes_skipped": 0,
+        }
+        self.stages = Counter()
+
+    def begin(self, anon_user_id: str, request) -> CancelToken:
+        """
+        Token for a new query: supersedes the user's running one, watches
+        for a disconnect, and becomes the current token of this context.
+        """
+        token = CancelToken(self, anon_user_id)
+        current.set(token)
+        if not CANCEL_QUERIES:
+            return token  # never cancelled
+        with self.lock:
+            previous = self.tokens.get(anon_user_id)
+            self.tokens[anon_user_id] = token
+        if previous is not None and CANCEL_SUPERSEDED:
+            previous.cancel("superseded")
+        token.watcher = asyncio.ensure_future(watch_disconnect(request, token))
+        return token
+
+    def end(self, token: CancelToken):
+        """The query is done (answered or cancelled); safe to call twice."""
+        token.finished = True
+        if token.watcher is not None:
+            token.watcher.cancel()
+        with self.lock:
+            if self.tokens.get(token.user_id) is token:
+                del self.tokens[token.user_id]
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            if name in ("disconnect", "superseded"):
+                self.counters["cancelled"] += n
+            self.counters[name] += n
+
+    def stopped(self, stage: Optional[str], tokens: int):
+        with self.lock:
+            if stage:
+                self.stages[stage] += 1
+            self.counters["tokens_saved"] += tokens
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": CANCEL_QUERIES,
+                **self.counters,
+                "stopped_at": dict(self.stages),
+                "running": len(self.tokens),
+            }
+
+
+active_queries = ActiveQueries()
@@ -0,0 +1,9 @@
+"""
+Loads backend/.env. Most modules read their settings with os.getenv at
+import time, so entry points (main.py, rag_engine.py) import this before
+any other local module.
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,133 @@
+"""
+Course namespaces.
+Each course gets its own vector collection, PDF directory and S3 prefix, so
+a query only searches (and only keeps in memory) the course it is about.
+The original single-course layout is DEFAULT_COURSE, so existing
+deployments keep their collection and files where they already are.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+DEFAULT_COURSE = os.getenv("DEFAULT_COURSE", "default")
+# Per-course indexes kept loaded; the least recently used one is unloaded
+MAX_LOADED_COURSES = int(os.getenv("MAX_LOADED_COURSES", "4"))
+
+# Lowercase slug that fits a (versioned) Chroma collection name, URL path and
+# S3 key
+COURSE_ID_PATTERN = r"^[a-z0-9](?:[a-z0-9_-]{0,38}[a-z0-9])?$"
+
+
+def normalize_course(course_id: Optional[str]) -> str:
+    """None/"" -> DEFAULT_COURSE; raises ValueError for malformed ids."""
+    if not course_id:
+        return DEFAULT_COURSE
+    if not re.match(COURSE_ID_PATTERN, course_id):
+        raise ValueError(f"Invalid course id: {course_id!r}")
+    return course_id
+
+
+def collection_name(course_id: str, version: int = 0) -> str:
+    """Chroma collection of one index version (0 = the unversioned original)."""
+    name = "course_materials"
+    if course_id != DEFAULT_COURSE:
+        name += f"_{course_id}"
+    if version:
+        name += f"_v{version}"
+    return name
+
+
+def course_dir(base: str, course_id: str) -> Path:
+    """PDF directory for a course (the default course uses the base itself)."""
+    if course_id == DEFAULT_COURSE:
+        return Path(base)
+    return Path(base) / course_id
+
+
+def s3_prefix(course_id: str) -> str:
+    if course_id == DEFAULT_COURSE:
+        return "pdfs/"
+    return f"pdfs/{course_id}/"
+
+
+def list_courses(base: str, extra=()) -> list:
+    """
+    Courses with a PDF directory under base, plus the default course and
+    any `extra` ids (e.g. course folders found in S3).
+    """
+    courses = {DEFAULT_COURSE, *(c for c in extra if re.match(COURSE_ID_PATTERN, c))}
+    if Path(base).is_dir():
+        courses.update(
+            p.name
+            for p in Path(base).iterdir()
+            if p.is_dir() and re.match(COURSE_ID_PATTERN, p.name)
+        )
+    return sorted(courses)
+
+
+class CourseIndexes:
+    """
+    Lazily loaded per-course indexes with LRU unloading.
+    loader(course_id) builds the index of the course's active version (its
+    .version); requests already holding an unloaded or replaced index keep
+    using it until they finish.
+    """
+
+    def __init__(self, loader: Callable, max_loaded: int = MAX_LOADED_COURSES):
+        self.loader = loader
+        self.max_loaded = max(1, max_loaded)
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()  # course_id -> [index, last_used]
+        self.loads = 0
+        self.unloads = 0
+
+    def get(self, course_id: str, version: Optional[int] = None):
+        """
+        The course's index; given the active `version`, a loaded index of
+        another version (swapped by another process's ingest) is reloaded.
+        """
+        with self.lock:
+            entry = self.loaded.get(course_id)
+            if entry is None or version not in (None, entry[0].version):
+                # Opening a collection is cheap, so load under the lock
+                # rather than risk two copies of the same course
+                entry = self.loaded[course_id] = [self.loader(course_id), 0.0]
+                self.loads += 1
+                self._evict()
+            self.loaded.move_to_end(course_id)
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def put(self, course_id: str, index):
+        """Replace a course's loaded index (e.g. after a version swap)."""
+        with self.lock:
+            self.loaded[course_id] = [index, time.monotonic()]
+            self.loaded.move_to_end(course_id)
+            self._evict()
+
+    def _evict(self):
+        while len(self.loaded) > self.max_loaded:
+            course_id, (_, last_used) = self.loaded.popitem(last=False)
+            self.unloads += 1
+            print(
+                f"[RAG] Unloaded course {course_id} "
+                f"(idle {time.monotonic() - last_used:.0f}s)"
+            )
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "loaded": {
+                    course_id: {"idle_seconds": round(now - last_used, 1)}
+                    for course_id, (_, last_used) in self.loaded.items()
+                },
+                "max_loaded": self.max_loaded,
+                "loads": self.loads,
+                "unloads": self.unloads,
+            }
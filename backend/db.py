@@ -1,13 +1,17 @@
 import logging
+import os
 import sqlite3
+import threading
 import time
 
 # Set up logging
 logging.basicConfig(level=logging.ERROR)
 
 # Improved SQLite connection with better concurrency handling
+DB_PATH = os.getenv("CONVERSATIONS_DB", "conversations.db")
+
 conn = sqlite3.connect(
-    "conversations.db",
+    DB_PATH,
     check_same_thread=False,
     timeout=10.0,  # Wait up to 10 seconds for write locks
     isolation_level="DEFERRED",  # Better concurrent read performance
@@ -15,6 +19,9 @@ conn = sqlite3.connect(
 # Enable WAL mode for better concurrent access
 conn.execute("PRAGMA journal_mode=WAL")
 c = conn.cursor()
+# The connection is shared across threads; sqlite3 objects are not safe for
+# concurrent use, so every statement goes through this lock on its own cursor.
+db_lock = threading.Lock()
 
 # 1. Create table
 try:
@@ -42,16 +49,39 @@ except sqlite3.Error as e:
 def save_message(anon_user_id, role, content, mode):
     # ... (Keep existing logic) ...
     try:
-        c.execute(
-            "INSERT INTO conversations (anon_user_id, role, content, mode) VALUES (?, ?, ?, ?)",
-            (anon_user_id, role, content, mode),
-        )
-        conn.commit()
+        with db_lock:
+            conn.execute(
+                "INSERT INTO conversations (anon_user_id, role, content, mode) VALUES (?, ?, ?, ?)",
+                (anon_user_id, role, content, mode),
+            )
+            conn.commit()
     except sqlite3.Error as e:
-        conn.rollback()
+        with db_lock:
+            conn.rollback()
         logging.error("Error saving: %s", e)
 
 
+def save_exchange(anon_user_id, question, answer, mode):
+    """
+    Save a question and its answer in one transaction. Unlike save_message,
+    errors are raised so the caller can retry (see deferred.py).
+    """
+    with db_lock:
+        try:
+            conn.executemany(
+                "INSERT INTO conversations (anon_user_id, role, content, mode) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (anon_user_id, "user", question, mode),
+                    (anon_user_id, "assistant", answer, mode),
+                ],
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+
 def get_history(anon_user_id, limit=10):
     """
     Fetch only the most recent 'limit' messages.
@@ -59,17 +89,17 @@ def get_history(anon_user_id, limit=10):
     try:
         # 3. PERFORMANCE FIX: Use LIMIT in SQL
         # We sort DESC (newest first) to get the last 10, then Python reverses it back to normal order.
-        c.execute(
-            """
-            SELECT role, content, mode 
-            FROM conversations 
-            WHERE anon_user_id = ? 
-            ORDER BY id DESC 
-            LIMIT ?
-            """,
-            (anon_user_id, limit),
-        )
-        rows = c.fetchall()
+        with db_lock:
+            rows = conn.execute(
+                """
+                SELECT role, content, mode 
+                FROM conversations 
+                WHERE anon_user_id = ? 
+                ORDER BY id DESC 
+                LIMIT ?
+                """,
+                (anon_user_id, limit),
+            ).fetchall()
 
         # Reverse them back so they are in chronological order (Oldest -> Newest)
         history = [
@@ -0,0 +1,46 @@
+"""
+Post-response work for the query endpoints: saving the exchange to the
+conversation history and storing the answer in the answer cache. These
+writes no longer hold the answer back. They run as Starlette background
+tasks after the last byte is sent, and failures such as a locked SQLite
+file are retried with backoff before being logged and dropped.
+"""
+
+import asyncio
+import os
+import random
+
+from starlette.background import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+
+DEFERRED_RETRIES = int(os.getenv("DEFERRED_RETRIES", "3"))
+DEFERRED_BACKOFF = float(os.getenv("DEFERRED_BACKOFF", "0.2"))
+
+counters = {"done": 0, "retries": 0, "failed": 0}
+
+
+async def run_with_retry(name: str, fn, *args):
+    """fn(*args) in the threadpool, retried on any exception."""
+    for attempt in range(DEFERRED_RETRIES + 1):
+        try:
+            await run_in_threadpool(fn, *args)
+            counters["done"] += 1
+            return
+        except Exception as e:
+            if attempt == DEFERRED_RETRIES:
+                counters["failed"] += 1
+                print(f"[DEFERRED] {name} failed for good: {e}")
+                return
+            counters["retries"] += 1
+            delay = random.uniform(0, DEFERRED_BACKOFF * 2**attempt)
+            print(f"[DEFERRED] {name} failed ({e}), retry in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def defer(tasks: BackgroundTasks, name: str, fn, *args):
+    """Queue fn(*args) to run, with retries, once the response is sent."""
+    tasks.add_task(run_with_retry, name, fn, *args)
+
+
+def deferred_stats() -> dict:
+    return dict(counters)
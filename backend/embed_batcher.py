@@ -0,0 +1,143 @@
+"""
+Micro-batching of query embeddings (EMBED_MICROBATCH=true).
+Concurrent /api/query requests each need one bge-small forward pass. Run one
+at a time from many threadpool threads, these contend for the model's
+threads and leave the vector units mostly idle. With micro-batching, the
+requests hand their text to a single embedding thread, which embeds
+everything queued in one batched call (rag_engine.embed_queries) and gives
+each caller back its own vector.
+
+Batches form by themselves while the model is busy. While traffic is
+concurrent (the last batch held more than one query), the thread also waits
+up to EMBED_BATCH_WAIT_MS for stragglers. A lone request never waits.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List
+
+EMBED_MICROBATCH = os.getenv("EMBED_MICROBATCH", "true").lower() == "true"
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch: int = EMBED_BATCH_MAX,
+        wait_ms: float = EMBED_BATCH_WAIT_MS,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch = max(1, max_batch)
+        self.wait = wait_ms / 1000
+        self.pending = queue.SimpleQueue()  # (text, Future, enqueued at)
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+        self.lock = threading.Lock()
+        self.last_size = 1
+        self.counters = {"batches": 0, "queries": 0, "errors": 0}
+        self.sizes = deque(maxlen=1000)
+        self.queue_waits = deque(maxlen=1000)  # enqueue -> batch start
+        self.batch_times = deque(maxlen=1000)  # model call
+
+    def embed(self, text: str) -> List[float]:
+        """One query's embedding, computed in a batch with whoever else asks."""
+        if self.thread is None:
+            self._start()
+        future = Future()
+        self.pending.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="embed-batcher", daemon=True
+                )
+                self.thread.start()
+
+    def _collect(self) -> list:
+        batch = [self.pending.get()]
+        # Whatever queued up during the previous batch
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if self.last_size > 1 and self.wait > 0:
+            deadline = time.perf_counter() + self.wait
+            while len(batch) < self.max_batch:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=left))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                vectors = self.embed_batch([text for text, _, _ in batch])
+                if len(vectors) != len(batch):
+                    # zip() would leave the unmatched callers waiting forever
+                    raise ValueError(
+                        f"Embedded {len(vectors)} vectors for {len(batch)} queries"
+                    )
+            except Exception as e:
+                with self.lock:
+                    self.counters["errors"] += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self.lock:
+                self.last_size = len(batch)
+                self.counters["batches"] += 1
+                self.counters["queries"] += len(batch)
+                self.sizes.append(len(batch))
+                self.batch_times.append(finished - started)
+                self.queue_waits.extend(started - queued for _, _, queued in batch)
+
+    def stats(self) -> dict:
+        with self.lock:
+            sizes = list(self.sizes)
+            waits = sorted(self.queue_waits)
+            batch_times = sorted(self.batch_times)
+            counters = dict(self.counters)
+
+        def pct(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+        return {
+            **counters,
+            "max_batch": self.max_batch,
+            "wait_ms": self.wait * 1000,
+            "mean_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0,
+            # Share of max_batch slots used, over recent batches
+            "fill_rate": (
+                round(sum(sizes) / (len(sizes) * self.max_batch), 3) if sizes else 0
+            ),
+            # Latency batching adds: time queued before the batch started
+            "queue_wait_ms": {
+                "p50": round(1000 * pct(waits, 0.50), 2),
+                "p95": round(1000 * pct(waits, 0.95), 2),
+                "max": round(1000 * waits[-1], 2) if waits else 0,
+            },
+            "batch_ms": {
+                "p50": round(1000 * pct(batch_times, 0.50), 2),
+                "p95": round(1000 * pct(batch_times, 0.95), 2),
+            },
+        }
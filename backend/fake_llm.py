@@ -0,0 +1,156 @@
+"""
+Offline stand-ins for the Groq LLM and the HuggingFace embedding model.
+Used by the benchmark harness and for running the backend without API keys
+(LLM_PROVIDER=fake / EMBED_PROVIDER=fake).
+"""
+
+import hashlib
+import math
+import os
+import re
+import time
+from typing import Any, List, Sequence
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import (
+    llm_chat_callback,
+    llm_completion_callback,
+)
+from llama_index.core.llms.custom import CustomLLM
+
+WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+
+def _stable_hash(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16)
+
+
+class FakeLLM(CustomLLM):
+    """
+    Deterministic LLM with configurable latency and token rate.
+    The same prompt always yields the same answer, so benchmark runs are
+    comparable between commits.
+    """
+
+    model_name: str = "fake-llm"
+    latency_ms: float = 0.0
+    tokens_per_sec: float = 0.0
+    answer_tokens: int = 120
+    context_window: int = 8192
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        return cls(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "0")),
+            tokens_per_sec=float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "0")),
+            answer_tokens=int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "120")),
+        )
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.answer_tokens,
+            model_name=self.model_name,
+        )
+
+    def _answer_tokens(self, prompt: str) -> List[str]:
+        """Build an answer from words in the prompt, picked by a seeded walk."""
+        words = WORD_RE.findall(prompt) or ["answer"]
+        seed = _stable_hash(prompt)
+        tokens = []
+        for i in range(self.answer_tokens):
+            seed = (seed * 6364136223846793005 + 1442695040888963407) % (2**64)
+            tokens.append(words[seed % len(words)])
+        return tokens
+
+    def _sleep_for(self, n_tokens: int) -> None:
+        delay = self.latency_ms / 1000
+        if self.tokens_per_sec > 0:
+            delay += n_tokens / self.tokens_per_sec
+        if delay > 0:
+            time.sleep(delay)
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        tokens = self._answer_tokens(prompt)
+        self._sleep_for(len(tokens))
+        return CompletionResponse(text=" ".join(tokens))
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        tokens = self._answer_tokens(prompt)
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+        text = ""
+        for token in tokens:
+            if self.tokens_per_sec > 0:
+                time.sleep(1 / self.tokens_per_sec)
+            delta = token if not text else f" {token}"
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        prompt = "\n".join(str(m.content) for m in messages)
+        response = self.complete(prompt, formatted=True)
+        return ChatResponse(
+            message=ChatMessage(role="assistant", content=response.text)
+        )
+
+    @llm_chat_callback()
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        prompt = "\n".join(str(m.content) for m in messages)
+        for chunk in self.stream_complete(prompt, formatted=True):
+            yield ChatResponse(
+                message=ChatMessage(role="assistant", content=chunk.text),
+                delta=chunk.delta,
+            )
+
+
+class FakeEmbedding(BaseEmbedding):
+    """
+    Hashed bag-of-words embedding with the same dimension as bge-small.
+    Cheap and deterministic, but texts sharing words still land close
+    together, so retrieval results are meaningful enough for timing runs.
+    """
+
+    model_name: str = "fake-embedding"
+    embed_dim: int = 384
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.embed_dim
+        for word in WORD_RE.findall(text.lower()):
+            h = _stable_hash(word)
+            vector[h % self.embed_dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        return [self._embed(q) for q in queries]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
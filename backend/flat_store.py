@@ -0,0 +1,470 @@
+"""
+Memory-mapped flat (exact search) vector store for small course corpora.
+A course is tens of thousands of 384-dim bge-small vectors; an exact,
+vectorized dot product over an mmap'd matrix beats Chroma's HNSW + SQLite
+at that size and needs no index build. Selected with VECTOR_BACKEND=flat.
+
+On-disk layout (one "generation" of files, named in manifest.json):
+    vectors-<gen>.bin   N x dim float32/float16, L2-normalised rows
+    files-<gen>.bin     N uint32 file ids (index into manifest "files")
+    offsets-<gen>.bin   N uint64 byte offsets into nodes-<gen>.jsonl
+    nodes-<gen>.jsonl   one compact JSON record per row (id, text, metadata)
+
+Adds append to the current generation and then publish the new row count by
+atomically replacing manifest.json; deletes compact into a new generation.
+Readers only ever see complete rows, so any number of processes can map the
+same directory read-only; writers serialise on a lock file.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import (
+    BaseNode,
+    NodeRelationship,
+    RelatedNodeInfo,
+    TextNode,
+)
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+# Rows scored per block, so float16 matrices never get fully upcast
+BLOCK_ROWS = 65536
+KINDS = ("vectors", "files", "offsets", "nodes")
+
+
+def filter_predicate(filters: MetadataFilters) -> Callable[[dict], bool]:
+    """Python predicate over a metadata dict for EQ/NE/IN/NIN filters."""
+    checks = []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            checks.append(filter_predicate(f))
+        elif f.operator == FilterOperator.EQ:
+            checks.append(lambda m, f=f: m.get(f.key) == f.value)
+        elif f.operator == FilterOperator.NE:
+            checks.append(lambda m, f=f: m.get(f.key) != f.value)
+        elif f.operator == FilterOperator.IN:
+            checks.append(lambda m, f=f: m.get(f.key) in f.value)
+        elif f.operator == FilterOperator.NIN:
+            checks.append(lambda m, f=f: m.get(f.key) not in f.value)
+        else:
+            raise NotImplementedError(f"Filter operator {f.operator} not supported")
+
+    if filters.condition == FilterCondition.OR:
+        return lambda m: any(check(m) for check in checks)
+    return lambda m: all(check(m) for check in checks)
+
+
+class Snapshot(NamedTuple):
+    """One consistent view of the index; swapped atomically on refresh."""
+
+    mtime: Optional[int]
+    manifest: dict
+    vectors: np.ndarray
+    file_ids: np.ndarray
+    offsets: np.ndarray
+
+
+class FlatVectorStore(BasePydanticVectorStore):
+    """Exact cosine-similarity search over an mmap'd embedding matrix."""
+
+    stores_text: bool = True
+    path: str
+    dtype: str = "float32"
+
+    _lock: threading.Lock = PrivateAttr()
+    _snapshot: Optional[Snapshot] = PrivateAttr(default=None)
+
+    def __init__(self, path: str, dtype: str = "float32", **kwargs: Any):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported flat index dtype: {dtype}")
+        super().__init__(path=str(path), dtype=dtype, **kwargs)
+        self._lock = threading.Lock()
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+        self._refresh()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FlatVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    # -- files ---------------------------------------------------------------
+
+    def _file(self, kind: str, generation: int) -> Path:
+        suffix = "jsonl" if kind == "nodes" else "bin"
+        return Path(self.path) / f"{kind}-{generation}.{suffix}"
+
+    def _write_manifest(self, manifest: dict):
+        tmp = Path(self.path) / "manifest.json.tmp"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, Path(self.path) / "manifest.json")
+
+    def _refresh(self, force: bool = False) -> Snapshot:
+        """
+        Current snapshot, remapped if a writer published new rows. Writers
+        force a re-read: two publishes within one mtime tick look unchanged.
+        """
+        manifest_path = Path(self.path) / "manifest.json"
+        try:
+            mtime = manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        snapshot = self._snapshot
+        if not force and snapshot is not None and snapshot.mtime == mtime:
+            return snapshot
+
+        if mtime is None:
+            manifest = {
+                "generation": 0,
+                "count": 0,
+                "dim": 0,
+                "dtype": self.dtype,
+                "files": [],
+            }
+        else:
+            manifest = json.loads(manifest_path.read_text())
+
+        count, dim, gen = manifest["count"], manifest["dim"], manifest["generation"]
+        if count == 0:
+            arrays = (
+                np.zeros((0, dim), dtype=manifest["dtype"]),
+                np.zeros(0, dtype=np.uint32),
+                np.zeros(0, dtype=np.uint64),
+            )
+        else:
+            arrays = tuple(
+                np.memmap(self._file(kind, gen), dtype=dtype, mode="r", shape=shape)
+                for kind, dtype, shape in (
+                    ("vectors", manifest["dtype"], (count, dim)),
+                    ("files", np.uint32, (count,)),
+                    ("offsets", np.uint64, (count,)),
+                )
+            )
+        self._snapshot = Snapshot(mtime, manifest, *arrays)
+        return self._snapshot
+
+    # -- records -------------------------------------------------------------
+
+    @staticmethod
+    def _record(node: BaseNode) -> dict:
+        record = {
+            "id": node.node_id,
+            "doc": node.ref_doc_id,
+            "text": node.get_content(),
+            "metadata": node.metadata,
+        }
+        # Only stored when set, to keep the sidecar compact
+        if node.excluded_llm_metadata_keys:
+            record["xl"] = node.excluded_llm_metadata_keys
+        if node.excluded_embed_metadata_keys:
+            record["xe"] = node.excluded_embed_metadata_keys
+        return record
+
+    @staticmethod
+    def _to_node(record: dict) -> TextNode:
+        node = TextNode(
+            id_=record["id"],
+            text=record["text"],
+            metadata=record["metadata"],
+            excluded_llm_metadata_keys=record.get("xl", []),
+            excluded_embed_metadata_keys=record.get("xe", []),
+        )
+        if record["doc"]:
+            node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(
+                node_id=record["doc"]
+            )
+        return node
+
+    def _read_records(self, snapshot: Snapshot, rows) -> List[dict]:
+        path = self._file("nodes", snapshot.manifest["generation"])
+        records = []
+        with open(path, "rb") as f:
+            for row in rows:
+                f.seek(int(snapshot.offsets[row]))
+                records.append(json.loads(f.readline()))
+        return records
+
+    def _iter_records(self, snapshot: Snapshot) -> Iterator[dict]:
+        """All published records in row order (sequential read)."""
+        path = self._file("nodes", snapshot.manifest["generation"])
+        if not snapshot.manifest["count"]:
+            return
+        with open(path, "rb") as f:
+            for _ in range(snapshot.manifest["count"]):
+                yield json.loads(f.readline())
+
+    # -- writes --------------------------------------------------------------
+
+    @contextmanager
+    def _writing(self):
+        """Exclusive across threads and processes sharing this directory."""
+        with self._lock, open(Path(self.path) / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self._refresh(force=True)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, records: List[dict], vectors: np.ndarray, manifest: dict):
+        files = manifest["files"]
+        file_index = {name: i for i, name in enumerate(files)}
+        file_ids = []
+        for record in records:
+            name = record["metadata"].get("file_name", "")
+            if name not in file_index:
+                file_index[name] = len(files)
+                files.append(name)
+            file_ids.append(file_index[name])
+
+        gen = manifest["generation"]
+        nodes_path = self._file("nodes", gen)
+        offset = nodes_path.stat().st_size if nodes_path.exists() else 0
+        offsets = []
+        with open(nodes_path, "ab") as f:
+            for record in records:
+                line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+                offsets.append(offset)
+                offset += len(line)
+                f.write(line)
+
+        for kind, array in (
+            ("vectors", vectors.astype(manifest["dtype"])),
+            ("files", np.asarray(file_ids, dtype=np.uint32)),
+            ("offsets", np.asarray(offsets, dtype=np.uint64)),
+        ):
+            with open(self._file(kind, gen), "ab") as f:
+                f.write(array.tobytes())
+
+        manifest["count"] += len(records)
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = np.asarray([n.get_embedding() for n in nodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        with self._writing() as snapshot:
+            manifest = json.loads(json.dumps(snapshot.manifest))
+            if not manifest["dim"]:
+                manifest["dim"] = vectors.shape[1]
+            elif manifest["dim"] != vectors.shape[1]:
+                raise ValueError(
+                    f"Embedding dim {vectors.shape[1]} != index dim {manifest['dim']}"
+                )
+            self._append([self._record(n) for n in nodes], vectors, manifest)
+            self._write_manifest(manifest)
+            self._refresh(force=True)
+        return [n.node_id for n in nodes]
+
+    def _compact(self, snapshot: Snapshot, keep: np.ndarray):
+        """Rewrite the rows where keep is True into a new generation."""
+        old_gen = snapshot.manifest["generation"]
+        manifest = {
+            **snapshot.manifest,
+            "generation": old_gen + 1,
+            "count": 0,
+            "files": [],
+        }
+        for kind in KINDS:
+            # Leftovers from an interrupted compaction
+            self._file(kind, old_gen + 1).unlink(missing_ok=True)
+
+        batch, rows = [], []
+        for row, record in enumerate(self._iter_records(snapshot)):
+            if keep[row]:
+                batch.append(record)
+                rows.append(row)
+            if len(batch) == BLOCK_ROWS:
+                self._append(batch, np.asarray(snapshot.vectors[rows]), manifest)
+                batch, rows = [], []
+        if batch:
+            self._append(batch, np.asarray(snapshot.vectors[rows]), manifest)
+        self._write_manifest(manifest)
+        self._refresh(force=True)
+
+        for kind in KINDS:
+            # Readers still holding the old maps keep working on POSIX
+            self._file(kind, old_gen).unlink(missing_ok=True)
+
+    def _delete_where(self, predicate: Callable[[dict], bool]) -> int:
+        with self._writing() as snapshot:
+            keep = np.fromiter(
+                (not predicate(r) for r in self._iter_records(snapshot)),
+                dtype=bool,
+                count=snapshot.manifest["count"],
+            )
+            removed = int(len(keep) - keep.sum())
+            if removed:
+                self._compact(snapshot, keep)
+            return removed
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._delete_where(lambda record: record["doc"] == ref_doc_id)
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        ids = set(node_ids or [])
+        matches = filter_predicate(filters) if filters else None
+
+        def predicate(record):
+            if ids and record["id"] not in ids:
+                return False
+            return matches(record["metadata"]) if matches else bool(ids)
+
+        self._delete_where(predicate)
+
+    def delete_file(self, file_name: str) -> int:
+        """Drop every chunk of file_name; returns how many were removed."""
+        with self._writing() as snapshot:
+            files = snapshot.manifest["files"]
+            if file_name not in files:
+                return 0
+            keep = snapshot.file_ids != files.index(file_name)
+            removed = int(len(keep) - keep.sum())
+            if removed:
+                self._compact(snapshot, keep)
+            return removed
+
+    def clear(self) -> None:
+        with self._writing() as snapshot:
+            self._compact(snapshot, np.zeros(snapshot.manifest["count"], dtype=bool))
+
+    # -- reads ---------------------------------------------------------------
+
+    def count(self) -> int:
+        return self._refresh().manifest["count"]
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """(node, stored unit vector) for every row, in row order."""
+        snapshot = self._refresh()
+        for row, record in enumerate(self._iter_records(snapshot)):
+            yield self._to_node(record), snapshot.vectors[row]
+
+    def _file_mask(self, snapshot: Snapshot, filters: MetadataFilters):
+        """Row mask for filters that only touch file_name, else None."""
+        files = snapshot.manifest["files"]
+        masks = []
+        for f in filters.filters:
+            if isinstance(f, MetadataFilters) or f.key != "file_name":
+                return None
+            values = f.value if isinstance(f.value, list) else [f.value]
+            mask = np.isin(
+                snapshot.file_ids, [files.index(v) for v in values if v in files]
+            )
+            if f.operator in (FilterOperator.EQ, FilterOperator.IN):
+                masks.append(mask)
+            elif f.operator in (FilterOperator.NE, FilterOperator.NIN):
+                masks.append(~mask)
+            else:
+                return None
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    @staticmethod
+    def _scores(snapshot: Snapshot, query: np.ndarray) -> np.ndarray:
+        """Row scores for a (dim,) query, or a (dim, Q) matrix of queries."""
+        vectors = snapshot.vectors
+        scores = np.empty((len(vectors), *query.shape[1:]), dtype=np.float32)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = np.asarray(vectors[start : start + BLOCK_ROWS], dtype=np.float32)
+            scores[start : start + len(block)] = block @ query
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        snapshot = self._refresh()
+        if not snapshot.manifest["count"] or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        vector = np.asarray(query.query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        scores = self._scores(snapshot, vector)
+        top_k = min(query.similarity_top_k, len(scores))
+
+        metadata_match = None
+        if query.filters and query.filters.filters:
+            mask = self._file_mask(snapshot, query.filters)
+            if mask is None:
+                metadata_match = filter_predicate(query.filters)
+            else:
+                scores[~mask] = -np.inf
+        doc_ids = set(query.doc_ids or [])
+        node_ids = set(query.node_ids or [])
+
+        if metadata_match is None and not doc_ids and not node_ids:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows = candidates[np.argsort(-scores[candidates])]
+            rows = [row for row in rows if np.isfinite(scores[row])]
+            records = self._read_records(snapshot, rows)
+        else:
+            # Conditions outside the row arrays: walk rows best-first
+            rows, records = [], []
+            for row in np.argsort(-scores):
+                if len(records) == top_k or not np.isfinite(scores[row]):
+                    break
+                record = self._read_records(snapshot, [row])[0]
+                if (
+                    (not doc_ids or record["doc"] in doc_ids)
+                    and (not node_ids or record["id"] in node_ids)
+                    and (metadata_match is None or metadata_match(record["metadata"]))
+                ):
+                    rows.append(row)
+                    records.append(record)
+
+        return VectorStoreQueryResult(
+            nodes=[self._to_node(r) for r in records],
+            similarities=[float(scores[row]) for row in rows],
+            ids=[r["id"] for r in records],
+        )
+
+    def query_batch(
+        self, embeddings: Sequence[Sequence[float]], top_k: int
+    ) -> List[VectorStoreQueryResult]:
+        """Unfiltered top_k for many queries in one pass over the matrix."""
+        snapshot = self._refresh()
+        if not snapshot.manifest["count"]:
+            return [
+                VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+                for _ in embeddings
+            ]
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+        scores = self._scores(snapshot, queries.T)
+        top_k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+
+        results = []
+        for q in range(scores.shape[1]):
+            column = scores[:, q]
+            rows = candidates[:, q][np.argsort(-column[candidates[:, q]])]
+            records = self._read_records(snapshot, rows)
+            results.append(
+                VectorStoreQueryResult(
+                    nodes=[self._to_node(r) for r in records],
+                    similarities=[float(column[row]) for row in rows],
+                    ids=[r["id"] for r in records],
+                )
+            )
+        return results
@@ -0,0 +1,238 @@
+"""
+HTTP caching and compression for read endpoints and lecture PDFs.
+  - conditional_json(): JSON responses with an ETag (and optionally a
+    Last-Modified) that answer a matching If-None-Match / If-Modified-Since
+    with an empty 304, so /api/files and /api/history polls cost a header.
+  - CompressionMiddleware: brotli (when the `brotli` package is installed)
+    or gzip for single-body JSON responses. Streams (SSE, NDJSON) and PDFs
+    pass through untouched.
+  - PDFFiles: the /pdfs mount. StaticFiles already does ETag/Last-Modified
+    304s and Range requests (pdf.js fetches big decks in pieces); this adds
+    Cache-Control. A URL carrying the file's content hash (?v=..., handed
+    out by /api/files) is immutable for a year; a bare URL must revalidate.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import stat
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTTP_COMPRESSION = os.getenv("HTTP_COMPRESSION", "true").lower() == "true"
+# Smaller bodies aren't worth the CPU (and may grow)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Cache lifetime of content-hashed PDF URLs
+PDF_CACHE_MAX_AGE = int(os.getenv("PDF_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+COMPRESSIBLE_TYPES = ("application/json",)
+
+
+def json_etag(payload) -> str:
+    """
+    Weak validator: the same JSON compressed differently (or not at all) is
+    still the same representation.
+    """
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return f'W/"{hashlib.sha256(body.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+def conditional_json(
+    request: Request,
+    payload,
+    cache_control: str = "no-cache",
+    last_modified: Optional[float] = None,
+) -> Response:
+    """
+    JSONResponse with validators, or a 304 when the client's copy is current.
+    If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2).
+    """
+    headers = {"ETag": json_etag(payload), "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match:
+        not_modified = etag_matches(if_none_match, headers["ETag"])
+    elif if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            since = 0
+        not_modified = int(last_modified) <= since
+    else:
+        not_modified = False
+
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+
+# (path, mtime_ns, size) -> content hash
+_pdf_versions = {}
+_pdf_versions_lock = threading.Lock()
+
+
+def pdf_version(path: Path) -> str:
+    """
+    Short content hash of a PDF, re-read only when its mtime or size
+    changes. Blocking; call from a worker thread.
+    """
+    info = path.stat()
+    key = (str(path), info.st_mtime_ns, info.st_size)
+    with _pdf_versions_lock:
+        if key in _pdf_versions:
+            return _pdf_versions[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    version = digest.hexdigest()[:16]
+    with _pdf_versions_lock:
+        # Drop hashes of older versions of the same file
+        for old in [k for k in _pdf_versions if k[0] == key[0]]:
+            del _pdf_versions[old]
+        _pdf_versions[key] = version
+    return version
+
+
+def pdf_url(base_dir: str, path: Path) -> str:
+    """Content-hashed /pdfs URL of a file under base_dir."""
+    relative = path.relative_to(base_dir).as_posix()
+    return f"/pdfs/{relative}?v={pdf_version(path)}"
+
+
+class PDFFiles(StaticFiles):
+    """StaticFiles plus Cache-Control for (content-hashed) PDF URLs."""
+
+    def _hash_matches(self, path: str, version: str) -> bool:
+        full_path, stat_result = self.lookup_path(path)
+        return (
+            stat_result is not None
+            and stat.S_ISREG(stat_result.st_mode)
+            and version == pdf_version(Path(full_path))
+        )
+
+    async def get_response(self, path: str, scope):
+        # Hashing a PDF reads all of it, so it stays off the event loop
+        version = Request(scope).query_params.get("v")
+        scope["pdf_immutable"] = bool(version) and await run_in_threadpool(
+            self._hash_matches, path, version
+        )
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if scope.get("pdf_immutable"):
+            response.headers["Cache-Control"] = (
+                f"public, max-age={PDF_CACHE_MAX_AGE}, immutable"
+            )
+        else:
+            # Stale or missing hash: the file may change under this URL
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br if acceptable and available, else gzip, else None (q=0 excluded)."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI, compressing only complete (single-message) JSON bodies, so
+    token streams are never buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not HTTP_COMPRESSION:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                content_type = headers.get("content-type", "")
+                if (
+                    content_type.startswith(COMPRESSIBLE_TYPES)
+                    and "content-encoding" not in headers
+                ):
+                    start = message  # decide once the body arrives
+                    return
+                await send(message)
+                return
+
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            held, start = start, None
+            body = message.get("body", b"")
+            held["headers"] = list(held.get("headers", []))
+            headers = MutableHeaders(raw=held["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if not message.get("more_body") and len(body) >= COMPRESS_MIN_BYTES:
+                body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                if headers.get("etag", "").startswith('"'):
+                    # A strong ETag names the exact bytes; these differ
+                    headers["ETag"] = "W/" + headers["etag"]
+                message = {**message, "body": body}
+            await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
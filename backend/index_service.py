@@ -0,0 +1,321 @@
+"""
+Shared retrieval/embedding service for multi-worker deployments.
+Without it every uvicorn worker opens its own Chroma client and loads its own
+copy of the embedding model, and an ingestion in one worker leaves the others
+with a stale index. With INDEX_SERVICE set, rag_engine forwards retrieval,
+ingestion, deletion and stats to this single process over a local socket,
+and every worker subscribes to index-version broadcasts so it learns about
+new ingestions straight away.
+
+Usage:
+    python index_service.py --address /tmp/tutorbot-index.sock
+    INDEX_SERVICE=/tmp/tutorbot-index.sock uvicorn main:app --workers 4
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+import uuid
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Callable, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Unix socket path, or host:port for TCP; empty = in-process index
+INDEX_SERVICE = os.getenv("INDEX_SERVICE", "")
+# Required for TCP: the protocol unpickles whatever an authenticated peer sends
+INDEX_SERVICE_AUTHKEY = os.getenv("INDEX_SERVICE_AUTHKEY", "")
+# Connections each worker keeps open to the service
+INDEX_CLIENT_POOL = int(os.getenv("INDEX_CLIENT_POOL", "8"))
+
+
+class IndexServiceError(Exception):
+    """The index service reported an error for a request."""
+
+
+def parse_address(address: str):
+    """'host:port' -> TCP address tuple, anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def authkey_for(address) -> bytes:
+    """
+    INDEX_SERVICE_AUTHKEY, or a fixed key for Unix sockets, which only this
+    user can connect to. TCP without an explicit key is refused.
+    """
+    if INDEX_SERVICE_AUTHKEY:
+        return INDEX_SERVICE_AUTHKEY.encode()
+    if isinstance(address, tuple):
+        raise IndexServiceError(
+            "INDEX_SERVICE_AUTHKEY must be set to use the index service over TCP"
+        )
+    return b"tutorbot"
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+
+class IndexServer:
+    """Owns the course indexes and embedding model; one thread per connection."""
+
+    def __init__(self, address: str):
+        self.address = parse_address(address)
+        self.authkey = authkey_for(self.address)  # fail before loading anything
+        # Load the real index in this process, not another client of ourselves
+        os.environ.pop("INDEX_SERVICE", None)
+        import index_snapshot
+        import rag_engine
+
+        self.rag = rag_engine
+        self.snapshots = index_snapshot
+        index_snapshot.bootstrap()
+        # The version restarts at 0 with the service; the epoch tells clients
+        # it did, so nothing they cached for an old version 0 is reused
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.write_lock = threading.Lock()  # ingest/delete one at a time
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+
+    def _serialize(self, n) -> dict:
+        return {
+            "id": n.node.node_id,
+            "text": n.node.get_content(),
+            "metadata": {
+                **n.node.metadata,
+                "resolved_page": self.rag.resolve_page_label(n),
+            },
+            # Keep the reader's exclusions so the LLM prompt is unchanged
+            "excluded_llm_metadata_keys": [
+                *n.node.excluded_llm_metadata_keys,
+                "resolved_page",
+            ],
+            "score": n.score,
+        }
+
+    def retrieve(self, query: str, top_k: int, course_id: str) -> List[dict]:
+        return [self._serialize(n) for n in self.rag.retrieve(query, top_k, course_id)]
+
+    def retrieve_batch(
+        self, queries: List[str], top_k: int, course_id: str
+    ) -> List[List[dict]]:
+        return [
+            [self._serialize(n) for n in nodes]
+            for nodes in self.rag.retrieve_batch(queries, top_k, course_id)
+        ]
+
+    def ingest(self, course_id: str) -> dict:
+        with self.write_lock:
+            result = self.rag.ingest_pdfs(course_id)
+            self.bump_version()
+        if result.get("status") == "success" and self.snapshots.SNAPSHOT_AFTER_INGEST:
+            threading.Thread(
+                target=self.publish_snapshot, args=(course_id,), daemon=True
+            ).start()
+        return result
+
+    def publish_snapshot(self, course_id: str):
+        if not self.rag.is_s3_enabled():
+            return
+        try:
+            self.snapshots.publish_snapshot(course_id)
+        except Exception as e:
+            print(f"[INDEX] Snapshot of {course_id} failed: {e}")
+
+    def delete(self, filename: str, course_id: str) -> bool:
+        with self.write_lock:
+            result = self.rag.delete_pdf_from_database(filename, course_id)
+            self.bump_version()
+        return result
+
+    def rollback(self, course_id: str, version) -> dict:
+        with self.write_lock:
+            result = self.rag.rollback_index(course_id, version)
+            self.bump_version()
+        return result
+
+    def stats(self, course_id: str) -> dict:
+        return self.rag.get_index_stats(course_id)
+
+    def stamp(self) -> tuple:
+        return (self.epoch, self.version)
+
+    def bump_version(self):
+        self.version += 1
+        print(f"[INDEX] Index version {self.version}, notifying subscribers")
+        with self.subscribers_lock:
+            alive = []
+            for conn in self.subscribers:
+                try:
+                    conn.send(self.stamp())
+                    alive.append(conn)
+                except (OSError, EOFError):
+                    conn.close()
+            self.subscribers = alive
+
+    def handle(self, conn):
+        ops = {
+            "retrieve": self.retrieve,
+            "retrieve_batch": self.retrieve_batch,
+            "ingest": self.ingest,
+            "delete": self.delete,
+            "stats": self.stats,
+            "rollback": self.rollback,
+            "versions": self.rag.get_index_versions,
+            "version": lambda: self.version,
+            "courses": self.rag.courses.stats,
+        }
+        try:
+            while True:
+                op, args = conn.recv()
+                if op == "subscribe":
+                    # The connection becomes a one-way version feed
+                    with self.subscribers_lock:
+                        conn.send(self.stamp())
+                        self.subscribers.append(conn)
+                    return
+                try:
+                    conn.send(("ok", ops[op](*args), self.stamp()))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}", self.stamp()))
+        except (EOFError, OSError):
+            conn.close()
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and Path(self.address).exists():
+            Path(self.address).unlink()  # stale socket from a previous run
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if isinstance(self.address, str):
+                os.chmod(self.address, 0o600)
+            print(f"[INDEX] Serving shared index on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"[INDEX] Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Client (used by rag_engine inside each worker)
+# ---------------------------------------------------------------------------
+
+
+class IndexClient:
+    """Thread-safe client with a small connection pool and a version feed."""
+
+    def __init__(self, address: str, pool_size: int = INDEX_CLIENT_POOL):
+        self.address = parse_address(address)
+        self.authkey = authkey_for(self.address)
+        self.pool = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.stamp = (None, 0)  # (service epoch, index version)
+        self.listeners: List[Callable[[int], None]] = []
+
+    def _connect(self):
+        return Client(self.address, authkey=self.authkey)
+
+    def call(self, op: str, *args):
+        with self.slots:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                try:
+                    conn.send((op, args))
+                    status, result, stamp = conn.recv()
+                except (EOFError, OSError):
+                    # Service restarted: retry once on a fresh connection
+                    conn.close()
+                    conn = self._connect()
+                    conn.send((op, args))
+                    status, result, stamp = conn.recv()
+            except BaseException:
+                # Half-sent or unread: the connection can't be reused
+                conn.close()
+                raise
+            else:
+                self.pool.put(conn)
+
+        self._set_stamp(stamp)
+        if status != "ok":
+            raise IndexServiceError(result)
+        return result
+
+    @staticmethod
+    def _to_node(n: dict):
+        from llama_index.core.schema import NodeWithScore, TextNode
+
+        return NodeWithScore(
+            node=TextNode(
+                id_=n["id"],
+                text=n["text"],
+                metadata=n["metadata"],
+                excluded_llm_metadata_keys=n["excluded_llm_metadata_keys"],
+            ),
+            score=n["score"],
+        )
+
+    def retrieve(self, query: str, top_k: int, course_id: str) -> list:
+        return [
+            self._to_node(n) for n in self.call("retrieve", query, top_k, course_id)
+        ]
+
+    def retrieve_batch(self, queries: List[str], top_k: int, course_id: str) -> list:
+        return [
+            [self._to_node(n) for n in nodes]
+            for nodes in self.call("retrieve_batch", queries, top_k, course_id)
+        ]
+
+    @property
+    def version(self) -> int:
+        return self.stamp[1]
+
+    def _set_stamp(self, stamp: tuple):
+        if stamp != self.stamp:
+            self.stamp = stamp
+            for listener in self.listeners:
+                listener(stamp[1])
+
+    def subscribe(self):
+        """Follow the service's index version in a background thread."""
+
+        def follow():
+            while True:
+                try:
+                    conn = self._connect()
+                    conn.send(("subscribe", ()))
+                    while True:
+                        self._set_stamp(conn.recv())
+                except (EOFError, OSError) as e:
+                    print(f"[INDEX] Lost index service feed ({e}), reconnecting...")
+                    time.sleep(1)
+
+        threading.Thread(target=follow, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared index service")
+    parser.add_argument(
+        "--address",
+        default=INDEX_SERVICE or "/tmp/tutorbot-index.sock",
+        help="Unix socket path or host:port",
+    )
+    args = parser.parse_args()
+    IndexServer(args.address).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+Prebuilt index snapshots for fast replica bootstrap.
+A fresh replica has an empty index, and ingest_pdfs would download every
+PDF and re-embed it. Instead, the instance that ingests exports the
+course's active index version into one compressed, versioned artifact next
+to the course's PDFs in S3:
+
+    pdfs/<course>/_snapshots/<timestamp>.tar.gz
+        snapshot.json   format, course, embedding model, counts, and the
+                        sha256 of the two files below
+        vectors.npy     float32 (chunks x dim) embedding matrix
+        nodes.jsonl     one chunk per line: id, text, node metadata, with
+                        the citation page already resolved
+    pdfs/<course>/_snapshots/latest.json
+        the newest artifact's key, sha256 and snapshot.json fields
+
+At boot (SNAPSHOT_BOOTSTRAP=true), every course whose local index is empty
+is imported from its latest snapshot. The archive's sha256 and each member's
+sha256 are checked, vectors.npy is memory-mapped rather than read into
+memory, and the rows are loaded into a new index version that is validated
+and activated like an ingest (index_versions.py). Re-embedding is skipped,
+so a replica is query-ready in seconds. A snapshot from a different
+embedding model is refused, because its vectors would not match the query
+embeddings.
+
+Usage:
+    python index_snapshot.py export --course <id> [--out FILE]
+    python index_snapshot.py import --course <id> [--file FILE] [--force]
+    python index_snapshot.py list
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+from courses import list_courses, normalize_course, s3_prefix
+from index_versions import IndexVersions
+from rag_engine import (
+    CHUNKING,
+    EMBED_PROVIDER,
+    PDF_UPLOAD_DIR,
+    VECTOR_BACKEND,
+    CourseIndex,
+    course_index,
+    courses,
+    drop_version,
+    get_index_version,
+    index_client,
+    index_versions,
+    resolve_page_label,
+    set_index_version,
+    validate_version,
+)
+from s3_storage import (
+    download_file_from_s3,
+    is_s3_enabled,
+    list_s3_courses,
+    upload_file_to_s3,
+)
+
+SNAPSHOT_BOOTSTRAP = os.getenv("SNAPSHOT_BOOTSTRAP", "true").lower() == "true"
+SNAPSHOT_AFTER_INGEST = os.getenv("SNAPSHOT_AFTER_INGEST", "true").lower() == "true"
+SNAPSHOT_GZIP_LEVEL = int(os.getenv("SNAPSHOT_GZIP_LEVEL", "6"))
+# Rows read from / written to the vector store per call
+SNAPSHOT_BATCH = int(os.getenv("SNAPSHOT_BATCH", "1000"))
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_FOLDER = "_snapshots/"
+MEMBERS = ("snapshot.json", "vectors.npy", "nodes.jsonl")
+
+# course_id -> summary of the last export / import in this process
+last_exports = {}
+last_imports = {}
+
+
+class SnapshotError(Exception):
+    """A snapshot is corrupt or doesn't fit this instance."""
+
+
+def embed_model_id() -> str:
+    """Identifies the query embedding space a snapshot's vectors belong to."""
+    model = Settings.embed_model
+    name = f"{EMBED_PROVIDER}:{getattr(model, 'model_name', type(model).__name__)}"
+    precision = getattr(model, "precision", None)
+    return f"{name}:{precision}" if precision else name
+
+
+def snapshot_key(course_id: str, name: str) -> str:
+    return f"{s3_prefix(course_id)}{SNAPSHOT_FOLDER}{name}"
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+
+def iter_rows(course: CourseIndex) -> Iterator[tuple]:
+    """(node, embedding) for every chunk of a course index version."""
+    if VECTOR_BACKEND == "flat":
+        yield from course.vector_store.iter_rows()
+        return
+    offset = 0
+    while True:
+        page = course.collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=SNAPSHOT_BATCH,
+            offset=offset,
+        )
+        if not page["ids"]:
+            return
+        for text, metadata, embedding in zip(
+            page["documents"], page["metadatas"], page["embeddings"]
+        ):
+            yield metadata_dict_to_node(metadata, text=text), embedding
+        offset += len(page["ids"])
+
+
+def with_resolved_page(node):
+    """
+    Store the citation page with the chunk, as the index service does, so
+    replicas cite correctly without the PDFs (the page-aware parser already
+    records metadata["page"]).
+    """
+    if not node.metadata.get("page") and "resolved_page" not in node.metadata:
+        node.metadata["resolved_page"] = resolve_page_label(NodeWithScore(node=node))
+        for keys in (
+            node.excluded_llm_metadata_keys,
+            node.excluded_embed_metadata_keys,
+        ):
+            keys.append("resolved_page")
+    return node
+
+
+def export_snapshot(course_id: Optional[str], out_path: Path) -> dict:
+    """Write the course's active index version to out_path as a .tar.gz."""
+    course_id = normalize_course(course_id)
+    if index_client:
+        raise SnapshotError("Export snapshots from the index service process")
+    started = time.perf_counter()
+    course = course_index(course_id)
+    corpus_version = index_versions.corpus_version(course_id)
+    count = course.count()
+    if not count:
+        raise SnapshotError(f"Course {course_id} has an empty index")
+
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        tmp = Path(tmp)
+        vectors = None
+        rows = 0
+        files = set()
+        with open(tmp / "nodes.jsonl", "w") as nodes_file:
+            for node, embedding in iter_rows(course):
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(
+                        tmp / "vectors.npy",
+                        mode="w+",
+                        dtype=np.float32,
+                        shape=(count, len(embedding)),
+                    )
+                if rows == count:
+                    raise SnapshotError("Index changed during export, retry")
+                vectors[rows] = embedding
+                node = with_resolved_page(node)
+                files.add(node.metadata.get("file_name", ""))
+                record = {
+                    "id": node.node_id,
+                    "text": node.get_content(),
+                    "metadata": node_to_metadata_dict(node, remove_text=True),
+                }
+                nodes_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+                rows += 1
+        if rows != count:
+            raise SnapshotError("Index changed during export, retry")
+        dim = vectors.shape[1]
+        vectors.flush()
+        del vectors
+
+        info = {
+            "format": SNAPSHOT_FORMAT,
+            "course_id": course_id,
+            "corpus_version": corpus_version,
+            "created": time.time(),
+            "embed_model": embed_model_id(),
+            "chunking": CHUNKING,
+            "count": count,
+            "dim": dim,
+            "pdfs": len(files),
+            "files": {
+                name: sha256_file(tmp / name) for name in ("vectors.npy", "nodes.jsonl")
+            },
+        }
+        (tmp / "snapshot.json").write_text(json.dumps(info, indent=2))
+
+        # snapshot.json first, so an import can reject the archive early
+        partial = out_path.with_name(out_path.name + ".tmp")
+        with tarfile.open(
+            partial, "w:gz", compresslevel=SNAPSHOT_GZIP_LEVEL
+        ) as archive:
+            for name in MEMBERS:
+                archive.add(tmp / name, arcname=name)
+        os.replace(partial, out_path)
+
+    info = {
+        **{k: v for k, v in info.items() if k != "files"},
+        "sha256": sha256_file(out_path),
+        "size": out_path.stat().st_size,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    last_exports[course_id] = info
+    print(
+        f"[SNAPSHOT] Exported {course_id} ({corpus_version}, {count} chunks, "
+        f"{info['size'] / 1e6:.1f} MB) in {info['seconds']}s"
+    )
+    return info
+
+
+def publish_snapshot(course_id: Optional[str]) -> dict:
+    """Export the course's index and upload it (then latest.json) to S3."""
+    course_id = normalize_course(course_id)
+    if not is_s3_enabled():
+        raise SnapshotError("S3 is not enabled")
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        archive = Path(tmp) / "snapshot.tar.gz"
+        info = export_snapshot(course_id, archive)
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(info["created"]))
+        info["key"] = snapshot_key(course_id, f"{stamp}.tar.gz")
+        if not upload_file_to_s3(archive, info["key"], "application/gzip"):
+            raise SnapshotError(f"Upload of {info['key']} failed")
+
+        # Only point at the artifact once it is fully uploaded
+        pointer = Path(tmp) / "latest.json"
+        pointer.write_text(json.dumps(info, indent=2))
+        latest = snapshot_key(course_id, "latest.json")
+        if not upload_file_to_s3(pointer, latest, "application/json"):
+            raise SnapshotError(f"Upload of {latest} failed")
+    print(f"[SNAPSHOT] Published {info['key']}")
+    return info
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+
+def unpack(archive_path: Path, dest: Path, expected_sha256: Optional[str]) -> dict:
+    """Verify and extract an archive; returns its snapshot.json."""
+    if expected_sha256 and sha256_file(archive_path) != expected_sha256:
+        raise SnapshotError(f"{archive_path.name}: archive checksum mismatch")
+    with tarfile.open(archive_path, "r:gz") as archive:
+        for member in archive:
+            # Only the known regular files; nothing is written by member path
+            if member.name not in MEMBERS or not member.isfile():
+                raise SnapshotError(f"Unexpected archive member {member.name!r}")
+            with (
+                archive.extractfile(member) as src,
+                open(dest / member.name, "wb") as out,
+            ):
+                shutil.copyfileobj(src, out, 1 << 20)
+
+    try:
+        info = json.loads((dest / "snapshot.json").read_text())
+    except (FileNotFoundError, ValueError) as e:
+        raise SnapshotError(f"Missing or unreadable snapshot.json: {e}")
+    if info.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format {info.get('format')}")
+    for name, digest in info["files"].items():
+        if not (dest / name).exists() or sha256_file(dest / name) != digest:
+            raise SnapshotError(f"{name}: checksum mismatch")
+    if info["embed_model"] != embed_model_id():
+        raise SnapshotError(
+            f"Snapshot embedded with {info['embed_model']}, "
+            f"this instance uses {embed_model_id()}"
+        )
+    return info
+
+
+def has_index(course_id: str) -> bool:
+    return bool(index_versions.active(course_id)) or courses.get(course_id).count() > 0
+
+
+def load_rows(course: CourseIndex, tmp: Path, info: dict):
+    vectors = np.load(tmp / "vectors.npy", mmap_mode="r")
+    if vectors.shape != (info["count"], info["dim"]):
+        raise SnapshotError(f"vectors.npy has shape {vectors.shape}")
+    nodes = []
+    with open(tmp / "nodes.jsonl") as nodes_file:
+        for row, line in enumerate(nodes_file):
+            record = json.loads(line)
+            node = metadata_dict_to_node(record["metadata"], text=record["text"])
+            node.embedding = vectors[row].tolist()
+            nodes.append(node)
+            if len(nodes) == SNAPSHOT_BATCH:
+                course.vector_store.add(nodes)
+                nodes = []
+    if nodes:
+        course.vector_store.add(nodes)
+
+
+def import_snapshot(
+    course_id: Optional[str],
+    archive_path: Path,
+    expected_sha256: Optional[str] = None,
+    only_if_empty: bool = True,
+) -> dict:
+    """
+    Load an archive into a new index version of the course and activate it.
+    With only_if_empty, a course that already has an index is left alone.
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        raise SnapshotError("Import snapshots in the index service process")
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        tmp = Path(tmp)
+        info = unpack(archive_path, tmp, expected_sha256)
+        if info["course_id"] != course_id:
+            print(
+                f"[SNAPSHOT] Importing {info['course_id']}'s snapshot into {course_id}"
+            )
+
+        with index_versions.writing() as manifest:
+            if only_if_empty and (
+                index_versions.course(course_id, manifest)["active"]
+                or courses.get(course_id).count()
+            ):
+                return {"status": "skipped", "reason": "course already has an index"}
+            version = IndexVersions.next_version(manifest, course_id)
+            course = CourseIndex(course_id, version)
+            try:
+                load_rows(course, tmp, info)
+                validate_version(course)
+            except Exception:
+                drop_version(course_id, version)
+                raise
+            expired = IndexVersions.activate(
+                manifest,
+                course_id,
+                version,
+                pdfs=info["pdfs"],
+                chunks=course.count(),
+                snapshot=info["corpus_version"],
+            )
+    courses.put(course_id, course)
+    set_index_version(get_index_version() + 1)
+    for old_version in expired:
+        drop_version(course_id, old_version)
+
+    result = {
+        "status": "success",
+        "course_id": course_id,
+        "version": version,
+        "chunks": info["count"],
+        "source": info["corpus_version"],
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    last_imports[course_id] = result
+    print(
+        f"[SNAPSHOT] Course {course_id} serves index version {version} from "
+        f"snapshot {info['corpus_version']} ({info['count']} chunks) "
+        f"in {result['seconds']}s"
+    )
+    return result
+
+
+def latest_snapshot(course_id: str) -> Optional[dict]:
+    """The course's latest.json from S3, or None if it has no snapshot."""
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        path = Path(tmp) / "latest.json"
+        if not download_file_from_s3(snapshot_key(course_id, "latest.json"), path):
+            return None
+        return json.loads(path.read_text())
+
+
+def import_latest(course_id: Optional[str], only_if_empty: bool = True) -> dict:
+    """Download the course's latest snapshot from S3 and import it."""
+    course_id = normalize_course(course_id)
+    pointer = latest_snapshot(course_id)
+    if pointer is None:
+        return {"status": "skipped", "reason": "no snapshot in S3"}
+    with tempfile.TemporaryDirectory(prefix="snapshot-") as tmp:
+        archive = Path(tmp) / "snapshot.tar.gz"
+        if not download_file_from_s3(pointer["key"], archive):
+            raise SnapshotError(f"Download of {pointer['key']} failed")
+        return import_snapshot(course_id, archive, pointer["sha256"], only_if_empty)
+
+
+def bootstrap():
+    """
+    At boot: import the latest S3 snapshot of every course whose local index
+    is empty. Failures are logged and leave the course as it was (ingest
+    still works).
+    """
+    if not SNAPSHOT_BOOTSTRAP or index_client or not is_s3_enabled():
+        return
+    for course_id in list_courses(PDF_UPLOAD_DIR, list_s3_courses()):
+        try:
+            if has_index(course_id):
+                continue
+            result = import_latest(course_id)
+            if result["status"] != "success":
+                print(f"[SNAPSHOT] {course_id}: {result['reason']}")
+        except Exception as e:
+            print(f"[SNAPSHOT] Bootstrap of {course_id} failed: {e}")
+
+
+def snapshot_stats() -> dict:
+    return {
+        "bootstrap": SNAPSHOT_BOOTSTRAP,
+        "after_ingest": SNAPSHOT_AFTER_INGEST,
+        "exports": last_exports,
+        "imports": last_imports,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index snapshot export/import")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="export a course's active index")
+    export_cmd.add_argument("--course", default=None)
+    export_cmd.add_argument("--out", help="write here instead of uploading to S3")
+    import_cmd = sub.add_parser("import", help="load a snapshot as a new version")
+    import_cmd.add_argument("--course", default=None)
+    import_cmd.add_argument("--file", help="local archive instead of S3's latest")
+    import_cmd.add_argument(
+        "--force", action="store_true", help="import even if the course has an index"
+    )
+    sub.add_parser("list", help="latest snapshot of every course in S3")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if args.out:
+            result = export_snapshot(args.course, Path(args.out))
+        else:
+            result = publish_snapshot(args.course)
+    elif args.command == "import":
+        if args.file:
+            result = import_snapshot(
+                args.course, Path(args.file), only_if_empty=not args.force
+            )
+        else:
+            result = import_latest(args.course, only_if_empty=not args.force)
+    else:
+        result = {
+            course_id: latest_snapshot(course_id)
+            for course_id in list_courses(PDF_UPLOAD_DIR, list_s3_courses())
+        }
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,148 @@
+"""
+Versioned index snapshots with blue/green activation.
+Every ingest builds a complete new version of a course's index (its own
+Chroma collection or flat-index directory) next to the live one. Only after
+it validates is the course's active pointer flipped, by atomically replacing
+the JSON manifest, so queries never see a half-built index and a failed
+ingest changes nothing. Previous versions are kept for instant rollback and
+garbage-collected after INDEX_KEEP_VERSIONS newer ones exist.
+
+Version 0 is the unversioned collection/directory that existed before
+snapshots; courses without a manifest entry keep serving it.
+
+Manifest layout:
+    {"courses": {"<course_id>": {
+        "active": 3,
+        "versions": [{"version": 3, "revision": 0, "created": ..., ...}]}}}
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+# Previous versions kept (besides the active one) for rollback
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+
+
+class IndexVersions:
+    """Per-course active-version pointers, shared by every process on the host."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._mtime = None
+        self._manifest = {"courses": {}}
+
+    def _read(self, force: bool = False) -> dict:
+        """
+        The manifest, re-read only when another writer replaced it (always
+        under the write lock: two writes within one mtime tick look unchanged).
+        """
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {"courses": {}}
+        if force or mtime != self._mtime:
+            self._manifest = json.loads(self.path.read_text())
+            self._mtime = mtime
+        return self._manifest
+
+    def _write(self, manifest: dict):
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp, self.path)
+        # This process sees its own write even if the mtime didn't move
+        self._manifest = manifest
+        self._mtime = self.path.stat().st_mtime_ns
+
+    @contextmanager
+    def writing(self):
+        """
+        Exclusive across threads and processes; yields a copy of the
+        manifest that is published when the block exits without error.
+        """
+        lock_path = self.path.with_suffix(".lock")
+        with self.lock, open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                manifest = json.loads(json.dumps(self._read(force=True)))
+                yield manifest
+                self._write(manifest)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def course(self, course_id: str, manifest: Optional[dict] = None) -> dict:
+        manifest = manifest if manifest is not None else self._read()
+        return manifest["courses"].get(course_id, {"active": 0, "versions": []})
+
+    def active(self, course_id: str) -> int:
+        return self.course(course_id)["active"]
+
+    def corpus_version(self, course_id: str) -> str:
+        """Changes whenever the course's searchable content does (cache keys)."""
+        entry = self.course(course_id)
+        revision = next(
+            (
+                v["revision"]
+                for v in entry["versions"]
+                if v["version"] == entry["active"]
+            ),
+            0,
+        )
+        return f"{course_id}@v{entry['active']}.{revision}"
+
+    @staticmethod
+    def next_version(manifest: dict, course_id: str) -> int:
+        entry = manifest["courses"].get(course_id, {"active": 0, "versions": []})
+        return 1 + max([entry["active"], *(v["version"] for v in entry["versions"])])
+
+    @staticmethod
+    def activate(manifest: dict, course_id: str, version: int, **info) -> List[int]:
+        """
+        Point course_id at version (recording info about it) and return the
+        versions that fell out of the retention window.
+        """
+        entry = manifest["courses"].setdefault(course_id, {"active": 0, "versions": []})
+        previous = entry["active"]
+        if previous not in {v["version"] for v in entry["versions"]}:
+            # The pre-snapshot collection is kept like any other version
+            entry["versions"].append({"version": previous, "revision": 0})
+        entry["versions"].append(
+            {"version": version, "revision": 0, "created": time.time(), **info}
+        )
+        entry["active"] = version
+
+        # Keep the new and previous versions plus the newest few others
+        older = sorted(
+            (v["version"] for v in entry["versions"] if v["version"] != version),
+            reverse=True,
+        )
+        keep = {version, previous, *older[:INDEX_KEEP_VERSIONS]}
+        entry["versions"] = sorted(
+            (v for v in entry["versions"] if v["version"] in keep),
+            key=lambda v: v["version"],
+        )
+        return [v for v in older if v not in keep]
+
+    @staticmethod
+    def set_active(manifest: dict, course_id: str, version: int):
+        entry = manifest["courses"].get(course_id)
+        if not entry or version not in {v["version"] for v in entry["versions"]}:
+            raise ValueError(f"Course {course_id} has no index version {version}")
+        entry["active"] = version
+
+    @staticmethod
+    def bump_revision(manifest: dict, course_id: str):
+        """The active version was edited in place (e.g. a PDF was deleted)."""
+        entry = manifest["courses"].setdefault(
+            course_id, {"active": 0, "versions": [{"version": 0, "revision": 0}]}
+        )
+        for v in entry["versions"]:
+            if v["version"] == entry["active"]:
+                v["revision"] += 1
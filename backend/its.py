@@ -1,3 +1,11 @@
+ITS_MODES = ("direct", "hint", "socratic")
+
+
+def normalize_mode(mode: str) -> str:
+    # Anything we don't recognise gets a direct answer, same as apply_its_mode
+    return mode if mode in ITS_MODES else "direct"
+
+
 def apply_its_mode(question: str, mode: str) -> str:
     if mode == "hint":
         return f"Give a helpful hint without revealing the full answer.\n\nQuestion:\n{question}"
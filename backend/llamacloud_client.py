@@ -1,95 +1,201 @@
+"""
+LlamaCloud retrieval + generation backend (see rag_backend.py for when it is
+used). One pooled httpx.AsyncClient is shared by every request, so calls
+reuse keep-alive connections instead of a new TLS handshake each, and each
+of the two calls (retrieve, then chat on the retrieved chunks) gets its own
+timeout, capped by what is left of the request's overall deadline.
+
+LLAMACLOUD_BASE_URL points the client at mock_llamacloud_server.py for tests.
+"""
+
+import asyncio
 import os
+import time
+from typing import Optional
 
-import requests
+import httpx
 from dotenv import load_dotenv
 
+from courses import DEFAULT_COURSE
+
 # load environment variables
 load_dotenv()
 
 API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
 INDEX_ID = os.getenv("LLAMACLOUD_INDEX_ID")
+# Per-course pipelines: "cs101=<pipeline id>,cs202=<pipeline id>"
+INDEX_IDS = os.getenv("LLAMACLOUD_INDEX_IDS", "")
+BASE_URL = os.getenv("LLAMACLOUD_BASE_URL", "https://api.cloud.llamaindex.ai")
+LLAMACLOUD_TOP_K = int(os.getenv("LLAMACLOUD_TOP_K", "3"))
+# Per-call timeouts, and the budget for a whole question
+LLAMACLOUD_RETRIEVE_TIMEOUT = float(os.getenv("LLAMACLOUD_RETRIEVE_TIMEOUT", "8"))
+LLAMACLOUD_CHAT_TIMEOUT = float(os.getenv("LLAMACLOUD_CHAT_TIMEOUT", "30"))
+LLAMACLOUD_DEADLINE = float(os.getenv("LLAMACLOUD_DEADLINE", "35"))
+LLAMACLOUD_MAX_CONNECTIONS = int(os.getenv("LLAMACLOUD_MAX_CONNECTIONS", "20"))
+
+NO_CONTEXT_ANSWER = (
+    "I cannot find relevant information in the course materials to answer "
+    "your question."
+)
+
+
+class LlamaCloudError(Exception):
+    """A LlamaCloud call failed, timed out or returned something unusable."""
+
+
+def pipeline_ids() -> dict:
+    ids = {DEFAULT_COURSE: INDEX_ID} if INDEX_ID else {}
+    for pair in INDEX_IDS.split(","):
+        course_id, _, pipeline_id = pair.strip().partition("=")
+        if course_id and pipeline_id:
+            ids[course_id.strip()] = pipeline_id.strip()
+    return ids
+
+
+PIPELINE_IDS = pipeline_ids()
+
+
+def is_configured(course_id: str = DEFAULT_COURSE) -> bool:
+    return bool(API_KEY) and course_id in PIPELINE_IDS
+
+
+class Deadline:
+    """Time left for one question; each call's timeout is capped by it."""
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def timeout(self, call_timeout: float) -> float:
+        left = self.expires - time.monotonic()
+        if left <= 0:
+            raise LlamaCloudError("deadline exceeded")
+        return min(call_timeout, left)
+
+
+class LlamaCloudClient:
+    def __init__(self, base_url: str = BASE_URL, api_key: Optional[str] = API_KEY):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self._http = None
+        self._loop = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Shared pool, recreated if a new event loop (CLI, tests) uses it."""
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+                limits=httpx.Limits(
+                    max_connections=LLAMACLOUD_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLAMACLOUD_MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                ),
+            )
+            self._loop = loop
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _post(self, path: str, payload: dict, timeout: float) -> dict:
+        try:
+            response = await self.http.post(path, json=payload, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        except httpx.TimeoutException as e:
+            raise LlamaCloudError(f"{path} timed out after {timeout:.1f}s") from e
+        except httpx.HTTPStatusError as e:
+            raise LlamaCloudError(f"{path} returned {e.response.status_code}") from e
+        except (httpx.HTTPError, ValueError) as e:
+            raise LlamaCloudError(f"{path} failed: {e}") from e
+
+    async def retrieve(
+        self, query: str, course_id: str, top_k: int, deadline: Deadline
+    ) -> list:
+        """[{"text", "file_name", "page_label", "score"}] for the top chunks."""
+        data = await self._post(
+            f"/api/v1/pipelines/{PIPELINE_IDS[course_id]}/retrieve",
+            {"query": query, "dense_similarity_top_k": top_k},
+            deadline.timeout(LLAMACLOUD_RETRIEVE_TIMEOUT),
+        )
+        chunks = []
+        for item in (data.get("retrieval_nodes") or [])[:top_k]:
+            node = item.get("node", {})
+            if "text" not in node:
+                continue
+            metadata = node.get("metadata") or {}
+            chunks.append(
+                {
+                    "text": node["text"],
+                    "file_name": metadata.get("file_name", "Unknown File"),
+                    "page_label": metadata.get("page_label", "?"),
+                    "score": item.get("score"),
+                }
+            )
+        return chunks
+
+    async def chat(self, messages: list, deadline: Deadline) -> str:
+        result = await self._post(
+            "/api/v1/chat/completions",
+            {"messages": messages, "temperature": 0.7, "max_tokens": 1000},
+            deadline.timeout(LLAMACLOUD_CHAT_TIMEOUT),
+        )
+        if result.get("choices"):
+            return result["choices"][0]["message"]["content"]
+        if "message" in result:
+            # Alternative response format
+            return result["message"]["content"]
+        raise LlamaCloudError(f"Unexpected chat response: {list(result)}")
 
-RETRIEVE_URL = f"https://api.cloud.llamaindex.ai/api/v1/pipelines/{INDEX_ID}/retrieve"
-CHAT_URL = "https://api.cloud.llamaindex.ai/api/v1/chat/completions"
 
-HEADERS = {
-    "Authorization": f"Bearer {API_KEY}",
-    "Content-Type": "application/json",
-}
+client = LlamaCloudClient()
 
 
-def query_llamacloud(question: str, system_prompt: str):
+async def query_llamacloud(
+    question: str,
+    system_prompt: str,
+    retrieval_query: Optional[str] = None,
+    course_id: str = DEFAULT_COURSE,
+    deadline: float = LLAMACLOUD_DEADLINE,
+) -> dict:
     """
-    Step 1: Retrieve relevant document chunks from LlamaCloud
-    Step 2: Extract top 3 chunks
-    Step 3: Send to LlamaCloud LLM with system prompt to generate answer
+    Retrieve the top chunks from the course's LlamaCloud pipeline and have
+    its LLM answer from them. Same result shape as rag_engine.query_rag.
+    Raises LlamaCloudError on any failure, including the deadline.
     """
-
-    print(f"[STEP 1] Retrieving relevant documents for: {question[:100]}...")
-
-    # Step 1: Retrieve documents
-    try:
-        response = requests.post(
-            RETRIEVE_URL, headers=HEADERS, json={"query": question}, timeout=60
-        )
-        response.raise_for_status()
-        data = response.json()
-        print(f"[STEP 1] Retrieval response: {list(data.keys())}")
-    except Exception as e:
-        print(f"[ERROR] Failed to retrieve from LlamaCloud: {e}")
-        raise
-
-    # Step 2: Extract top 3 chunks
-    chunks = []
-    if "retrieval_nodes" in data and data["retrieval_nodes"]:
-        for node in data["retrieval_nodes"][:3]:  # Top 3 chunks only
-            if "text" in node.get("node", {}):
-                chunks.append(node["node"]["text"])
-
-    if not chunks:
-        print("[WARNING] No relevant chunks found")
-        return "I cannot find relevant information in the course materials to answer your question."
-
-    context = "\n\n---\n\n".join(chunks)
-    print(
-        f"[STEP 2] Extracted {len(chunks)} relevant chunks ({len(context)} characters)"
+    started = time.perf_counter()
+    deadline = Deadline(deadline)
+    chunks = await client.retrieve(
+        retrieval_query or question, course_id, LLAMACLOUD_TOP_K, deadline
     )
+    if not chunks:
+        print("[LLAMACLOUD] No relevant chunks found")
+        return {"answer": NO_CONTEXT_ANSWER, "citations": [], "route": "llamacloud"}
 
-    # Step 3: Call LlamaCloud LLM to synthesize answer
-    print("[STEP 3] Generating answer with LlamaCloud LLM...")
-
+    context = "\n\n---\n\n".join(c["text"] for c in chunks)
     messages = [
         {"role": "system", "content": system_prompt},
         {
             "role": "user",
-            "content": f"Using only the following course material:\n\n{context}\n\n---\n\nPlease answer this question: {question}",
+            "content": (
+                "Using only the following course material:\n\n"
+                f"{context}\n\n---\n\nPlease answer this question: {question}"
+            ),
         },
     ]
-
-    try:
-        llm_response = requests.post(
-            CHAT_URL,
-            headers=HEADERS,
-            json={"messages": messages, "temperature": 0.7, "max_tokens": 1000},
-            timeout=60,
-        )
-        llm_response.raise_for_status()
-        result = llm_response.json()
-        print(f"[STEP 3] LLM response received")
-        print(f"[DEBUG] Response keys: {list(result.keys())}")
-
-        # Extract answer from response
-        if "choices" in result and len(result["choices"]) > 0:
-            answer = result["choices"][0]["message"]["content"]
-            print("[SUCCESS] Answer generated successfully")
-            return answer
-        elif "message" in result:
-            # Alternative response format
-            return result["message"]["content"]
-        else:
-            print(f"[ERROR] Unexpected LLM response format: {result}")
-            return "Error: Could not generate response from LLM."
-
-    except Exception as e:
-        print(f"[ERROR] Failed to get LLM response: {e}")
-        raise
+    answer = await client.chat(messages, deadline)
+    print(
+        f"[LLAMACLOUD] Answered from {len(chunks)} chunks in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+    citations = list(
+        dict.fromkeys(f"{c['file_name']} (Page {c['page_label']})" for c in chunks)
+    )
+    return {"answer": answer, "citations": citations, "route": "llamacloud"}
@@ -0,0 +1,506 @@
+"""
+Rate-limit-aware dispatch layer for LLM calls.
+Every Groq call goes through one LLMDispatcher that tracks the
+requests-per-minute and tokens-per-minute budgets, makes callers wait for
+budget instead of hitting 429s, and retries 429/5xx responses with jittered
+exponential backoff. A burst of students turns into short queue waits
+instead of "I'm having trouble accessing the course materials".
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional, Sequence
+
+import httpx
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms import LLM
+from llama_index.core.llms.custom import CustomLLM
+from pydantic import PrivateAttr
+
+from cancellation import (
+    CANCEL_QUERIES,
+    Cancelled,
+    checkpoint,
+    current_token,
+    wait_cancelled,
+)
+
+# Groq free tier for llama-3.3-70b-versatile; raise these on paid plans
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "30"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "12000"))
+# Per-model overrides, "model=rpm:tpm,..." (default: free tier 8B)
+LLM_LIMITS = os.getenv("LLM_LIMITS", "llama-3.1-8b-instant=30:6000")
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Give up (rather than queue forever) if the budget is this far behind
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "30"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Past these, callers should skip the LLM and answer with excerpts instead
+LLM_DEGRADE_QUEUE_WAIT = float(os.getenv("LLM_DEGRADE_QUEUE_WAIT", "8"))
+LLM_DEGRADE_ERROR_RATE = float(os.getenv("LLM_DEGRADE_ERROR_RATE", "0.5"))
+# Typical RAG prompt + answer, used to estimate the wait for the next call
+DEGRADE_PROBE_TOKENS = 2500
+
+# Output budget assumed when the caller does not cap max_tokens
+DEFAULT_OUTPUT_TOKENS = 512
+
+
+class LLMOverloadedError(Exception):
+    """Raised when the estimated wait for LLM budget exceeds the limit."""
+
+    def __init__(self, wait: float):
+        super().__init__(f"LLM queue wait of {wait:.1f}s exceeds limit")
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that hands out reservations.
+    reserve() always succeeds and returns how long the caller has to wait
+    before its reservation is covered, so callers queue in arrival order.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        """Empty the bucket after a 429 so every caller backs off together."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def available(self) -> float:
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # openai.APIConnectionError / APITimeoutError, httpx transport errors
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _field(obj: Any, name: str) -> Any:
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def usage_tokens(raw: Any) -> Optional[int]:
+    """
+    Total tokens reported by the API response, if present. Groq reports a
+    stream's usage on its last chunk, under x_groq.
+    """
+    for source in (raw, _field(raw, "x_groq")):
+        usage = _field(source, "usage")
+        if usage is not None:
+            return _field(usage, "total_tokens")
+    return None
+
+
+class LLMDispatcher:
+    """Shared request/token budgets, retries and queue metrics for LLM calls."""
+
+    def __init__(
+        self,
+        rpm: int = LLM_RPM_LIMIT,
+        tpm: int = LLM_TPM_LIMIT,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        max_queue_wait: float = LLM_MAX_QUEUE_WAIT,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_queue_wait = max_queue_wait
+
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.counters = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "failures": 0,
+            "overloaded": 0,
+            "cancelled": 0,
+        }
+        self.queue_waits = deque(maxlen=1000)
+        self.outcomes = deque(maxlen=100)  # True = success, for error rate
+
+    def estimate_tokens(self, prompt: str, max_tokens: Optional[int]) -> int:
+        # ~4 characters per token for English prompts
+        return len(prompt) // 4 + (max_tokens or DEFAULT_OUTPUT_TOKENS)
+
+    def estimated_wait(self, est_tokens: int = 0) -> float:
+        """How long a new call would queue right now (without reserving)."""
+        request_deficit = max(0.0, 1 - self.requests.available())
+        token_deficit = max(0.0, est_tokens - self.tokens.available())
+        return max(
+            request_deficit / self.requests.rate, token_deficit / self.tokens.rate
+        )
+
+    def _acquire(self, est_tokens: int) -> float:
+        wait = max(self.requests.reserve(1), self.tokens.reserve(est_tokens))
+        if wait > self.max_queue_wait:
+            self.requests.refund(1)
+            self.tokens.refund(est_tokens)
+            with self.lock:
+                self.counters["overloaded"] += 1
+            raise LLMOverloadedError(wait)
+        if wait > 0:
+            with self.lock:
+                self.queued += 1
+            try:
+                if wait_cancelled(wait):
+                    # Abandoned while queued: hand the budget to the next caller
+                    self.requests.refund(1)
+                    self.tokens.refund(est_tokens)
+                    with self.lock:
+                        self.counters["cancelled"] += 1
+                    checkpoint("llm_queue", tokens=est_tokens)
+            finally:
+                with self.lock:
+                    self.queued -= 1
+        with self.lock:
+            self.queue_waits.append(wait)
+        return wait
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        hint = retry_after_seconds(error)
+        return max(delay, hint) if hint is not None else delay
+
+    def _record_error(self, error: Exception):
+        status = getattr(error, "status_code", None)
+        with self.lock:
+            if status == 429:
+                self.counters["rate_limited"] += 1
+            elif status is not None and status >= 500:
+                self.counters["server_errors"] += 1
+        if status == 429:
+            self.requests.drain()
+
+    def _settle(self, est_tokens: int, raw: Any, unused_output: int = 0):
+        """
+        Refund what the call didn't use: by the reported usage, or else by
+        the estimated output budget left over (unused_output).
+        """
+        actual = usage_tokens(raw)
+        if actual is None:
+            if unused_output > 0:
+                self.tokens.refund(unused_output)
+        elif actual < est_tokens:
+            self.tokens.refund(est_tokens - actual)
+
+    def call(self, func: Callable, est_tokens: int):
+        """Run func() within the budget, retrying 429/5xx/connection errors."""
+        attempt = 0
+        while True:
+            self._acquire(est_tokens)
+            with self.lock:
+                self.in_flight += 1
+                self.counters["calls"] += 1
+            try:
+                result = func()
+                self._settle(est_tokens, getattr(result, "raw", None))
+                self.outcomes.append(True)
+                return result
+            except Exception as e:
+                self._record_error(e)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failures"] += 1
+                    self.outcomes.append(False)
+                    raise
+                delay = self._backoff(attempt, e)
+                print(
+                    f"[LLM] {type(e).__name__}, retry {attempt + 1}/"
+                    f"{self.max_retries} in {delay:.1f}s"
+                )
+                with self.lock:
+                    self.counters["retries"] += 1
+                if wait_cancelled(delay):
+                    checkpoint("llm_retry")
+                attempt += 1
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    def stream(
+        self,
+        func: Callable,
+        est_tokens: int,
+        output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+    ):
+        """
+        Like call() for generator-returning functions.
+        Retries only happen before the first chunk has been yielded.
+        If the query is cancelled mid-answer the stream is closed, which
+        drops the connection so the API stops generating; the output
+        budget not used (`output_tokens` minus what was generated) is
+        refunded.
+        """
+        attempt = 0
+        while True:
+            self._acquire(est_tokens)
+            with self.lock:
+                self.in_flight += 1
+                self.counters["calls"] += 1
+            started = False
+            try:
+                last = None
+                generated = 0  # characters
+                chunks = func()
+                for chunk in chunks:
+                    started = True
+                    generated += len(getattr(chunk, "delta", None) or "")
+                    token = current_token()
+                    if token is not None and token.cancelled:
+                        chunks.close()
+                        unused = max(0, output_tokens - generated // 4)
+                        self.tokens.refund(unused)
+                        with self.lock:
+                            self.counters["cancelled"] += 1
+                        token.registry.count("llm_aborted")
+                        checkpoint("generation", tokens=unused)
+                    last = chunk
+                    yield chunk
+                self._settle(
+                    est_tokens,
+                    getattr(last, "raw", None),
+                    output_tokens - generated // 4,
+                )
+                self.outcomes.append(True)
+                return
+            except Cancelled:
+                raise
+            except Exception as e:
+                self._record_error(e)
+                if started or not is_retryable(e) or attempt >= self.max_retries:
+                    with self.lock:
+                        self.counters["failures"] += 1
+                    self.outcomes.append(False)
+                    raise
+                delay = self._backoff(attempt, e)
+                with self.lock:
+                    self.counters["retries"] += 1
+                if wait_cancelled(delay):
+                    checkpoint("llm_retry")
+                attempt += 1
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    def error_rate(self) -> float:
+        outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def saturation(self) -> Optional[str]:
+        """Why a new call should be skipped right now, or None if it's fine."""
+        if self.estimated_wait(DEGRADE_PROBE_TOKENS) > LLM_DEGRADE_QUEUE_WAIT:
+            return "queue"
+        if len(self.outcomes) >= 10 and self.error_rate() > LLM_DEGRADE_ERROR_RATE:
+            return "errors"
+        return None
+
+    def stats(self) -> dict:
+        waits = sorted(self.queue_waits)
+
+        def pct(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        with self.lock:
+            return {
+                **self.counters,
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "queue_wait_ms": {
+                    "mean": round(1000 * sum(waits) / len(waits), 1) if waits else 0,
+                    "p50": round(1000 * pct(0.50), 1),
+                    "p95": round(1000 * pct(0.95), 1),
+                    "max": round(1000 * waits[-1], 1) if waits else 0,
+                },
+                "recent_error_rate": round(self.error_rate(), 3),
+                "degraded": self.saturation(),
+                "requests_available": round(self.requests.available(), 1),
+                "tokens_available": round(self.tokens.available()),
+            }
+
+
+def make_http_client() -> httpx.Client:
+    """Keep-alive connection pool shared by every Groq client."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=60,
+        ),
+        timeout=LLM_TIMEOUT,
+    )
+
+
+class DispatchedLLM(CustomLLM):
+    """
+    Wraps any LlamaIndex LLM so every call goes through an LLMDispatcher.
+    Callback events are emitted by the wrapped LLM, so the wrapper methods
+    are deliberately not decorated (that would double-count them).
+    """
+
+    _inner: LLM = PrivateAttr()
+    _dispatcher: LLMDispatcher = PrivateAttr()
+
+    def __init__(self, inner: LLM, dispatcher: LLMDispatcher, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._inner = inner
+        self._dispatcher = dispatcher
+
+    @property
+    def inner(self) -> LLM:
+        return self._inner
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._inner.metadata
+
+    def _estimate(self, prompt: str) -> int:
+        max_tokens = getattr(self._inner, "max_tokens", None)
+        return self._dispatcher.estimate_tokens(prompt, max_tokens)
+
+    def _output_tokens(self) -> int:
+        return getattr(self._inner, "max_tokens", None) or DEFAULT_OUTPUT_TOKENS
+
+    def _streamed(self) -> bool:
+        # Inside a query, one-shot calls are streamed too so that a
+        # cancelled query can stop the generation partway
+        return CANCEL_QUERIES and current_token() is not None
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        if self._streamed():
+            last = CompletionResponse(text="")
+            for last in self.stream_complete(prompt, formatted=formatted, **kwargs):
+                pass
+            return last
+        return self._dispatcher.call(
+            lambda: self._inner.complete(prompt, formatted=formatted, **kwargs),
+            self._estimate(prompt),
+        )
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        return self._dispatcher.stream(
+            lambda: self._inner.stream_complete(prompt, formatted=formatted, **kwargs),
+            self._estimate(prompt),
+            self._output_tokens(),
+        )
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        if self._streamed():
+            last = ChatResponse(message=ChatMessage(role="assistant", content=""))
+            for last in self.stream_chat(messages, **kwargs):
+                pass
+            return last
+        prompt = "".join(str(m.content) for m in messages)
+        return self._dispatcher.call(
+            lambda: self._inner.chat(messages, **kwargs), self._estimate(prompt)
+        )
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        prompt = "".join(str(m.content) for m in messages)
+        return self._dispatcher.stream(
+            lambda: self._inner.stream_chat(messages, **kwargs),
+            self._estimate(prompt),
+            self._output_tokens(),
+        )
+
+
+def model_limits() -> dict:
+    """LLM_LIMITS as {model: (rpm, tpm)}."""
+    limits = {}
+    for pair in LLM_LIMITS.split(","):
+        model, _, budget = pair.strip().partition("=")
+        rpm, _, tpm = budget.partition(":")
+        if model and rpm.strip().isdigit() and tpm.strip().isdigit():
+            limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+
+# Groq rate limits apply per model, so each model gets its own budgets
+# (LLM_LIMITS, else LLM_RPM_LIMIT/LLM_TPM_LIMIT)
+MODEL_LIMITS = model_limits()
+dispatchers = {}
+dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(model: str) -> LLMDispatcher:
+    with dispatchers_lock:
+        if model not in dispatchers:
+            rpm, tpm = MODEL_LIMITS.get(model, (LLM_RPM_LIMIT, LLM_TPM_LIMIT))
+            dispatchers[model] = LLMDispatcher(rpm=rpm, tpm=tpm)
+        return dispatchers[model]
+
+
+def dispatcher_stats() -> dict:
+    return {model: d.stats() for model, d in list(dispatchers.items())}
+
+
+def llm_saturation(model: str) -> Optional[str]:
+    """saturation() of the model's dispatcher; None before its first call."""
+    dispatcher = dispatchers.get(model)
+    return dispatcher.saturation() if dispatcher else None
@@ -1,142 +1,570 @@
 """
 Load Testing Script for MyTutorBot
-Tests concurrent user capacity and identifies bottlenecks
+Scenario-driven capacity tests with streaming latency histograms
 
 Usage:
     pip install locust
     locust -f load_test.py --host http://localhost:8000
 
-Then open http://localhost:8089 and simulate users
+Then open http://localhost:8089 and simulate users.
+
+Scenarios (pass the user classes on the command line):
+    Normal mix:        locust -f load_test.py StudentUser AdminUser
+    Exam rush:         locust -f load_test.py ExamRushUser
+    Ingest under load: locust -f load_test.py StudentUser IngestAdminUser
+    Long sessions:     locust -f load_test.py LongSessionUser
+    Streaming TTFT:    locust -f load_test.py StreamingUser
+
+Find the saturation point automatically (adds users step by step and stops
+once p95 or the error rate crosses the target):
+    LOAD_SHAPE=step locust -f load_test.py --headless ExamRushUser \\
+        --step-users 25 --step-seconds 60 --max-users 600 --target-p95-ms 5000
+
+Write a JSON report and compare it with an earlier run:
+    locust -f load_test.py --headless -u 100 -r 10 -t 5m StudentUser \\
+        --report-json reports/run.json --baseline reports/baseline.json
+
+Pair with mock_groq_server.py to test our own limits without Groq quota.
 """
 
 import json
+import math
+import os
 import random
+import tempfile
+import time
+from pathlib import Path
+
+from locust import HttpUser, LoadTestShape, between, events, task
+
+from synthetic_corpus import make_lecture, write_pdf
+
+STUDENT_QUESTIONS = [
+    "What is the main topic of the lecture?",
+    "Can you explain the key concepts?",
+    "What are the important points to remember?",
+    "How does this relate to previous topics?",
+    "Can you summarize the material?",
+]
+
+# A handful of questions everyone asks the night before the exam
+EXAM_RUSH_QUESTIONS = [
+    "What will be on the exam about linked lists?",
+    "How do I free memory in a linked list?",
+    "What is the difference between a pointer and a reference?",
+]
+
+FOLLOW_UPS = [
+    "Can you give me an example?",
+    "Why does that work?",
+    "What happens if the list is empty?",
+    "How would I debug that with valgrind?",
+    "Can you explain that more simply?",
+    "What is a common mistake here?",
+]
+
+ITS_MODES = ["direct", "hint", "socratic"]
+
+
+# ---------------------------------------------------------------------------
+# Streaming histograms
+# ---------------------------------------------------------------------------
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram with log-spaced buckets.
+    Memory stays bounded (a few hundred buckets) however many samples are
+    recorded, and any percentile is accurate to about 1%.
+    """
+
+    GROWTH = 1.02  # each bucket is 2% wider than the last
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, value_ms: float) -> int:
+        return int(math.log(max(value_ms, 0.01) * 100, self.GROWTH))
+
+    def _bucket_value(self, bucket: int) -> float:
+        # Upper edge of the bucket, so percentiles never under-report
+        return self.GROWTH ** (bucket + 1) / 100
+
+    def record(self, value_ms: float):
+        bucket = self._bucket(value_ms)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+        target = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._bucket_value(bucket), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 1),
+            "min_ms": round(self.min, 1),
+            "p50_ms": round(self.percentile(50), 1),
+            "p90_ms": round(self.percentile(90), 1),
+            "p95_ms": round(self.percentile(95), 1),
+            "p99_ms": round(self.percentile(99), 1),
+            "max_ms": round(self.max, 1),
+        }
+
+
+class StatsWindow:
+    """Per-endpoint histograms and error counts over one time window."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.errors = {}
+
+    def record(self, name: str, response_time: float, failed: bool):
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return
+        self.histograms.setdefault(name, LatencyHistogram()).record(response_time)
+
+    def merged(self) -> LatencyHistogram:
+        total = LatencyHistogram()
+        for hist in self.histograms.values():
+            total.merge(hist)
+        return total
+
+    def requests(self) -> int:
+        return sum(h.count for h in self.histograms.values()) + sum(
+            self.errors.values()
+        )
+
+    def error_rate(self) -> float:
+        total = self.requests()
+        return sum(self.errors.values()) / total if total else 0.0
+
+    def summary(self) -> dict:
+        elapsed = max(time.time() - self.started, 1e-6)
+        endpoints = {}
+        for name in set(self.histograms) | set(self.errors):
+            hist = self.histograms.get(name, LatencyHistogram())
+            endpoints[name] = hist.summary()
+            endpoints[name]["errors"] = self.errors.get(name, 0)
+        return {
+            "duration_s": round(elapsed, 1),
+            "requests": self.requests(),
+            "rps": round(self.requests() / elapsed, 2),
+            "error_rate": round(self.error_rate(), 4),
+            "endpoints": endpoints,
+        }
+
 
-from locust import HttpUser, between, task
+run_stats = StatsWindow()  # whole test
+step_stats = StatsWindow()  # current ramp step (LOAD_SHAPE=step)
+step_results = []
+saturation = {}
+
+
+@events.request.add_listener
+def on_request(request_type, name, response_time, response_length, exception, **kwargs):
+    """Feed every request into the streaming histograms"""
+    failed = exception is not None
+    run_stats.record(name, response_time, failed)
+    step_stats.record(name, response_time, failed)
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    group = parser.add_argument_group("MyTutorBot capacity test")
+    group.add_argument("--report-json", default="", help="Write a JSON report here")
+    group.add_argument("--baseline", default="", help="JSON report to compare with")
+    group.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed p95/p99 slowdown vs baseline (0.2 = 20%%)",
+    )
+    group.add_argument("--step-users", type=int, default=25)
+    group.add_argument("--step-seconds", type=int, default=60)
+    group.add_argument("--max-users", type=int, default=1000)
+    group.add_argument("--target-p95-ms", type=float, default=5000)
+    group.add_argument("--max-error-rate", type=float, default=0.01)
+
+
+# ---------------------------------------------------------------------------
+# Scenario users
+# ---------------------------------------------------------------------------
+
+
+def check_json(response, key):
+    if response.status_code != 200:
+        response.failure(f"Got status {response.status_code}")
+    elif key not in response.json():
+        response.failure(f"Missing {key} in response")
+    else:
+        response.success()
 
 
 class TutorBotUser(HttpUser):
-    """Simulates a student using the tutoring app"""
+    """Base class: a student session with its own anon_user_id"""
 
-    # Wait 1-3 seconds between tasks (realistic student behavior)
+    abstract = True
     wait_time = between(1, 3)
 
     def on_start(self):
         """Called when a simulated user starts"""
-        # Generate a unique user ID
-        self.user_id = f"student_{random.randint(1000, 9999)}"
-        print(f"[START] User {self.user_id} started session")
-
-    @task(5)  # Higher weight = more frequent
-    def ask_question(self):
-        """Simulate asking a question (most common action)"""
-        questions = [
-            "What is the main topic of the lecture?",
-            "Can you explain the key concepts?",
-            "What are the important points to remember?",
-            "How does this relate to previous topics?",
-            "Can you summarize the material?",
-        ]
+        self.user_id = f"student_{random.randint(100000, 999999)}"
 
+    def ask(self, question: str, mode: str = None, name: str = "Ask Question"):
         payload = {
-            "question": random.choice(questions),
-            "mode": random.choice(["direct", "guided", "socratic"]),
+            "question": question,
+            "mode": mode or random.choice(ITS_MODES),
             "anon_user_id": self.user_id,
         }
-
         with self.client.post(
-            "/api/query", json=payload, catch_response=True, name="Ask Question"
+            "/api/query", json=payload, catch_response=True, name=name
         ) as response:
-            if response.status_code == 200:
-                data = response.json()
-                if "content" in data:
-                    response.success()
-                else:
-                    response.failure("Missing content in response")
-            else:
-                response.failure(f"Got status {response.status_code}")
-
-    @task(2)
-    def get_chat_history(self):
-        """Simulate fetching conversation history"""
-        payload = {"anon_user_id": self.user_id}
+            check_json(response, "content")
 
+    def get_history(self):
         with self.client.post(
-            "/api/history", json=payload, catch_response=True, name="Get History"
+            "/api/history",
+            json={"anon_user_id": self.user_id},
+            catch_response=True,
+            name="Get History",
         ) as response:
-            if response.status_code == 200:
-                response.success()
-            else:
-                response.failure(f"Got status {response.status_code}")
+            check_json(response, "conversation")
 
-    @task(1)
     def list_pdfs(self):
-        """Simulate checking available PDFs"""
         with self.client.get(
             "/api/files", catch_response=True, name="List PDFs"
         ) as response:
-            if response.status_code == 200:
-                data = response.json()
-                if "files" in data:
-                    response.success()
-                else:
-                    response.failure("Missing files in response")
-            else:
-                response.failure(f"Got status {response.status_code}")
+            check_json(response, "files")
+
+
+class StudentUser(TutorBotUser):
+    """Normal study session: mostly questions, some history and file browsing"""
+
+    @task(5)
+    def ask_question(self):
+        self.ask(random.choice(STUDENT_QUESTIONS))
+
+    @task(2)
+    def get_chat_history(self):
+        self.get_history()
+
+    @task(1)
+    def browse_pdfs(self):
+        self.list_pdfs()
 
     @task(1)
     def health_check(self):
-        """Check system health"""
         with self.client.get(
             "/health", catch_response=True, name="Health Check"
         ) as response:
-            if response.status_code == 200:
+            check_json(response, "status")
+
+
+class ExamRushUser(TutorBotUser):
+    """Night before the exam: rapid-fire, heavily duplicated questions"""
+
+    wait_time = between(0.5, 1.5)
+
+    @task(9)
+    def ask_hot_question(self):
+        self.ask(random.choice(EXAM_RUSH_QUESTIONS), name="Ask Question (exam)")
+
+    @task(1)
+    def get_chat_history(self):
+        self.get_history()
+
+
+class LongSessionUser(TutorBotUser):
+    """Multi-turn tutoring session: one topic, many follow-ups, history reloads"""
+
+    wait_time = between(3, 8)
+
+    def on_start(self):
+        super().on_start()
+        self.mode = random.choice(ITS_MODES)
+        self.turn = 0
+
+    @task
+    def next_turn(self):
+        if self.turn == 0:
+            question = random.choice(STUDENT_QUESTIONS)
+        else:
+            question = random.choice(FOLLOW_UPS)
+        self.ask(question, self.mode, name="Ask Question (session)")
+        self.get_history()
+        self.turn += 1
+        if self.turn >= 20:
+            # Start a fresh session with a new identity
+            self.on_start()
+
+
+class StreamingUser(TutorBotUser):
+    """Uses /api/query/stream and reports time-to-first-token separately"""
+
+    @task
+    def ask_streaming(self):
+        payload = {
+            "question": random.choice(STUDENT_QUESTIONS),
+            "mode": random.choice(ITS_MODES),
+            "anon_user_id": self.user_id,
+        }
+        start = time.perf_counter()
+        ttft_ms = None
+        with self.client.post(
+            "/api/query/stream",
+            json=payload,
+            stream=True,
+            catch_response=True,
+            name="Ask Question (stream)",
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"Got status {response.status_code}")
+                return
+            done = False
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                if json.loads(line).get("type") == "done":
+                    done = True
+            if done:
                 response.success()
             else:
-                response.failure(f"Got status {response.status_code}")
+                response.failure("Stream ended without a done event")
+
+        if ttft_ms is not None:
+            self.environment.events.request.fire(
+                request_type="STREAM",
+                name="Time To First Token",
+                response_time=ttft_ms,
+                response_length=0,
+                exception=None,
+                context={},
+            )
 
 
 class AdminUser(HttpUser):
-    """Simulates an admin user (less frequent, different actions)"""
+    """Simulates an admin user (less frequent, read-only checks)"""
 
     wait_time = between(5, 15)
 
-    @task(1)
-    def check_index_stats(self):
-        """Check RAG index statistics"""
-        with self.client.post("/api/ingest", catch_response=True) as response:
-            # This endpoint can return success or error depending on content
-            if response.status_code in [200, 400]:
-                response.success()
-            else:
-                response.failure(f"Got status {response.status_code}")
+    @task
+    def check_files(self):
+        with self.client.get(
+            "/api/files", catch_response=True, name="Admin List PDFs"
+        ) as response:
+            check_json(response, "files")
 
 
-# Performance Test Scenarios
+class IngestAdminUser(HttpUser):
+    """Uploads a new lecture and re-ingests every minute or two"""
 
+    wait_time = between(60, 120)
 
-class QuickTest(HttpUser):
-    """Quick test: 10 users for 1 minute"""
+    def on_start(self):
+        self.lecture = 100 + random.randint(0, 899)
+
+    @task
+    def upload_and_ingest(self):
+        self.lecture += 1
+        path = Path(tempfile.gettempdir()) / f"loadtest-lecture-{self.lecture}.pdf"
+        write_pdf(path, make_lecture(random.Random(self.lecture), self.lecture, 15))
+        with open(path, "rb") as f:
+            with self.client.post(
+                "/api/upload",
+                files={"file": (path.name, f, "application/pdf")},
+                catch_response=True,
+                name="Upload PDF",
+            ) as response:
+                check_json(response, "status")
+        path.unlink(missing_ok=True)
 
-    # Run with: locust -f load_test.py --users 10 --spawn-rate 2 --run-time 1m QuickTest
-    tasks = [TutorBotUser]
-    wait_time = between(1, 2)
+        with self.client.post(
+            "/api/ingest", catch_response=True, name="Ingest"
+        ) as response:
+            check_json(response, "status")
+
+
+# ---------------------------------------------------------------------------
+# Step-load ramp with automatic saturation detection
+# ---------------------------------------------------------------------------
+
+if os.getenv("LOAD_SHAPE") == "step":
+
+    class StepLoadShape(LoadTestShape):
+        """
+        Add --step-users every --step-seconds. After each step, if p95 exceeds
+        --target-p95-ms or the error rate exceeds --max-error-rate, the
+        previous step is recorded as the saturation point and the test stops.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.step = 0
+            self.users = 0
+
+        def tick(self):
+            global step_stats
+            options = self.runner.environment.parsed_options
+            run_time = self.get_run_time()
+            step = int(run_time // options.step_seconds)
+
+            if step != self.step:
+                result = step_stats.summary()
+                result["users"] = self.users
+                result["p95_ms"] = round(step_stats.merged().percentile(95), 1)
+                step_results.append(result)
+                print(
+                    f"[STEP] {self.users} users: {result['rps']} rps, "
+                    f"p95 {result['p95_ms']}ms, errors {result['error_rate']:.2%}"
+                )
+                step_stats = StatsWindow()
+                self.step = step
+
+                if (
+                    result["p95_ms"] > options.target_p95_ms
+                    or result["error_rate"] > options.max_error_rate
+                ):
+                    previous = step_results[-2] if len(step_results) > 1 else None
+                    saturation.update(
+                        {
+                            "saturated_at_users": self.users,
+                            "max_healthy_users": previous["users"] if previous else 0,
+                            "max_healthy_rps": previous["rps"] if previous else 0,
+                            "reason": (
+                                "p95"
+                                if result["p95_ms"] > options.target_p95_ms
+                                else "error_rate"
+                            ),
+                        }
+                    )
+                    print(f"[STEP] Saturation found: {saturation}")
+                    return None
+
+            self.users = min(options.max_users, (step + 1) * options.step_users)
+            if step * options.step_users >= options.max_users:
+                return None
+            return self.users, options.step_users
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, current in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or not current.get("count"):
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if base.get(metric) and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {metric}: {base[metric]} -> {current[metric]}"
+                )
+    if report["error_rate"] > baseline.get("error_rate", 0) + 0.01:
+        regressions.append(
+            f"error rate: {baseline.get('error_rate', 0):.2%} -> "
+            f"{report['error_rate']:.2%}"
+        )
+    return regressions
 
 
-class NormalLoad(HttpUser):
-    """Normal load: 50 users for 5 minutes"""
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    """Print performance summary and write the JSON report"""
+    report = run_stats.summary()
+    if not report["requests"]:
+        return
+    report["steps"] = step_results
+    report["saturation"] = saturation
 
-    # Run with: locust -f load_test.py --users 50 --spawn-rate 5 --run-time 5m NormalLoad
-    tasks = [TutorBotUser]
-    wait_time = between(1, 3)
+    print("\n" + "=" * 60)
+    print("PERFORMANCE SUMMARY")
+    print("=" * 60)
+    for endpoint, s in sorted(report["endpoints"].items()):
+        print(f"\n{endpoint}:")
+        print(f"  Requests: {s.get('count', 0)}  Errors: {s['errors']}")
+        if s.get("count"):
+            print(f"  Average: {s['mean_ms']:.0f}ms")
+            print(
+                f"  P50: {s['p50_ms']:.0f}ms  P95: {s['p95_ms']:.0f}ms  "
+                f"P99: {s['p99_ms']:.0f}ms"
+            )
+            print(f"  Min: {s['min_ms']:.0f}ms  Max: {s['max_ms']:.0f}ms")
 
+    print("\n" + "=" * 60)
+    print("Bottleneck Analysis:")
 
-class StressTest(HttpUser):
-    """Stress test: 100 users for 10 minutes"""
+    def mean(name):
+        return report["endpoints"].get(name, {}).get("mean_ms", 0)
 
-    # Run with: locust -f load_test.py --users 100 --spawn-rate 10 --run-time 10m StressTest
-    tasks = [TutorBotUser]
-    wait_time = between(1, 3)
+    if mean("Ask Question") > 3000:
+        print("⚠️  Query times > 3s: Groq API bottleneck (expected)")
+    if mean("Time To First Token") > 1500:
+        print("⚠️  TTFT > 1.5s: retrieval or queueing before the LLM is slow")
+    if mean("Get History") > 100:
+        print("⚠️  History times > 100ms: Consider PostgreSQL")
+    if mean("List PDFs") > 200:
+        print("⚠️  PDF listing slow: Check S3 configuration")
+    if saturation:
+        print(
+            f"📈 Saturation: healthy up to {saturation['max_healthy_users']} users "
+            f"({saturation['max_healthy_rps']} rps), limited by {saturation['reason']}"
+        )
+    print("=" * 60)
+
+    options = environment.parsed_options
+    if options and options.report_json:
+        path = Path(options.report_json)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        report["meta"] = {
+            "host": environment.host,
+            "user_classes": [cls.__name__ for cls in environment.user_classes],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        path.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {path}")
+
+    if options and options.baseline:
+        baseline = json.loads(Path(options.baseline).read_text())
+        regressions = compare_with_baseline(report, baseline, options.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) vs {options.baseline}:")
+            for line in regressions:
+                print(f"  - {line}")
+            environment.process_exit_code = 1
+        else:
+            print(f"✅ No regressions vs {options.baseline}")
 
 
 """
@@ -149,6 +577,7 @@ FAST (< 100ms):
 
 MEDIUM (100-500ms):
 - ChromaDB vector search (internal)
+- Time To First Token (streaming)
 
 SLOW (1-3 seconds):
 - POST /api/query (due to Groq LLM API call)
@@ -166,72 +595,3 @@ Success Criteria for 100 Users:
 ✅ No "database is locked" errors
 ✅ Memory usage < 1GB
 """
-
-
-import time
-
-# Custom metrics tracking
-from locust import events
-
-response_times = []
-
-
-@events.request.add_listener
-def on_request(request_type, name, response_time, response_length, exception, **kwargs):
-    """Track response times for analysis"""
-    if exception is None:
-        response_times.append(
-            {"endpoint": name, "time_ms": response_time, "timestamp": time.time()}
-        )
-
-
-@events.test_stop.add_listener
-def on_test_stop(environment, **kwargs):
-    """Print performance summary after test"""
-    if not response_times:
-        return
-
-    print("\n" + "=" * 60)
-    print("PERFORMANCE SUMMARY")
-    print("=" * 60)
-
-    # Group by endpoint
-    endpoints = {}
-    for rt in response_times:
-        ep = rt["endpoint"]
-        if ep not in endpoints:
-            endpoints[ep] = []
-        endpoints[ep].append(rt["time_ms"])
-
-    # Print stats for each endpoint
-    for endpoint, times in endpoints.items():
-        times.sort()
-        count = len(times)
-        avg = sum(times) / count
-        p50 = times[count // 2]
-        p95 = times[int(count * 0.95)] if count > 20 else times[-1]
-
-        print(f"\n{endpoint}:")
-        print(f"  Requests: {count}")
-        print(f"  Average: {avg:.0f}ms")
-        print(f"  P50: {p50:.0f}ms")
-        print(f"  P95: {p95:.0f}ms")
-        print(f"  Min: {min(times):.0f}ms")
-        print(f"  Max: {max(times):.0f}ms")
-
-    print("\n" + "=" * 60)
-    print("Bottleneck Analysis:")
-
-    query_times = endpoints.get("Ask Question", [])
-    if query_times and sum(query_times) / len(query_times) > 3000:
-        print("⚠️  Query times > 3s: Groq API bottleneck (expected)")
-
-    history_times = endpoints.get("Get History", [])
-    if history_times and sum(history_times) / len(history_times) > 100:
-        print("⚠️  History times > 100ms: Consider PostgreSQL")
-
-    files_times = endpoints.get("List PDFs", [])
-    if files_times and sum(files_times) / len(files_times) > 200:
-        print("⚠️  PDF listing slow: Check S3 configuration")
-
-    print("=" * 60)
@@ -1,33 +1,84 @@
+import asyncio
 import json
 import os
 import time
 from pathlib import Path
+from typing import Optional
 
-from dotenv import load_dotenv
-from fastapi import FastAPI, File, Request, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-
-from db import get_history, save_message
-from its import apply_its_mode
-from models import HistoryRequest, QueryRequest
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTasks
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import config  # noqa: F401 - loads .env before the modules below read it
+import request_trace
+from admission import AdmissionRejected, scheduler
+from answer_cache import answer_cache
+from batch_query import run_batch
+from cancellation import Cancelled, active_queries, current_token, until_cancelled
+from courses import (
+    DEFAULT_COURSE,
+    course_dir,
+    list_courses,
+    normalize_course,
+    s3_prefix,
+)
+from db import get_history, save_exchange
+from deferred import defer, deferred_stats
+from http_cache import CompressionMiddleware, PDFFiles, conditional_json, pdf_url
+from index_service import INDEX_SERVICE
+from index_snapshot import (
+    SNAPSHOT_AFTER_INGEST,
+    bootstrap,
+    publish_snapshot,
+    snapshot_stats,
+)
+from its import apply_its_mode, normalize_mode
+from llm_dispatch import dispatcher_stats
+from model_router import route_stats
+from models import BatchQueryRequest, HistoryRequest, PrefetchRequest, QueryRequest
+from prefetch import prefetch_cache
+from prewarm import PREWARM_AFTER_INGEST, prewarm_stats, start_prewarm
 from prompts import SYSTEM_PROMPT
+from rag_backend import LOCAL, answer_question, backend_stats, breakers, stream_backend
 from rag_engine import (
     PDF_UPLOAD_DIR,
     delete_pdf_from_database,
+    excerpt_query,
+    get_corpus_version,
+    get_course_stats,
     get_index_stats,
+    get_index_version,
+    get_index_versions,
     ingest_pdfs,
-    query_rag,
+    query_batcher,
+    retrieve_for_mode,
+    rollback_index,
+    stream_excerpt_query,
+    stream_query_rag,
+)
+from request_trace import (
+    RequestTraceMiddleware,
+    note,
+    question_hash,
+    slow_queries,
+    stage,
 )
 from s3_storage import (
     delete_file_from_s3,
     get_s3_file_url,
     is_s3_enabled,
+    list_s3_courses,
     list_s3_pdfs,
     upload_file_to_s3,
 )
+from stage_graph import StageGraph
+from summaries import SUMMARIES_AFTER_INGEST, start_summaries, summary_stats
 
-load_dotenv()
+# A fresh replica loads its courses' latest index snapshots from S3 instead
+# of re-embedding the PDFs (index_snapshot.py)
+bootstrap()
 
 app = FastAPI()
 
@@ -47,11 +98,17 @@ app.add_middleware(
     allow_origins=allowed_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Stage timings, slow-query log and X-Profile sampling for the query endpoints
+app.add_middleware(RequestTraceMiddleware)
+# gzip/brotli for JSON bodies (outermost, so it sees the final response)
+app.add_middleware(CompressionMiddleware)
 
 # MOUNT PDF DIRECTORY
 Path(PDF_UPLOAD_DIR).mkdir(exist_ok=True)
-app.mount("/pdfs", StaticFiles(directory=PDF_UPLOAD_DIR), name="pdfs")
+# ETag/Last-Modified 304s, Range requests and immutable content-hashed URLs
+app.mount("/pdfs", PDFFiles(directory=PDF_UPLOAD_DIR), name="pdfs")
 
 # Display names storage
 DISPLAY_NAMES_FILE = Path("display_names.json")
@@ -67,6 +124,13 @@ def load_display_names():
     return {}
 
 
+def display_key(course_id: str, filename: str) -> str:
+    # Default-course entries keep their original bare-filename keys
+    if course_id == DEFAULT_COURSE:
+        return filename
+    return f"{course_id}/{filename}"
+
+
 def save_display_names(display_names: dict):
     try:
         with open(DISPLAY_NAMES_FILE, "w") as f:
@@ -91,53 +155,565 @@ async def health_check():
     return health_data
 
 
+@app.get("/api/metrics")
+async def metrics():
+    return {
+        "llm": dispatcher_stats(),
+        "routes": route_stats.stats(),
+        "admission": scheduler.stats(),
+        "index": {"version": get_index_version(), "shared": bool(INDEX_SERVICE)},
+        "courses": await run_in_threadpool(get_course_stats),
+        "answer_cache": (
+            await run_in_threadpool(answer_cache.stats) if answer_cache else None
+        ),
+        "backends": backend_stats(),
+        "embedding_batches": query_batcher.stats() if query_batcher else None,
+        "deferred_writes": deferred_stats(),
+        "snapshots": snapshot_stats(),
+        "summaries": summary_stats(),
+        "prefetch": prefetch_cache.stats() if prefetch_cache else None,
+        "cancellation": active_queries.stats(),
+    }
+
+
+@app.get("/api/admin/slow-queries")
+async def list_slow_queries(limit: int = 50, min_ms: float = 0):
+    """Recent slow (or profiled) query requests, newest first."""
+    return {
+        "threshold_ms": request_trace.SLOW_QUERY_MS,
+        "recorded": slow_queries.total,
+        "queries": slow_queries.list(limit, min_ms),
+    }
+
+
+@app.get("/api/admin/slow-queries/{request_id}")
+async def get_slow_query(request_id: str):
+    """One logged request, including its sampling profile if it has one."""
+    record = slow_queries.get(request_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Request not in the log")
+    return record
+
+
+@app.get("/api/courses")
+async def courses():
+    extra = list_s3_courses() if is_s3_enabled() else []
+    return {"courses": list_courses(PDF_UPLOAD_DIR, extra), "default": DEFAULT_COURSE}
+
+
 @app.post("/api/upload")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(
+    file: UploadFile = File(...), course_id: Optional[str] = Form(None)
+):
     if not file.filename:
         return {"status": "error", "message": "No filename provided"}
     if not file.filename.endswith(".pdf"):
         return {"status": "error", "message": "Only PDF files allowed"}
+    try:
+        course_id = normalize_course(course_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
 
-    file_path = Path(PDF_UPLOAD_DIR) / file.filename
+    pdf_dir = course_dir(PDF_UPLOAD_DIR, course_id)
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    file_path = pdf_dir / file.filename
     file_content = await file.read()
     with open(file_path, "wb") as f:
         f.write(file_content)
 
     if is_s3_enabled():
-        success = upload_file_to_s3(file_path)
+        success = upload_file_to_s3(file_path, f"{s3_prefix(course_id)}{file.filename}")
         if not success:
             return {
                 "status": "warning",
                 "message": "File saved locally but S3 upload failed",
                 "filename": file.filename,
+                "course_id": course_id,
             }
 
-    return {"status": "success", "filename": file.filename}
+    return {"status": "success", "filename": file.filename, "course_id": course_id}
 
 
 @app.post("/api/ingest")
-async def ingest():
-    return ingest_pdfs()
+async def ingest(course_id: Optional[str] = None):
+    try:
+        course_id = normalize_course(course_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    # Parsing, embedding and the index build run off the event loop, so
+    # queries keep being served during an ingest
+    result = await run_in_threadpool(ingest_pdfs, course_id)
+    background = BackgroundTasks()
+    if result.get("status") == "success":
+        if SUMMARIES_AFTER_INGEST:
+            result["summaries"] = start_summaries(course_id)
+        if PREWARM_AFTER_INGEST:
+            result["prewarm"] = start_prewarm(course_id)
+        # Replicas bootstrap from this instead of re-embedding the PDFs
+        if SNAPSHOT_AFTER_INGEST and is_s3_enabled() and not INDEX_SERVICE:
+            defer(background, "snapshot", publish_snapshot, course_id)
+            result["snapshot"] = "publishing"
+    return JSONResponse(result, background=background)
+
+
+@app.post("/api/cache/prewarm")
+async def cache_prewarm(course_id: Optional[str] = None):
+    """Start pre-warming a course's answer cache in the background."""
+    try:
+        started = start_prewarm(course_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success" if started else "skipped", **prewarm_stats()}
+
+
+@app.post("/api/summaries/build")
+async def summaries_build(course_id: Optional[str] = None):
+    """Build a course's document summaries in the background."""
+    try:
+        started = start_summaries(course_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success" if started else "skipped", **summary_stats()}
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    if not answer_cache:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        **await run_in_threadpool(answer_cache.stats),
+        "prewarm": prewarm_stats(),
+    }
+
+
+@app.get("/api/suggested-questions")
+async def suggested_questions(course_id: Optional[str] = None):
+    """Pre-warmed questions for the current materials (answered instantly)."""
+    if not answer_cache:
+        return {"questions": []}
+    corpus_version = await run_in_threadpool(get_corpus_version, course_id)
+    questions = await run_in_threadpool(
+        answer_cache.prewarmed_questions, corpus_version, "direct"
+    )
+    return {"questions": questions}
+
+
+@app.get("/api/index/versions")
+async def index_versions(course_id: Optional[str] = None):
+    try:
+        return {"status": "success", **get_index_versions(course_id)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.post("/api/index/rollback")
+async def index_rollback(request: Request):
+    """Re-activate a kept index version (default: the previous one)."""
+    try:
+        data = await request.json()
+        return await run_in_threadpool(
+            rollback_index, data.get("course_id"), data.get("version")
+        )
+    except Exception as e:
+        print(f"[ROLLBACK ERROR] {e}")
+        return {"status": "error", "message": str(e)}
+
+
+def rejected_response(e: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+        content={"status": "error", "message": e.reason, "retry_after": e.retry_after},
+    )
+
+
+def cancelled_response(token):
+    """For a query cancelled before its answer: nothing is saved."""
+    active_queries.count("writes_skipped")
+    note(cancelled=token.reason, cancelled_at=token.stage)
+    return JSONResponse(
+        # 499: nginx's "client closed request", for the access logs
+        status_code=409 if token.reason == "superseded" else 499,
+        content={
+            "status": "cancelled",
+            "reason": token.reason,
+            "message": (
+                "Replaced by a newer question"
+                if token.reason == "superseded"
+                else "Client disconnected"
+            ),
+        },
+    )
+
+
+async def cached_answer(req: QueryRequest):
+    """
+    (corpus version, cached result or None) for an LLM answer request;
+    the version is what a fresh answer should be stored under.
+    """
+    if not answer_cache or req.response_type == "excerpts":
+        return None, None
+    with stage("cache", sample=False):
+        try:
+            corpus_version = await run_in_threadpool(get_corpus_version, req.course_id)
+        except Exception as e:
+            print(f"[CACHE] Corpus version unavailable: {e}")
+            return None, None
+        cached = await run_in_threadpool(
+            answer_cache.get, req.question, normalize_mode(req.mode), corpus_version
+        )
+    note(cached=cached is not None)
+    return corpus_version, cached
+
+
+def defer_cache_answer(
+    tasks: BackgroundTasks,
+    req: QueryRequest,
+    corpus_version: Optional[str],
+    answer: str,
+    citations: list,
+):
+    if corpus_version:
+        defer(
+            tasks,
+            "answer cache",
+            answer_cache.put,
+            req.question,
+            normalize_mode(req.mode),
+            corpus_version,
+            answer,
+            citations,
+        )
+
+
+def query_graph(req: QueryRequest, modified_question: str, tickets: list):
+    """
+    /api/query as a stage graph:
+
+        cache --+--> admit -----+--> answer
+                +--> retrieve --+
+
+    Retrieval runs while the request waits for an admission slot, so a
+    queued question reaches the LLM with its context already retrieved.
+    Tickets taken by "admit" go into `tickets` for the caller to release.
+    """
+    graph = StageGraph()
+    graph.add("cache", lambda: cached_answer(req))
+
+    async def admit(cache):
+        if cache[1]:
+            return None
+
+        async def acquire():
+            ticket = await scheduler.acquire(req.anon_user_id)
+            # Registered in the same step the slot is granted, so the
+            # caller releases it even if this stage is cancelled right after
+            tickets.append(ticket)
+            return ticket
+
+        ticket = await until_cancelled(current_token(), acquire(), "admission")
+        note(queue_ms=round(ticket.waited * 1000, 1))
+        return ticket
+
+    async def retrieve(cache):
+        if cache[1]:
+            return None
+        if prefetch_cache:
+            # Retrieved while the student was typing
+            prefetched = await prefetch_cache.take(
+                req.anon_user_id, req.question, req.mode, req.course_id
+            )
+            if prefetched:
+                return prefetched
+        try:
+            return await run_in_threadpool(
+                retrieve_for_mode, req.question, req.mode, req.course_id
+            )
+        except Exception as e:
+            # answer_question retrieves again (or fails over) on its own
+            print(f"[QUERY] Early retrieval failed: {e}")
+            return None
+
+    async def answer(cache, ticket, retrieved):
+        if cache[1]:
+            # Answered before (or pre-warmed): no admission, no LLM call
+            return cache[1]
+        # Local pipeline or LlamaCloud, whichever is healthy
+        return await answer_question(
+            modified_question,
+            SYSTEM_PROMPT,
+            mode=req.mode,
+            retrieval_query=req.question,
+            course_id=req.course_id,
+            retrieved=retrieved,
+        )
+
+    graph.add("admit", admit, "cache")
+    graph.add("retrieve", retrieve, "cache")
+    graph.add("answer", answer, "cache", "admit", "retrieve")
+    return graph
 
 
 @app.post("/api/query")
-async def query_ai(req: QueryRequest):
+async def query_ai(req: QueryRequest, request: Request):
+    note(question_hash=question_hash(req.question), mode=normalize_mode(req.mode))
     modified_question = apply_its_mode(req.question, req.mode)
     citations = []
+    excerpts = None
+    degraded = None
     answer = "Error processing request."
+    background = BackgroundTasks()
+    tickets = []
+    # Cancelled if the client disconnects or the user asks something else
+    token = active_queries.begin(req.anon_user_id, request)
+    graph = query_graph(req, modified_question, tickets)
 
     try:
-        result = query_rag(modified_question, SYSTEM_PROMPT)
+        if req.response_type == "excerpts":
+            # Retrieval only: cheap enough to skip the LLM admission queue
+            result = await run_in_threadpool(
+                excerpt_query, req.question, req.mode, course_id=req.course_id
+            )
+        else:
+            corpus_version, cached = await graph.result("cache")
+            result = await until_cancelled(token, graph.result("answer"))
+            note(**graph.timings("answer"))
+            if not cached and not result.get("degraded"):
+                defer_cache_answer(
+                    background,
+                    req,
+                    corpus_version,
+                    result["answer"],
+                    result["citations"],
+                )
         answer = result["answer"]
         citations = result["citations"]
+        excerpts = result.get("excerpts")
+        degraded = result.get("degraded")
+    except Cancelled:
+        return cancelled_response(token)
+    except AdmissionRejected as e:
+        if not e.overload:
+            return rejected_response(e)
+        # Server-wide overload: serve cited passages instead of a 429
+        try:
+            result = await run_in_threadpool(
+                excerpt_query, req.question, req.mode, course_id=req.course_id
+            )
+            answer, citations, excerpts = (
+                result["answer"],
+                result["citations"],
+                result["excerpts"],
+            )
+            degraded = "overload"
+        except Exception as e:
+            print(f"Error: {e}")
+            answer = "I'm having trouble accessing the course materials right now."
     except Exception as e:
         print(f"Error: {e}")
         answer = "I'm having trouble accessing the course materials right now."
+    finally:
+        graph.cancel()
+        for ticket in tickets:
+            ticket.release()
+        active_queries.end(token)
+
+    # History is written after the response is sent
+    defer(
+        background,
+        "conversation history",
+        save_exchange,
+        req.anon_user_id,
+        req.question,
+        answer,
+        req.mode,
+    )
+
+    response = {"content": answer, "citations": citations, "role": "assistant"}
+    if excerpts is not None:
+        response["excerpts"] = excerpts
+    if degraded:
+        response["degraded"] = degraded
+    return JSONResponse(response, background=background)
+
+
+@app.post("/api/query/stream")
+async def query_ai_stream(req: QueryRequest, request: Request):
+    """
+    Same as /api/query, but streams NDJSON lines as the answer is generated:
+    {"type": "token", "content": ...} per chunk, then one
+    {"type": "done", "citations": [...], "role": "assistant"}, or
+    {"type": "cancelled", "reason": "superseded"} if the user asked
+    something else meanwhile.
+    """
+    note(question_hash=question_hash(req.question), mode=normalize_mode(req.mode))
+    modified_question = apply_its_mode(req.question, req.mode)
+    token = active_queries.begin(req.anon_user_id, request)
+    corpus_version, cached = await cached_answer(req)
 
-    save_message(req.anon_user_id, "user", req.question, req.mode)
-    save_message(req.anon_user_id, "assistant", answer, req.mode)
-
-    return {"content": answer, "citations": citations, "role": "assistant"}
+    # Admit before the response starts so rejections are a plain 429
+    ticket = None
+    backend, remote = None, None
+    try:
+        if req.response_type != "excerpts" and not cached:
+            try:
+                ticket = await until_cancelled(
+                    token, scheduler.acquire(req.anon_user_id), "admission"
+                )
+                note(queue_ms=round(ticket.waited * 1000, 1))
+            except AdmissionRejected as e:
+                if not e.overload:
+                    active_queries.end(token)
+                    return rejected_response(e)
+                # Server-wide overload: stream cited passages instead of a 429
+
+        if ticket is not None:
+            backend, remote = await until_cancelled(
+                token,
+                stream_backend(
+                    modified_question, SYSTEM_PROMPT, req.question, req.course_id
+                ),
+                "backend",
+            )
+    except Cancelled:
+        if ticket:
+            ticket.release()
+        active_queries.end(token)
+        return cancelled_response(token)
+    started = time.perf_counter()
+    # Runs once the stream has ended; the generator queues its writes here
+    background = BackgroundTasks()
+    if ticket:
+        # Frees the slot even if the stream never started
+        background.add_task(ticket.release)
+    background.add_task(active_queries.end, token)
+    settled = False  # breakers[LOCAL] was told about this stream
+
+    def settle_local(ok: Optional[bool]):
+        """record() the stream's outcome, or release() if it was abandoned."""
+        nonlocal settled
+        if backend != LOCAL or settled:
+            return
+        settled = True
+        if ok is None:
+            # Says nothing about the backend, but a half-open breaker
+            # must not keep waiting for this probe
+            breakers[LOCAL].release()
+        else:
+            breakers[LOCAL].record(ok, time.perf_counter() - started)
+
+    # Also covers a stream that never started
+    background.add_task(settle_local, None)
+
+    if cached or remote:
+        # One piece: a cached answer, or LlamaCloud's (it doesn't stream)
+        answer = cached or remote
+        source = iter([("token", answer["answer"]), ("citations", answer["citations"])])
+    elif ticket is None:
+        source = stream_excerpt_query(req.question, req.mode, req.course_id)
+    else:
+        retrieved = None
+        if prefetch_cache:
+            retrieved = await prefetch_cache.take(
+                req.anon_user_id, req.question, req.mode, req.course_id
+            )
+        source = stream_query_rag(
+            modified_question,
+            SYSTEM_PROMPT,
+            mode=req.mode,
+            retrieval_query=req.question,
+            course_id=req.course_id,
+            retrieved=retrieved,
+        )
+
+    async def event_stream():
+        answer_parts = []
+        citations = []
+        degraded = None
+        try:
+            async for kind, value in iterate_in_threadpool(source):
+                if kind == "token":
+                    answer_parts.append(value)
+                    yield json.dumps({"type": "token", "content": value}) + "\n"
+                elif kind == "degraded":
+                    degraded = value
+                else:
+                    citations = value
+            answer = "".join(answer_parts)
+            settle_local(not degraded)
+            if ticket and not degraded:
+                defer_cache_answer(background, req, corpus_version, answer, citations)
+        except Cancelled:
+            # Superseded mid-answer (after a disconnect nobody reads this)
+            active_queries.count("writes_skipped")
+            note(cancelled=token.reason, cancelled_at=token.stage)
+            yield json.dumps({"type": "cancelled", "reason": token.reason}) + "\n"
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # Starlette stopped the stream because the client went away;
+            # the generation thread stops at its next chunk
+            token.cancel("disconnect")
+            active_queries.count("writes_skipped")
+            raise
+        except Exception as e:
+            settle_local(False)
+            print(f"Error: {e}")
+            answer = "I'm having trouble accessing the course materials right now."
+            yield json.dumps({"type": "token", "content": answer}) + "\n"
+        finally:
+            settle_local(None)  # no-op unless cancelled
+            if ticket:
+                ticket.release()
+
+        defer(
+            background,
+            "conversation history",
+            save_exchange,
+            req.anon_user_id,
+            req.question,
+            answer,
+            req.mode,
+        )
+        yield json.dumps(
+            {"type": "done", "citations": citations, "role": "assistant"}
+        ) + "\n"
+        active_queries.end(token)
+
+    return StreamingResponse(
+        event_stream(), media_type="application/x-ndjson", background=background
+    )
+
+
+@app.post("/api/prefetch")
+async def prefetch(req: PrefetchRequest):
+    """
+    Retrieve for the question being typed, so /api/query can skip it
+    (prefetch.py). Returns at once; the retrieval runs in the background.
+    """
+    if not prefetch_cache:
+        return {"status": "disabled"}
+    status = prefetch_cache.start(
+        req.anon_user_id, req.question, req.mode, req.course_id
+    )
+    return {"status": status}
+
+
+@app.post("/api/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    """
+    Answer a list of questions (instructor checks, evaluation runs) as NDJSON:
+    one {"type": "result", "index": ...} line per question as it finishes,
+    then {"type": "done", ...}. Nothing is saved to conversation history.
+    """
+
+    async def lines():
+        async for line in run_batch(
+            req.questions, req.mode, req.course_id, req.response_type
+        ):
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.post("/api/history")
@@ -145,26 +721,59 @@ async def get_conversation_history(req: HistoryRequest):
     return {"conversation": get_history(req.anon_user_id)}
 
 
+@app.get("/api/history")
+async def get_conversation_history_cached(request: Request, anon_user_id: str):
+    """
+    Same as POST /api/history, but with an ETag so a reload whose history
+    hasn't changed gets a 304 instead of the conversation again.
+    """
+    history = await run_in_threadpool(get_history, anon_user_id)
+    return conditional_json(
+        request, {"conversation": history}, cache_control="private, no-cache"
+    )
+
+
 @app.get("/api/files")
-async def list_files():
-    if is_s3_enabled():
-        files = list_s3_pdfs()
-    else:
-        files = [f.name for f in Path(PDF_UPLOAD_DIR).glob("*.pdf")]
+async def list_files(request: Request, course_id: Optional[str] = None):
+    try:
+        course_id = normalize_course(course_id)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
 
-    display_names = load_display_names()
+    prefix = s3_prefix(course_id)
     file_urls = {}
+    if is_s3_enabled():
+        files = list_s3_pdfs(prefix)
+    else:
+        paths = sorted(course_dir(PDF_UPLOAD_DIR, course_id).glob("*.pdf"))
+        files = [path.name for path in paths]
+        # Content-hashed URLs the browser may cache for good
+        for path in paths:
+            file_urls[path.name] = await run_in_threadpool(
+                pdf_url, PDF_UPLOAD_DIR, path
+            )
+
+    all_display_names = load_display_names()
+    display_names = {
+        filename: all_display_names[display_key(course_id, filename)]
+        for filename in files
+        if display_key(course_id, filename) in all_display_names
+    }
     if is_s3_enabled():
         for filename in files:
-            url = get_s3_file_url(filename)
+            url = get_s3_file_url(filename, prefix=prefix)
             if url:
                 file_urls[filename] = url
 
-    return {
-        "files": files,
-        "display_names": display_names,
-        "file_urls": file_urls if file_urls else None,
-    }
+    return conditional_json(
+        request,
+        {
+            "course_id": course_id,
+            "files": files,
+            "display_names": display_names,
+            "file_urls": file_urls if file_urls else None,
+        },
+    )
 
 
 @app.post("/api/delete-pdf")
@@ -174,19 +783,22 @@ async def delete_pdf(request: Request):
         filename = data.get("filename")
         if not filename:
             return {"status": "error", "message": "Filename required"}
+        course_id = normalize_course(data.get("course_id"))
 
-        file_path = Path(PDF_UPLOAD_DIR) / filename
-        delete_pdf_from_database(filename)
+        file_path = course_dir(PDF_UPLOAD_DIR, course_id) / filename
+        # Re-versions the index: keep it off the event loop like ingest
+        await run_in_threadpool(delete_pdf_from_database, filename, course_id)
 
         if is_s3_enabled():
-            delete_file_from_s3(filename)
+            await run_in_threadpool(delete_file_from_s3, filename, s3_prefix(course_id))
 
         if file_path.exists():
             file_path.unlink()
 
         display_names = load_display_names()
-        if filename in display_names:
-            del display_names[filename]
+        key = display_key(course_id, filename)
+        if key in display_names:
+            del display_names[key]
             save_display_names(display_names)
 
         return {"status": "success", "message": f"Deleted {filename}"}
@@ -204,22 +816,24 @@ async def set_display_name(request: Request):
 
         if not filename:
             return {"status": "error", "message": "Filename required"}
+        course_id = normalize_course(data.get("course_id"))
 
-        file_path = Path(PDF_UPLOAD_DIR) / filename
+        file_path = course_dir(PDF_UPLOAD_DIR, course_id) / filename
         if not file_path.exists():
             return {"status": "error", "message": "File not found"}
 
         display_names = load_display_names()
+        key = display_key(course_id, filename)
         if display_name:
-            display_names[filename] = display_name
-        elif filename in display_names:
-            del display_names[filename]
+            display_names[key] = display_name
+        elif key in display_names:
+            del display_names[key]
         save_display_names(display_names)
 
         return {
             "status": "success",
             "message": f"Display name updated",
-            "display_name": display_names.get(filename, filename),
+            "display_name": display_names.get(key, filename),
         }
     except Exception as e:
         print(f"[SET-DISPLAY-NAME ERROR] {e}")
@@ -0,0 +1,339 @@
+"""
+Mock Groq / OpenAI-compatible chat-completions server for load testing.
+Implements the streaming and non-streaming /chat/completions shape with
+configurable latency, token throughput, rate limiting and error injection,
+so load tests exercise our own code without spending the Groq daily quota.
+
+Usage:
+    python mock_groq_server.py --port 9000 --latency-ms 800 --tokens-per-sec 250
+    # then start the backend against it:
+    GROQ_API_BASE=http://localhost:9000/openai/v1 uvicorn main:app
+
+Every setting can also come from MOCK_* environment variables or be changed
+at runtime with POST /mock/config (see DEFAULT_CONFIG).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_CONFIG = {
+    # fixed | uniform | normal | lognormal | exponential
+    "latency_dist": os.getenv("MOCK_LATENCY_DIST", "lognormal"),
+    # Mean time to first token, and spread (stddev / half-width) around it
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", "300")),
+    "latency_jitter_ms": float(os.getenv("MOCK_LATENCY_JITTER_MS", "150")),
+    # Generation speed; 0 = instant
+    "tokens_per_sec": float(os.getenv("MOCK_TOKENS_PER_SEC", "250")),
+    "completion_tokens": int(os.getenv("MOCK_COMPLETION_TOKENS", "200")),
+    # Groq-style request/token budgets per minute; 0 = unlimited
+    "rpm_limit": int(os.getenv("MOCK_RPM_LIMIT", "0")),
+    "tpm_limit": int(os.getenv("MOCK_TPM_LIMIT", "0")),
+    # Random fault injection (probabilities 0..1)
+    "rate_limit_rate": float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "seed": os.getenv("MOCK_SEED"),
+}
+
+config = dict(DEFAULT_CONFIG)
+rng = random.Random(config["seed"])
+
+stats = {
+    "requests": 0,
+    "streamed": 0,
+    "rate_limited": 0,
+    "errors": 0,
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+
+WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+app = FastAPI(title="Mock Groq API")
+
+
+class MinuteBudget:
+    """Sliding one-minute window of request and token usage."""
+
+    def __init__(self):
+        self.events = deque()  # (timestamp, tokens)
+
+    def _trim(self, now: float):
+        cutoff = now - 60
+        while self.events and self.events[0][0] < cutoff:
+            self.events.popleft()
+
+    def check(self, tokens: int):
+        """
+        Record a request if it fits the budget.
+
+        Returns:
+            Seconds until the budget frees up, or 0 if the request was admitted
+        """
+        now = time.time()
+        self._trim(now)
+        used_requests = len(self.events)
+        used_tokens = sum(t for _, t in self.events)
+        over_rpm = config["rpm_limit"] and used_requests >= config["rpm_limit"]
+        over_tpm = config["tpm_limit"] and used_tokens + tokens > config["tpm_limit"]
+        if over_rpm or over_tpm:
+            oldest = self.events[0][0] if self.events else now
+            return max(0.1, oldest + 60 - now)
+        self.events.append((now, tokens))
+        return 0
+
+    def remaining(self):
+        self._trim(time.time())
+        return (
+            max(0, config["rpm_limit"] - len(self.events)),
+            max(0, config["tpm_limit"] - sum(t for _, t in self.events)),
+        )
+
+
+budget = MinuteBudget()
+
+
+def sample_latency() -> float:
+    """Time to first token in seconds, drawn from the configured distribution."""
+    mean = config["latency_ms"]
+    spread = config["latency_jitter_ms"]
+    dist = config["latency_dist"]
+
+    if dist == "uniform":
+        value = rng.uniform(mean - spread, mean + spread)
+    elif dist == "normal":
+        value = rng.gauss(mean, spread)
+    elif dist == "exponential":
+        value = rng.expovariate(1 / mean) if mean > 0 else 0
+    elif dist == "lognormal" and mean > 0:
+        # Parameterise so the distribution has the requested mean and stddev
+        variance = spread**2
+        sigma2 = math.log(1 + variance / mean**2)
+        mu = math.log(mean) - sigma2 / 2
+        value = rng.lognormvariate(mu, sigma2**0.5)
+    else:
+        value = mean
+    return max(0.0, value) / 1000
+
+
+def count_tokens(text: str) -> int:
+    # Rough llama-tokenizer estimate, good enough for budgets and usage stats
+    return max(1, len(text) // 4)
+
+
+def make_answer(messages: list, max_tokens: int) -> list:
+    prompt = " ".join(str(m.get("content", "")) for m in messages)
+    words = WORD_RE.findall(prompt) or ["answer"]
+    n_tokens = min(config["completion_tokens"], max_tokens or 10**9)
+    local = random.Random(prompt)
+    return [local.choice(words) for _ in range(n_tokens)]
+
+
+def rate_limit_response(retry_after: float, kind: str = "requests"):
+    remaining_requests, remaining_tokens = budget.remaining()
+    stats["rate_limited"] += 1
+    return JSONResponse(
+        status_code=429,
+        headers={
+            "retry-after": f"{retry_after:.2f}",
+            "x-ratelimit-remaining-requests": str(remaining_requests),
+            "x-ratelimit-remaining-tokens": str(remaining_tokens),
+        },
+        content={
+            "error": {
+                "message": (
+                    f"Rate limit reached for model on {kind} per minute. "
+                    f"Please try again in {retry_after:.2f}s."
+                ),
+                "type": kind,
+                "code": "rate_limit_exceeded",
+            }
+        },
+    )
+
+
+def chunk_payload(completion_id, model, created, delta, finish_reason=None, usage=None):
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        payload["x_groq"] = {"usage": usage}
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_tokens(completion_id, model, created, tokens, usage, ttft):
+    try:
+        await asyncio.sleep(ttft)
+        yield chunk_payload(
+            completion_id, model, created, {"role": "assistant", "content": ""}
+        )
+        delay = 1 / config["tokens_per_sec"] if config["tokens_per_sec"] > 0 else 0
+        for i, token in enumerate(tokens):
+            if delay:
+                await asyncio.sleep(delay)
+            text = token if i == 0 else f" {token}"
+            yield chunk_payload(completion_id, model, created, {"content": text})
+        yield chunk_payload(completion_id, model, created, {}, "stop", usage)
+        yield "data: [DONE]\n\n"
+    finally:
+        stats["in_flight"] -= 1
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "llama-3.3-70b-versatile")
+    max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+    stream = bool(body.get("stream"))
+
+    stats["requests"] += 1
+    prompt_tokens = count_tokens(" ".join(str(m.get("content", "")) for m in messages))
+
+    retry_after = budget.check(prompt_tokens + (max_tokens or 0))
+    if retry_after:
+        return rate_limit_response(retry_after)
+    if rng.random() < config["rate_limit_rate"]:
+        return rate_limit_response(rng.uniform(0.5, 3.0), kind="tokens")
+    if rng.random() < config["error_rate"]:
+        stats["errors"] += 1
+        status = rng.choice([500, 502, 503])
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": "Injected upstream error", "type": "server"}},
+        )
+
+    tokens = make_answer(messages, max_tokens)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+    stats["prompt_tokens"] += prompt_tokens
+    stats["completion_tokens"] += len(tokens)
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    ttft = sample_latency()
+
+    if stream:
+        stats["streamed"] += 1
+        return StreamingResponse(
+            stream_tokens(completion_id, model, created, tokens, usage, ttft),
+            media_type="text/event-stream",
+        )
+
+    try:
+        generation = (
+            len(tokens) / config["tokens_per_sec"] if config["tokens_per_sec"] else 0
+        )
+        await asyncio.sleep(ttft + generation)
+    finally:
+        stats["in_flight"] -= 1
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(tokens)},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": usage,
+    }
+
+
+@app.get("/openai/v1/models")
+@app.get("/v1/models")
+async def list_models():
+    models = ["llama-3.3-70b-versatile", "llama-3.1-8b-instant"]
+    return {
+        "object": "list",
+        "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in models],
+    }
+
+
+@app.get("/mock/stats")
+async def get_stats():
+    return {"stats": stats, "config": config}
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    """Change settings at runtime, e.g. to ramp up error rates mid-test."""
+    global rng
+    updates = await request.json()
+    unknown = [k for k in updates if k not in DEFAULT_CONFIG]
+    if unknown:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown settings: {unknown}"}
+        )
+    for key, value in updates.items():
+        default = DEFAULT_CONFIG[key]
+        config[key] = type(default)(value) if default is not None else value
+    if "seed" in updates:
+        rng = random.Random(config["seed"])
+    return {"config": config}
+
+
+@app.post("/mock/reset")
+async def reset_stats():
+    for key in stats:
+        stats[key] = 0
+    budget.events.clear()
+    return {"stats": stats}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock Groq chat-completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency-dist",
+        choices=["fixed", "uniform", "normal", "lognormal", "exponential"],
+    )
+    parser.add_argument("--latency-ms", type=float)
+    parser.add_argument("--latency-jitter-ms", type=float)
+    parser.add_argument("--tokens-per-sec", type=float)
+    parser.add_argument("--completion-tokens", type=int)
+    parser.add_argument("--rpm-limit", type=int)
+    parser.add_argument("--tpm-limit", type=int)
+    parser.add_argument("--rate-limit-rate", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--seed")
+    args = parser.parse_args()
+
+    for key in DEFAULT_CONFIG:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    rng = random.Random(config["seed"])
+
+    print(f"[MOCK GROQ] Listening on http://{args.host}:{args.port}/openai/v1")
+    print(f"[MOCK GROQ] Config: {json.dumps(config)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
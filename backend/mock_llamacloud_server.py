@@ -0,0 +1,145 @@
+"""
+Local stand-in for the two LlamaCloud endpoints llamacloud_client.py calls
+(pipeline retrieve and chat completions), with configurable latency and
+error injection, for exercising the backend failover without an account.
+
+Usage:
+    python mock_llamacloud_server.py --port 9100 --latency-ms 400
+    # then start the backend against it:
+    LLAMACLOUD_BASE_URL=http://localhost:9100 LLAMA_CLOUD_API_KEY=test \
+        LLAMACLOUD_INDEX_ID=mock RAG_BACKEND=llamacloud uvicorn main:app
+
+Settings can be changed at runtime with POST /mock/config, e.g.
+{"error_rate": 1} to watch the circuit breaker open.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+DEFAULT_CONFIG = {
+    "retrieve_latency_ms": float(os.getenv("MOCK_RETRIEVE_LATENCY_MS", "150")),
+    "chat_latency_ms": float(os.getenv("MOCK_CHAT_LATENCY_MS", "400")),
+    # Random fault injection (probabilities 0..1); a hang outlives any timeout
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "hang_rate": float(os.getenv("MOCK_HANG_RATE", "0")),
+    "chunks": int(os.getenv("MOCK_CHUNKS", "3")),
+}
+
+config = dict(DEFAULT_CONFIG)
+stats = {"retrieve": 0, "chat": 0, "errors": 0, "hangs": 0, "in_flight": 0}
+
+WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+app = FastAPI(title="Mock LlamaCloud API")
+
+
+async def simulate(kind: str):
+    """Latency plus injected faults; returns an error response or None."""
+    stats[kind] += 1
+    stats["in_flight"] += 1
+    try:
+        if random.random() < config["hang_rate"]:
+            stats["hangs"] += 1
+            await asyncio.sleep(3600)
+        await asyncio.sleep(config[f"{kind}_latency_ms"] / 1000)
+        if random.random() < config["error_rate"]:
+            stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"detail": "mock outage"})
+        return None
+    finally:
+        stats["in_flight"] -= 1
+
+
+@app.post("/api/v1/pipelines/{pipeline_id}/retrieve")
+async def retrieve(pipeline_id: str, request: Request):
+    body = await request.json()
+    error = await simulate("retrieve")
+    if error:
+        return error
+    words = WORD_RE.findall(body.get("query", "")) or ["topic"]
+    top_k = min(config["chunks"], body.get("dense_similarity_top_k") or 10**9)
+    return {
+        "pipeline_id": pipeline_id,
+        "retrieval_nodes": [
+            {
+                "node": {
+                    "text": f"Lecture notes on {' '.join(words)} (part {i + 1}).",
+                    "metadata": {
+                        "file_name": f"{pipeline_id}-lecture.pdf",
+                        "page_label": str(i + 1),
+                    },
+                },
+                "score": round(1 - i * 0.1, 2),
+            }
+            for i in range(top_k)
+        ],
+    }
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = await simulate("chat")
+    if error:
+        return error
+    question = str(body["messages"][-1]["content"]).rsplit(":", 1)[-1].strip()
+    return {
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": f"(LlamaCloud mock) An answer to: {question}",
+                },
+                "finish_reason": "stop",
+            }
+        ]
+    }
+
+
+@app.get("/mock/stats")
+async def get_stats():
+    return {"stats": stats, "config": config}
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    updates = await request.json()
+    unknown = [k for k in updates if k not in DEFAULT_CONFIG]
+    if unknown:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown settings: {unknown}"}
+        )
+    for key, value in updates.items():
+        config[key] = type(DEFAULT_CONFIG[key])(value)
+    return {"config": config}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock LlamaCloud API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--retrieve-latency-ms", type=float)
+    parser.add_argument("--chat-latency-ms", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--hang-rate", type=float)
+    parser.add_argument("--chunks", type=int)
+    args = parser.parse_args()
+
+    for key in DEFAULT_CONFIG:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+
+    print(f"[MOCK LLAMACLOUD] Listening on http://{args.host}:{args.port}")
+    print(f"[MOCK LLAMACLOUD] Config: {json.dumps(config)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
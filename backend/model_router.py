@@ -0,0 +1,117 @@
+"""
+Mode-aware model routing and generation profiles.
+Each ITS mode (see its.py) gets its own model, max_tokens, temperature and
+retrieval top_k. Short hints and Socratic prompts go to the fast model and
+are escalated to the large one when retrieval confidence is low. Per-route
+latency and token counts are recorded so the trade-off can be tuned.
+"""
+
+import os
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+from its import normalize_mode
+
+LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "llama-3.3-70b-versatile")
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "llama-3.1-8b-instant")
+# MODEL_ROUTING=false sends every mode down the original 70B route
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+# Escalate to LARGE_MODEL when the best chunk's cosine similarity is below
+# this (rag_engine.cosine_score puts every vector backend on that scale)
+ESCALATE_BELOW = float(os.getenv("ROUTER_ESCALATE_BELOW", "0.65"))
+
+
+class Route(NamedTuple):
+    name: str
+    model: str
+    max_tokens: Optional[int]
+    temperature: float
+    top_k: int
+    escalate: bool = False
+
+
+ROUTES = {
+    "hint": Route("hint", FAST_MODEL, 256, 0.5, 4, escalate=True),
+    "socratic": Route("socratic", FAST_MODEL, 384, 0.7, 6, escalate=True),
+    "direct": Route("direct", LARGE_MODEL, 1024, 0.7, 10),
+}
+
+# What every request used before routing existed
+LEGACY_ROUTE = Route("legacy", LARGE_MODEL, None, 0.7, 10)
+
+# Retrieval-only answers (no LLM call); "model" is just a label for metrics
+EXCERPT_ROUTE = Route("excerpts", "none", 0, 0.0, 5)
+
+
+def base_route(mode: str) -> Route:
+    """Route used for retrieval, before confidence is known."""
+    if not MODEL_ROUTING:
+        return LEGACY_ROUTE
+    return ROUTES[normalize_mode(mode)]
+
+
+def choose_route(mode: str, top_score: Optional[float]) -> Route:
+    """Final route once the retrieval scores are in."""
+    route = base_route(mode)
+    if (
+        route.escalate
+        and route.model != LARGE_MODEL
+        and (top_score is None or top_score < ESCALATE_BELOW)
+    ):
+        return route._replace(name=f"{route.name}+escalated", model=LARGE_MODEL)
+    return route
+
+
+class RouteStats:
+    """Rolling per-route latency and token counters for /api/metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(
+        self,
+        route: Route,
+        latency: float,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ):
+        with self.lock:
+            entry = self.routes.setdefault(
+                route.name,
+                {
+                    "model": route.model,
+                    "count": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latencies": deque(maxlen=500),
+                },
+            )
+            entry["count"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["latencies"].append(latency)
+
+    def stats(self) -> dict:
+        result = {}
+        with self.lock:
+            for name, entry in self.routes.items():
+                latencies = sorted(entry["latencies"])
+                n = len(latencies)
+                result[name] = {
+                    "model": entry["model"],
+                    "count": entry["count"],
+                    "avg_prompt_tokens": round(entry["prompt_tokens"] / entry["count"]),
+                    "avg_completion_tokens": round(
+                        entry["completion_tokens"] / entry["count"]
+                    ),
+                    "latency_ms": {
+                        "p50": round(1000 * latencies[n // 2], 1),
+                        "p95": round(1000 * latencies[min(n - 1, int(n * 0.95))], 1),
+                    },
+                }
+        return result
+
+
+route_stats = RouteStats()
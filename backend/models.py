@@ -1,13 +1,36 @@
 # Pydantic request/response models
 
-# from typing import Optional
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from courses import COURSE_ID_PATTERN
 
 
 class QueryRequest(BaseModel):
     question: str
     mode: str
     anon_user_id: str
+    # "answer" (LLM-generated) or "excerpts" (top passages, no LLM call)
+    response_type: str = "answer"
+    # Course namespace to search (None = DEFAULT_COURSE, see courses.py)
+    course_id: Optional[str] = Field(None, pattern=COURSE_ID_PATTERN)
+
+
+class PrefetchRequest(BaseModel):
+    # The partial question typed so far (see prefetch.py)
+    question: str = Field(..., max_length=2000)
+    mode: str
+    anon_user_id: str
+    course_id: Optional[str] = Field(None, pattern=COURSE_ID_PATTERN)
+
+
+class BatchQueryRequest(BaseModel):
+    # Answered like /api/query, but not saved to anyone's conversation
+    questions: List[str] = Field(..., min_length=1, max_length=500)
+    mode: str = "direct"
+    response_type: str = "answer"
+    course_id: Optional[str] = Field(None, pattern=COURSE_ID_PATTERN)
 
 
 class HistoryRequest(BaseModel):
@@ -0,0 +1,251 @@
+"""
+ONNX Runtime embedding backend (EMBED_PROVIDER=onnx).
+Runs the same bge-small-en-v1.5 model as HuggingFaceEmbedding, but from an
+exported ONNX graph with dynamic int8 quantization, so CPU-only boxes don't
+need PyTorch at serve time and the thread count is under our control.
+
+Usage:
+    python onnx_embedding.py export     # fetch the ONNX graph + tokenizer, quantize
+    python onnx_embedding.py check      # compare against the PyTorch embeddings
+"""
+
+import argparse
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+MODEL_NAME = "BAAI/bge-small-en-v1.5"
+# Same query prefix HuggingFaceEmbedding applies to BGE English models
+QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./onnx_models/bge-small-en-v1.5")
+# "int8" (dynamic quantization) or "fp32" (the unquantized export)
+ONNX_PRECISION = os.getenv("ONNX_PRECISION", "int8")
+# 0 = let ONNX Runtime pick (one thread per physical core)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+MODEL_FILES = {"fp32": "model.onnx", "int8": "model_int8.onnx"}
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """bge-small CLS-pooled, L2-normalised embeddings via ONNX Runtime."""
+
+    model_name: str = MODEL_NAME
+    model_dir: str = ONNX_MODEL_DIR
+    precision: str = ONNX_PRECISION
+    threads: int = EMBED_THREADS
+    max_length: int = 512
+    query_instruction: str = QUERY_INSTRUCTION
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("embed_batch_size", EMBED_BATCH_SIZE)
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = Path(self.model_dir) / MODEL_FILES[self.precision]
+        if not model_path.exists():
+            raise FileNotFoundError(
+                f"{model_path} not found; run: python onnx_embedding.py export"
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [i.name for i in self._session.get_inputs()]
+
+        self._tokenizer = Tokenizer.from_file(
+            str(Path(self.model_dir) / "tokenizer.json")
+        )
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        self._tokenizer.enable_padding(
+            pad_id=self._tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]"
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        # Batch similar lengths together so short queries aren't padded to 512
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.embed_batch_size):
+            batch = order[start : start + self.embed_batch_size]
+            encodings = self._tokenizer.encode_batch([texts[i] for i in batch])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array(
+                    [e.attention_mask for e in encodings], dtype=np.int64
+                ),
+                "token_type_ids": np.array(
+                    [e.type_ids for e in encodings], dtype=np.int64
+                ),
+            }
+            hidden = self._session.run(
+                None, {name: feeds[name] for name in self._input_names}
+            )[0]
+            cls = hidden[:, 0, :]
+            cls = cls / np.linalg.norm(cls, axis=1, keepdims=True).clip(min=1e-12)
+            for i, vector in zip(batch, cls):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([self.query_instruction + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Many query embeddings in one batched run (see rag_engine.embed_queries)."""
+        return self._embed([self.query_instruction + q for q in queries])
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+
+# ---------------------------------------------------------------------------
+# Export / equivalence check
+# ---------------------------------------------------------------------------
+
+
+def export_model(out_dir: Path):
+    """
+    Fetch the ONNX graph the model repo publishes (falling back to a torch
+    export when it isn't available), then write an int8 copy next to it.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fp32_path = out_dir / MODEL_FILES["fp32"]
+
+    from huggingface_hub import hf_hub_download
+
+    shutil.copy(hf_hub_download(MODEL_NAME, "tokenizer.json"), out_dir)
+    try:
+        shutil.copy(hf_hub_download(MODEL_NAME, "onnx/model.onnx"), fp32_path)
+        print(f"[ONNX] Downloaded {MODEL_NAME} ONNX graph")
+    except Exception as e:
+        print(f"[ONNX] No published ONNX graph ({e}), exporting with torch...")
+        import torch
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(MODEL_NAME).eval()
+        dummy = torch.ones(1, 8, dtype=torch.long)
+        axes = {0: "batch", 1: "sequence"}
+        torch.onnx.export(
+            model,
+            (dummy, dummy, torch.zeros_like(dummy)),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": axes,
+                "attention_mask": axes,
+                "token_type_ids": axes,
+                "last_hidden_state": axes,
+            },
+            opset_version=17,
+        )
+
+    quantize(fp32_path, out_dir / MODEL_FILES["int8"])
+
+
+def quantize(fp32_path: Path, int8_path: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    print(
+        f"[ONNX] Quantized {fp32_path.name} ({fp32_path.stat().st_size >> 20} MB)"
+        f" -> {int8_path.name} ({int8_path.stat().st_size >> 20} MB)"
+    )
+
+
+def check_equivalence(model_dir: str, precision: str, min_cosine: float) -> bool:
+    """
+    Embed lecture text and questions with both backends and compare.
+    Passes when every pair's cosine similarity is at least min_cosine.
+    """
+    import random
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    from synthetic_corpus import TOPICS, make_lecture
+
+    rng = random.Random(0)
+    texts = ["\n".join(page) for n in range(4) for page in make_lecture(rng, n + 1, 5)]
+    questions = [f"How do {topic.lower()} work?" for topic in TOPICS]
+
+    reference = HuggingFaceEmbedding(model_name=MODEL_NAME)
+    candidate = OnnxEmbedding(model_dir=model_dir, precision=precision)
+    embeddings = {}
+    for name, model in (("torch", reference), ("onnx", candidate)):
+        embeddings[name] = (
+            np.asarray(model.get_text_embedding_batch(texts)),
+            np.asarray([model.get_query_embedding(q) for q in questions]),
+        )
+
+    ok = True
+    for i, kind in enumerate(("text", "query")):
+        ref, got = embeddings["torch"][i], embeddings["onnx"][i]
+        cosines = (ref * got).sum(axis=1) / (
+            np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1)
+        )
+        print(
+            f"[ONNX] {kind}: n={len(cosines)} min cosine {cosines.min():.4f}, "
+            f"mean {cosines.mean():.4f}"
+        )
+        ok = ok and cosines.min() >= min_cosine
+
+    # Do both rank the same top-5 passages for each question?
+    top = {
+        name: np.argsort(-(queries @ docs.T), axis=1)[:, :5]
+        for name, (docs, queries) in embeddings.items()
+    }
+    overlap = np.mean(
+        [len(set(a) & set(b)) / 5 for a, b in zip(top["torch"], top["onnx"])]
+    )
+    print(f"[ONNX] top-5 retrieval overlap with PyTorch: {overlap:.2%}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX embedding backend tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Fetch/export and quantize the model")
+    export.add_argument("--out", type=Path, default=Path(ONNX_MODEL_DIR))
+    check = sub.add_parser("check", help="Compare against the PyTorch model")
+    check.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    check.add_argument("--precision", choices=list(MODEL_FILES), default=ONNX_PRECISION)
+    check.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.out)
+    elif not check_equivalence(args.model_dir, args.precision, args.min_cosine):
+        print(f"[ONNX] FAILED: cosine similarity below {args.min_cosine}")
+        sys.exit(1)
+    else:
+        print("[ONNX] Embeddings match the PyTorch model")
+
+
+if __name__ == "__main__":
+    main()
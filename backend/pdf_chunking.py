@@ -0,0 +1,164 @@
+"""
+Page- and layout-aware chunking for lecture slides (CHUNKING=pages).
+The PDF reader yields one Document per page. Rather than running
+SentenceSplitter over each page as-is, PageAwareNodeParser
+  - strips headers/footers repeated across a deck, and bare page numbers,
+  - merges runs of tiny slides (titles, section dividers) into one chunk,
+  - splits long pages without crossing page boundaries, and
+  - records the exact page (or page range, "4-5") in metadata["page"], so
+    citations don't have to search the PDF text for it.
+CHUNKING=sentences keeps the original SentenceSplitter behaviour.
+"""
+
+import os
+import re
+from collections import Counter
+from itertools import groupby
+from pathlib import Path
+from typing import Any, List, Sequence, Set
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# Slides shorter than this (after stripping) are merged with their neighbours
+MIN_CHUNK_CHARS = int(os.getenv("MIN_CHUNK_CHARS", "300"))
+
+# Lines this close to the top/bottom of a page are header/footer candidates,
+# and are boilerplate when they repeat on at least this share of a deck
+EDGE_LINES = 2
+BOILERPLATE_SHARE = 0.5
+PAGE_NUMBER = re.compile(r"^(page|slide)?\s*\d+\s*((/|of)\s*\d+)?$", re.IGNORECASE)
+
+
+def normalize_line(line: str) -> str:
+    """Case/whitespace-insensitive, with numbers masked ("Slide 3" ~ "Slide 4")."""
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+def edge_indexes(lines: List[str]) -> Set[int]:
+    nonempty = [i for i, line in enumerate(lines) if line.strip()]
+    return set(nonempty[:EDGE_LINES] + nonempty[-EDGE_LINES:])
+
+
+def find_boilerplate(pages: List[List[str]]) -> Set[str]:
+    """Normalized edge lines that repeat on most pages of one deck."""
+    if len(pages) < 3:
+        return set()
+    counts = Counter()
+    for lines in pages:
+        counts.update({normalize_line(lines[i]) for i in edge_indexes(lines)})
+    threshold = BOILERPLATE_SHARE * len(pages)
+    return {line for line, n in counts.items() if n >= threshold}
+
+
+def strip_page(lines: List[str], boilerplate: Set[str]) -> str:
+    edges = edge_indexes(lines)
+    return "\n".join(
+        line
+        for i, line in enumerate(lines)
+        if i not in edges
+        or not (normalize_line(line) in boilerplate or PAGE_NUMBER.match(line.strip()))
+    ).strip()
+
+
+def strip_deck(pages: List[str]) -> List[str]:
+    """A deck's page texts without its repeated headers/footers and page numbers."""
+    lines = [page.splitlines() for page in pages]
+    boilerplate = find_boilerplate(lines)
+    return [strip_page(page_lines, boilerplate) for page_lines in lines]
+
+
+def deck_title(texts: List[str], file_name: str) -> str:
+    """The title slide's first line, else the file name ("lecture-03 trees")."""
+    first = next((t.strip().split("\n", 1)[0] for t in texts if t.strip()), "")
+    return first[:80] or Path(file_name).stem.replace("_", " ")
+
+
+def group_pages(texts: List[str], min_chars: int, max_chars: int) -> List[List[int]]:
+    """
+    Page indexes to chunk together: each page on its own, except that tiny
+    pages join their neighbours while the group still fits in max_chars.
+    Empty pages are dropped.
+    """
+    groups, current, size = [], [], 0
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        both_full = size >= min_chars and len(text) >= min_chars
+        if current and (both_full or size + len(text) > max_chars):
+            groups.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += len(text)
+    if current:
+        groups.append(current)
+    return groups
+
+
+class PageAwareNodeParser(NodeParser):
+    """Chunks per page (or run of tiny pages) with deck boilerplate removed."""
+
+    chunk_size: int = CHUNK_SIZE
+    chunk_overlap: int = CHUNK_OVERLAP
+    min_chunk_chars: int = MIN_CHUNK_CHARS
+
+    _splitter: SentenceSplitter = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._splitter = SentenceSplitter(
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PageAwareNodeParser"
+
+    def _parse_nodes(
+        self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any
+    ) -> List[BaseNode]:
+        # The reader emits each file's pages consecutively and in order
+        parsed = []
+        for _, pages in groupby(nodes, key=lambda n: n.metadata.get("file_name")):
+            parsed.extend(self._parse_file(list(pages)))
+        return parsed
+
+    def _parse_file(self, pages: List[BaseNode]) -> List[BaseNode]:
+        if not all("page_label" in page.metadata for page in pages):
+            # Not a paged document: plain sentence splitting
+            return self._splitter.get_nodes_from_documents(pages)
+
+        texts = strip_deck([page.get_content() for page in pages])
+
+        nodes = []
+        # ~3 characters per token keeps a merged group within one chunk
+        for group in group_pages(texts, self.min_chunk_chars, self.chunk_size * 3):
+            first, last = group[0] + 1, group[-1] + 1
+            page = str(first) if first == last else f"{first}-{last}"
+            text = "\n\n".join(texts[i] for i in group)
+            splits = self._splitter.split_text(text)
+            for node in build_nodes_from_splits(splits, pages[group[0]]):
+                node.metadata["page"] = page
+                node.excluded_embed_metadata_keys = [
+                    *node.excluded_embed_metadata_keys,
+                    "page",
+                ]
+                node.excluded_llm_metadata_keys = [
+                    *node.excluded_llm_metadata_keys,
+                    "page",
+                ]
+                nodes.append(node)
+        return nodes
+
+
+def make_node_parser(kind: str) -> NodeParser:
+    """Node parser for a CHUNKING mode: "pages" or "sentences"."""
+    if kind == "sentences":
+        return SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    if kind == "pages":
+        return PageAwareNodeParser()
+    raise ValueError(f"Unknown CHUNKING mode: {kind}")
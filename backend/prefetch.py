@@ -0,0 +1,192 @@
+"""
+Speculative retrieval while the student types (POST /api/prefetch).
+ChatPage.tsx posts the partial question once typing pauses. The question
+is retrieved here the same way /api/query would (retrieve_for_mode) and
+kept per anon_user_id for PREFETCH_TTL seconds. When the question is
+submitted, /api/query and /api/query/stream reuse the prefetched nodes if:
+  - the text is close enough to what was prefetched (PREFETCH_SIMILARITY)
+  - the mode, course and corpus version are the same
+so embedding and vector search are already done when the student hits
+send. A prefetch still running at that point is awaited, not repeated.
+
+It stays cheap:
+  - one prefetch per user at a time
+  - none while the admission queue has anyone waiting
+  - only for questions of PREFETCH_MIN_CHARS or more
+Entries live in the worker's memory. With several uvicorn workers, a
+prefetch only helps if the query lands on the same worker; otherwise the
+query retrieves as usual.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import scheduler
+from answer_cache import normalize_question
+from courses import normalize_course
+from its import normalize_mode
+from rag_engine import get_corpus_version, retrieve_for_mode
+from request_trace import note
+
+PREFETCH = os.getenv("PREFETCH", "true").lower() == "true"
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "30"))
+PREFETCH_MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
+# difflib ratio between the prefetched and the submitted question
+PREFETCH_SIMILARITY = float(os.getenv("PREFETCH_SIMILARITY", "0.9"))
+PREFETCH_MAX_USERS = int(os.getenv("PREFETCH_MAX_USERS", "5000"))
+
+
+def similar(a: str, b: str) -> float:
+    a, b = normalize_question(a), normalize_question(b)
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class Prefetch:
+    def __init__(self, question: str, mode: str, course_id: str):
+        self.question = question
+        self.mode = mode
+        self.course_id = course_id
+        self.created = time.monotonic()
+        self.corpus_version = None
+        self.seconds = None  # how long the retrieval took
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        started = time.perf_counter()
+        self.corpus_version = await run_in_threadpool(
+            get_corpus_version, self.course_id
+        )
+        result = await run_in_threadpool(
+            retrieve_for_mode, self.question, self.mode, self.course_id
+        )
+        self.seconds = time.perf_counter() - started
+        return result
+
+
+class PrefetchCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Prefetch]" = OrderedDict()
+        self.counters = {
+            "prefetched": 0,
+            "skipped": 0,
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "saved_ms": 0.0,
+        }
+
+    def start(
+        self, anon_user_id: str, question: str, mode: str, course_id: Optional[str]
+    ) -> str:
+        """Start retrieving for a partial question; returns what happened."""
+        question = question.strip()
+        if len(question) < PREFETCH_MIN_CHARS:
+            reason = "too_short"
+        elif scheduler.queue:
+            # Queued questions need the CPU more than guesses do
+            reason = "busy"
+        else:
+            reason = None
+        course_id = normalize_course(course_id)
+        mode = normalize_mode(mode)
+        with self.lock:
+            current = self.entries.get(anon_user_id)
+            if reason is None and current and not current.task.done():
+                reason = "in_flight"
+            elif (
+                reason is None
+                and current
+                and (current.mode, current.course_id) == (mode, course_id)
+                and normalize_question(current.question) == normalize_question(question)
+            ):
+                reason = "unchanged"
+            if reason:
+                self.counters["skipped"] += 1
+                return reason
+            entry = Prefetch(question, mode, course_id)
+            entry.task = asyncio.ensure_future(entry.run())
+            entry.task.add_done_callback(self._done)
+            self.entries[anon_user_id] = entry
+            self.entries.move_to_end(anon_user_id)
+            while len(self.entries) > PREFETCH_MAX_USERS:
+                self.entries.popitem(last=False)
+            self.counters["prefetched"] += 1
+        return "started"
+
+    @staticmethod
+    def _done(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"[PREFETCH] Retrieval failed: {task.exception()}")
+
+    async def take(
+        self, anon_user_id: str, question: str, mode: str, course_id: Optional[str]
+    ) -> Optional[tuple]:
+        """
+        The prefetched (nodes, route) for a submitted question, or None.
+        An entry is used at most once.
+        """
+        with self.lock:
+            entry = self.entries.pop(anon_user_id, None)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > PREFETCH_TTL:
+            return self._miss("expired", "expired")
+        if (
+            entry.mode != normalize_mode(mode)
+            or entry.course_id != normalize_course(course_id)
+            or similar(entry.question, question) < PREFETCH_SIMILARITY
+        ):
+            return self._miss("misses", "miss")
+        try:
+            waited = time.perf_counter()
+            result = await asyncio.shield(entry.task)
+            waited = time.perf_counter() - waited
+        except Exception:
+            return self._miss("misses", "failed")
+        try:
+            corpus_version = await run_in_threadpool(get_corpus_version, course_id)
+        except Exception as e:
+            # e.g. the index service is restarting; the query retrieves as usual
+            print(f"[PREFETCH] Corpus version check failed: {e}")
+            return self._miss("misses", "failed")
+        if corpus_version != entry.corpus_version:
+            # Re-ingested since
+            return self._miss("expired", "stale")
+
+        saved_ms = max(0.0, (entry.seconds - waited) * 1000)
+        with self.lock:
+            self.counters["hits"] += 1
+            self.counters["saved_ms"] += saved_ms
+        note(prefetch="hit", prefetch_saved_ms=round(saved_ms, 1))
+        return result
+
+    def _miss(self, counter: str, outcome: str):
+        with self.lock:
+            self.counters[counter] += 1
+        note(prefetch=outcome)
+        return None
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            users = len(self.entries)
+        used = counters["hits"] + counters["misses"] + counters["expired"]
+        return {
+            **counters,
+            "saved_ms": round(counters["saved_ms"], 1),
+            "users": users,
+            "hit_rate": round(counters["hits"] / used, 3) if used else 0,
+        }
+
+
+prefetch_cache = PrefetchCache() if PREFETCH else None
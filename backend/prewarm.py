@@ -0,0 +1,214 @@
+"""
+Answer cache pre-warming (PREWARM_AFTER_INGEST=true, POST /api/cache/prewarm
+or `python prewarm.py --course <id>`).
+After an ingest, guesses what students will ask about the new material and
+answers it in every ITS mode ahead of time, so the first students to ask
+get a cached answer instead of waiting on the LLM. Questions come from
+  - slide headings (the first line of each page once the deck's repeated
+    header/footer is stripped), plus an overview question per deck, and
+  - the course's most-asked questions, whose cached answers belong to the
+    corpus version the ingest just replaced.
+Runs at background priority: each question waits until nobody is queued
+and half the pipeline slots are free (FairQueueScheduler.acquire_background),
+and the run never goes faster than PREWARM_RATE_PER_MIN LLM calls.
+Whether it paid off shows in /api/cache/stats: by_source.prewarm.entries_hit.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionRejected
+from answer_cache import answer_cache, normalize_question
+from background_jobs import BackgroundRuns
+from courses import course_dir, normalize_course
+from its import ITS_MODES, apply_its_mode
+from pdf_chunking import PAGE_NUMBER, deck_title, strip_deck
+from prompts import SYSTEM_PROMPT
+from rag_engine import PDF_UPLOAD_DIR, get_corpus_version, query_rag, read_page_texts
+
+PREWARM_AFTER_INGEST = os.getenv("PREWARM_AFTER_INGEST", "false").lower() == "true"
+# LLM calls per minute a run may spend (each question costs one per ITS mode)
+PREWARM_RATE_PER_MIN = float(os.getenv("PREWARM_RATE_PER_MIN", "20"))
+# Questions per run, before multiplying by the ITS modes
+PREWARM_MAX_QUESTIONS = int(os.getenv("PREWARM_MAX_QUESTIONS", "60"))
+PREWARM_HEADINGS_PER_DOC = int(os.getenv("PREWARM_HEADINGS_PER_DOC", "8"))
+PREWARM_POPULAR_QUESTIONS = int(os.getenv("PREWARM_POPULAR_QUESTIONS", "20"))
+
+# Longest slide title we'd turn into a question
+MAX_HEADING_WORDS = 10
+
+runs = BackgroundRuns("__prewarm__")
+
+
+def looks_like_heading(line: str) -> bool:
+    return (
+        0 < len(line.split()) <= MAX_HEADING_WORDS
+        and line[-1] not in ".,;:"
+        and any(c.isalpha() for c in line)
+        and not PAGE_NUMBER.match(line)
+    )
+
+
+def deck_questions(pdf_path: Path, max_headings: int) -> List[str]:
+    """An overview question plus one question per distinct slide heading."""
+    texts = strip_deck(read_page_texts(str(pdf_path), pdf_path.stat().st_mtime))
+    title = deck_title(texts, pdf_path.name)
+
+    headings = []
+    for text in texts:
+        first = text.split("\n", 1)[0].strip()
+        if looks_like_heading(first) and first not in headings and first != title:
+            headings.append(first)
+
+    questions = [f"What are the key points of {title.replace('-', ' ')}?"]
+    questions += [f"Can you explain {h}?" for h in headings[:max_headings]]
+    return questions
+
+
+def candidate_questions(course_id: str, limit: int = PREWARM_MAX_QUESTIONS) -> list:
+    """
+    Popular questions first (known demand), then decks' questions
+    round-robin so every document gets some, deduplicated by cache key.
+    """
+    popular = answer_cache.popular_questions(course_id, PREWARM_POPULAR_QUESTIONS)
+    decks = [
+        deck_questions(path, PREWARM_HEADINGS_PER_DOC)
+        for path in sorted(course_dir(PDF_UPLOAD_DIR, course_id).glob("*.pdf"))
+    ]
+    interleaved = [
+        deck[i]
+        for i in range(max(map(len, decks), default=0))
+        for deck in decks
+        if i < len(deck)
+    ]
+    questions = {}
+    for question in popular + interleaved:
+        questions.setdefault(normalize_question(question), question)
+    return list(questions.values())[:limit]
+
+
+async def prewarm_course(course_id: Optional[str] = None) -> dict:
+    """Answer a course's likely questions in every ITS mode into the cache."""
+    course_id = normalize_course(course_id)
+    started = time.monotonic()
+    corpus_version = await run_in_threadpool(get_corpus_version, course_id)
+    questions = await run_in_threadpool(candidate_questions, course_id)
+    summary = {
+        "course_id": course_id,
+        "corpus_version": corpus_version,
+        "questions": len(questions),
+        "answered": 0,
+        "already_cached": 0,
+        "degraded": 0,
+        "failed": 0,
+        "status": "running",
+    }
+    print(
+        f"[PREWARM] {course_id}: {len(questions)} questions x {len(ITS_MODES)} "
+        f"modes at <= {PREWARM_RATE_PER_MIN:g}/min"
+    )
+
+    interval = 60.0 / PREWARM_RATE_PER_MIN
+    try:
+        for question in questions:
+            for mode in ITS_MODES:
+                if await run_in_threadpool(
+                    answer_cache.contains, question, mode, corpus_version
+                ):
+                    summary["already_cached"] += 1
+                    continue
+                if await runs.superseded(course_id, corpus_version):
+                    summary["status"] = "superseded"
+                    return summary
+
+                call_started = time.monotonic()
+                ticket = await runs.admit()
+                try:
+                    result = await run_in_threadpool(
+                        query_rag,
+                        apply_its_mode(question, mode),
+                        SYSTEM_PROMPT,
+                        mode=mode,
+                        retrieval_query=question,
+                        course_id=course_id,
+                    )
+                except Exception as e:
+                    print(f"[PREWARM] Failed on {question!r} ({mode}): {e}")
+                    summary["failed"] += 1
+                    result = None
+                finally:
+                    ticket.release()
+
+                if result and result.get("degraded"):
+                    # LLM saturated: stop spending budget on excerpts
+                    summary["degraded"] += 1
+                    summary["status"] = "stopped (llm degraded)"
+                    return summary
+                if result:
+                    await run_in_threadpool(
+                        answer_cache.put,
+                        question,
+                        mode,
+                        corpus_version,
+                        result["answer"],
+                        result["citations"],
+                        "prewarm",
+                    )
+                    summary["answered"] += 1
+                await asyncio.sleep(
+                    max(0.0, interval - (time.monotonic() - call_started))
+                )
+        summary["status"] = "done"
+    except AdmissionRejected:
+        summary["status"] = "stopped (server busy)"
+    finally:
+        summary["seconds"] = round(time.monotonic() - started, 1)
+        runs.last[course_id] = summary
+        print(f"[PREWARM] {course_id}: {summary}")
+    return summary
+
+
+def start_prewarm(course_id: Optional[str] = None) -> bool:
+    """
+    Run prewarm_course in the background on the current event loop.
+    Returns False if the answer cache is off or the course already has a run.
+    """
+    if answer_cache is None:
+        return False
+    return runs.start(normalize_course(course_id), prewarm_course)
+
+
+def prewarm_stats() -> dict:
+    return {
+        "running": runs.running(),
+        "last_runs": runs.last,
+        "after_ingest": PREWARM_AFTER_INGEST,
+        "rate_per_min": PREWARM_RATE_PER_MIN,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warm the answer cache")
+    parser.add_argument("--course", default=None, help="Course id (default course)")
+    parser.add_argument(
+        "--list", action="store_true", help="Only print the candidate questions"
+    )
+    args = parser.parse_args()
+
+    if answer_cache is None:
+        raise SystemExit("[PREWARM] ANSWER_CACHE is off, nothing to warm")
+    if args.list:
+        for question in candidate_questions(normalize_course(args.course)):
+            print(question)
+    else:
+        asyncio.run(prewarm_course(args.course))
+
+
+if __name__ == "__main__":
+    main()
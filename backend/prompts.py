@@ -20,3 +20,23 @@ STRICT RULES (YOU MUST FOLLOW ALL OF THESE):
 
 Your goal is to help students learn using ONLY the professor-provided content.
 """
+
+# Summary tree built at ingest for overview questions (summaries.py)
+SECTION_SUMMARY_PROMPT = """
+Summarize this section of the course material "{title}" (pages {pages}) in
+3-5 sentences for a student. Name the main topics and key terms it covers.
+Use only the text below.
+
+{text}
+
+Summary:"""
+
+DOCUMENT_SUMMARY_PROMPT = """
+Below are summaries of the sections of the course document "{title}", in
+order. Write a 4-6 sentence overview of the whole document for a student:
+its main topic, what it covers, and how the sections build on each other.
+Use only these summaries.
+
+{sections}
+
+Overview:"""
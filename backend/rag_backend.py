@@ -0,0 +1,313 @@
+"""
+Answer backends for /api/query and /api/query/stream: the local pipeline
+(Chroma + Groq, rag_engine.query_rag) and LlamaCloud (llamacloud_client.py).
+
+RAG_BACKEND picks the primary. When LlamaCloud is configured for the
+course, the other backend is the fallback, and each backend has a
+CircuitBreaker that opens when its recent calls are too slow or fail too
+often:
+  - closed: calls go through; failures fall over to the other backend
+    within the same request
+  - open: the backend is skipped for BREAKER_COOLDOWN seconds
+  - half-open: the next call is a probe; success closes the breaker,
+    failure re-opens it
+A degraded local answer (Groq saturated or failing, so excerpts instead of
+an answer) counts as a failure, since LlamaCloud brings its own LLM.
+
+With LlamaCloud as primary, local retrieval runs alongside the cloud call
+(LLAMACLOUD_SPECULATIVE_LOCAL), so a failover only has the Groq call left.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import llamacloud_client
+from cancellation import Cancelled
+from courses import normalize_course
+from llamacloud_client import query_llamacloud
+from rag_engine import answer_from_nodes, query_rag, retrieve_for_mode
+from request_trace import note
+
+LOCAL = "local"
+LLAMACLOUD = "llamacloud"
+
+RAG_BACKEND = os.getenv("RAG_BACKEND", LOCAL).lower()
+# Recent calls a breaker judges, and how many it needs before judging
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Open when the window's median call is slower than this
+BREAKER_SLOW_MS = float(os.getenv("BREAKER_SLOW_MS", "20000"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+LLAMACLOUD_SPECULATIVE_LOCAL = (
+    os.getenv("LLAMACLOUD_SPECULATIVE_LOCAL", "true").lower() == "true"
+)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)  # (ok, seconds)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+        self.counters = {"calls": 0, "failures": 0, "opened": 0, "skipped": 0}
+
+    def allow(self) -> bool:
+        """
+        Whether to try this backend now. In half-open state only one caller
+        gets True (the probe) until it records its outcome.
+        """
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                    self.counters["skipped"] += 1
+                    return False
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open":
+                if self.probing:
+                    self.counters["skipped"] += 1
+                    return False
+                self.probing = True
+            return True
+
+    def record(self, ok: bool, seconds: float):
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["failures"] += not ok
+            if self.state == "half_open":
+                self.probing = False
+                if ok:
+                    print(f"[BREAKER] {self.name} closed after a successful probe")
+                    self.state = "closed"
+                    self.outcomes.clear()
+                else:
+                    self._open("probe failed")
+                return
+            self.outcomes.append((ok, seconds))
+            reason = self._trip_reason()
+            if self.state == "closed" and reason:
+                self._open(reason)
+
+    def release(self):
+        """
+        For a call that was abandoned (the student left) rather than judged:
+        if it was the half-open probe, let the next caller probe instead.
+        """
+        with self.lock:
+            self.probing = False
+
+    def _trip_reason(self) -> Optional[str]:
+        if len(self.outcomes) < BREAKER_MIN_CALLS:
+            return None
+        failures = sum(not ok for ok, _ in self.outcomes)
+        if failures / len(self.outcomes) > BREAKER_ERROR_RATE:
+            return f"{failures}/{len(self.outcomes)} calls failed"
+        latencies = sorted(seconds for _, seconds in self.outcomes)
+        median = latencies[len(latencies) // 2]
+        if median * 1000 > BREAKER_SLOW_MS:
+            return f"median call took {median:.1f}s"
+        return None
+
+    def _open(self, reason: str):
+        print(f"[BREAKER] {self.name} open for {BREAKER_COOLDOWN:g}s: {reason}")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.counters["opened"] += 1
+        self.outcomes.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            outcomes = list(self.outcomes)
+            return {
+                **self.counters,
+                "state": self.state,
+                "recent_error_rate": (
+                    round(sum(not ok for ok, _ in outcomes) / len(outcomes), 3)
+                    if outcomes
+                    else 0
+                ),
+            }
+
+
+breakers = {LOCAL: CircuitBreaker(LOCAL), LLAMACLOUD: CircuitBreaker(LLAMACLOUD)}
+
+
+def candidates(course_id: Optional[str]) -> list:
+    """Backends for a course, primary first."""
+    if not llamacloud_client.is_configured(normalize_course(course_id)):
+        return [LOCAL]
+    if RAG_BACKEND == LLAMACLOUD:
+        return [LLAMACLOUD, LOCAL]
+    return [LOCAL, LLAMACLOUD]
+
+
+def pick_backend(course_id: Optional[str], exclude=()) -> Optional[str]:
+    """
+    First backend whose breaker lets a call through, or None. A backend
+    returned here must get a breakers[...].record() call.
+    """
+    for name in candidates(course_id):
+        if name not in exclude and breakers[name].allow():
+            return name
+    return None
+
+
+def is_failure(result: dict) -> bool:
+    return bool(result.get("degraded"))
+
+
+async def run_local(question, system_prompt, mode, retrieval_query, course_id):
+    return await run_in_threadpool(
+        query_rag,
+        question,
+        system_prompt,
+        mode=mode,
+        retrieval_query=retrieval_query,
+        course_id=course_id,
+    )
+
+
+async def answer_question(
+    question: str,
+    system_prompt: str,
+    mode: str = "direct",
+    retrieval_query: Optional[str] = None,
+    course_id: Optional[str] = None,
+    retrieved: Optional[tuple] = None,
+) -> dict:
+    """
+    query_rag with failover: the primary backend if its breaker allows,
+    else (or when it fails) the other one. When every backend is skipped or
+    failed, the local pipeline answers anyway, or its degraded answer is
+    returned. `retrieved` is a (nodes, route) local retrieval the caller
+    already ran, used instead of retrieving again.
+    """
+    speculative = None
+    fallback = None  # (backend, degraded result)
+    tried = []
+    try:
+        while True:
+            name = pick_backend(course_id, exclude=tried)
+            if name is None:
+                break
+            tried.append(name)
+            started = time.perf_counter()
+            try:
+                if name == LLAMACLOUD:
+                    if (
+                        LLAMACLOUD_SPECULATIVE_LOCAL
+                        and LOCAL not in tried
+                        and retrieved is None
+                    ):
+                        speculative = asyncio.ensure_future(
+                            run_in_threadpool(
+                                retrieve_for_mode,
+                                retrieval_query or question,
+                                mode,
+                                course_id,
+                            )
+                        )
+                    result = await query_llamacloud(
+                        question,
+                        system_prompt,
+                        retrieval_query,
+                        normalize_course(course_id),
+                    )
+                elif retrieved is not None or speculative is not None:
+                    if retrieved is None:
+                        retrieved = await speculative
+                        speculative = None
+                    nodes, route = retrieved
+                    result = await run_in_threadpool(
+                        answer_from_nodes,
+                        question,
+                        system_prompt,
+                        nodes,
+                        route,
+                        started,
+                    )
+                else:
+                    result = await run_local(
+                        question, system_prompt, mode, retrieval_query, course_id
+                    )
+            except (Cancelled, asyncio.CancelledError):
+                # The student is gone: not the backend's fault, no failover
+                breakers[name].release()
+                raise
+            except Exception as e:
+                print(f"[BACKEND] {name} failed: {e}")
+                breakers[name].record(False, time.perf_counter() - started)
+                continue
+
+            failed = is_failure(result)
+            breakers[name].record(not failed, time.perf_counter() - started)
+            if not failed:
+                note(backend=name)
+                return result
+            fallback = fallback or (name, result)
+    finally:
+        if speculative is not None:
+            speculative.cancel()
+
+    if fallback is not None:
+        note(backend=fallback[0])
+        return fallback[1]
+    if LOCAL in tried:
+        raise RuntimeError("No answer backend available")
+    # Every breaker is open: the local pipeline is the last resort
+    note(backend=LOCAL)
+    return await run_local(question, system_prompt, mode, retrieval_query, course_id)
+
+
+def backend_stats() -> dict:
+    return {
+        "primary": RAG_BACKEND,
+        "llamacloud_courses": sorted(llamacloud_client.PIPELINE_IDS),
+        "speculative_local": LLAMACLOUD_SPECULATIVE_LOCAL,
+        "breakers": {name: b.stats() for name, b in breakers.items()},
+    }
+
+
+async def stream_backend(
+    question: str,
+    system_prompt: str,
+    retrieval_query: Optional[str] = None,
+    course_id: Optional[str] = None,
+):
+    """
+    Backend choice for /api/query/stream, as (backend, result):
+      - (LOCAL, None): stream from the local pipeline, then report how it
+        went with breakers[LOCAL].record(), or .release() if abandoned
+      - (LLAMACLOUD, result): a finished LlamaCloud answer to send at once
+      - (None, None): every breaker is open; stream locally, unrecorded
+    """
+    for name in candidates(course_id):
+        if not breakers[name].allow():
+            continue
+        if name == LOCAL:
+            return LOCAL, None
+        started = time.perf_counter()
+        try:
+            result = await query_llamacloud(
+                question, system_prompt, retrieval_query, normalize_course(course_id)
+            )
+        except asyncio.CancelledError:
+            breakers[name].release()
+            raise
+        except Exception as e:
+            print(f"[BACKEND] {name} failed: {e}")
+            breakers[name].record(False, time.perf_counter() - started)
+            continue
+        breakers[name].record(True, time.perf_counter() - started)
+        note(backend=name)
+        return name, result
+    return None, None
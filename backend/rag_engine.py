@@ -3,28 +3,55 @@ Local RAG Engine using LlamaIndex + Chroma
 Replaces LlamaCloud with local, controlled RAG stack
 """
 
+import math
 import os
+import shutil
+import time
+from functools import lru_cache
 from pathlib import Path
+from typing import List, Optional
 
-import chromadb
-from dotenv import load_dotenv
 from llama_index.core import (
+    QueryBundle,
     Settings,
     SimpleDirectoryReader,
     StorageContext,
     VectorStoreIndex,
+    get_response_synthesizer,
 )
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.llms.groq import Groq
-from llama_index.vector_stores.chroma import ChromaVectorStore
-
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+import config  # noqa: F401 - loads .env before the modules below read it
+from cancellation import Cancelled, checkpoint
+from courses import (
+    DEFAULT_COURSE,
+    CourseIndexes,
+    collection_name,
+    course_dir,
+    normalize_course,
+    s3_prefix,
+)
+from embed_batcher import EMBED_MICROBATCH, EmbeddingBatcher
+from index_service import INDEX_SERVICE, IndexClient
+from index_versions import IndexVersions
+from llm_dispatch import DEFAULT_OUTPUT_TOKENS, llm_saturation
+from model_router import (
+    EXCERPT_ROUTE,
+    LEGACY_ROUTE,
+    base_route,
+    choose_route,
+    route_stats,
+)
+from pdf_chunking import make_node_parser
+from request_trace import note, stage
 from s3_storage import (
     download_file_from_s3,
     ensure_pdf_local,
     is_s3_enabled,
     list_s3_pdfs,
 )
+from summaries import SUMMARIES, looks_like_overview, summary_store
 
 try:
     import pypdf
@@ -36,18 +63,47 @@ except ImportError:
         "[WARNING] pypdf not installed. Install it for better page number accuracy: pip install pypdf"
     )
 
-load_dotenv()
-
 # Configuration
+# LLM_PROVIDER=fake / EMBED_PROVIDER=fake swap in the offline stand-ins from
+# fake_llm.py (benchmarks, local runs without a Groq key).
+# EMBED_PROVIDER=onnx runs bge-small through ONNX Runtime (onnx_embedding.py).
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq").lower()
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "huggingface").lower()
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
+# Point at mock_groq_server.py (or any OpenAI-compatible endpoint) for load tests
+GROQ_API_BASE = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1")
+if LLM_PROVIDER == "groq" and not GROQ_API_KEY:
     raise ValueError(
         "GROQ_API_KEY environment variable is required. "
         "Please set it in your environment or .env file."
     )
 
-CHROMA_PATH = "./chroma_db"
-PDF_UPLOAD_DIR = "./uploaded_pdfs"
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+# Cap on Chroma's in-memory HNSW segments (MB, 0 = unlimited). With many
+# courses this lets Chroma evict the collections nobody is querying.
+CHROMA_CACHE_MB = int(os.getenv("CHROMA_CACHE_MB", "0"))
+# "chroma" (HNSW + SQLite) or "flat" (mmap'd exact search, see flat_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+FLAT_INDEX_PATH = os.getenv("FLAT_INDEX_PATH", "./flat_index")
+FLAT_INDEX_DTYPE = os.getenv("FLAT_INDEX_DTYPE", "float32")
+PDF_UPLOAD_DIR = os.getenv("PDF_UPLOAD_DIR", "./uploaded_pdfs")
+# Active index version of every course (see index_versions.py)
+INDEX_VERSIONS_PATH = os.getenv(
+    "INDEX_VERSIONS_PATH",
+    str(
+        Path(FLAT_INDEX_PATH if VECTOR_BACKEND == "flat" else CHROMA_PATH)
+        / "index_versions.json"
+    ),
+)
+
+# "pages" (page/layout-aware, see pdf_chunking.py) or "sentences" (original
+# SentenceSplitter); re-ingest after changing it
+CHUNKING = os.getenv("CHUNKING", "pages").lower()
+
+# Retrieval-only "excerpts" answers (see excerpt_query)
+EXCERPT_TOP_K = int(os.getenv("EXCERPT_TOP_K", "5"))
+EXCERPT_CHARS = int(os.getenv("EXCERPT_CHARS", "600"))
 
 try:
     Path(CHROMA_PATH).mkdir(exist_ok=True)
@@ -56,38 +112,240 @@ except Exception as e:
     print(f"[ERROR] Failed to create directories: {e}")
     raise
 
-# Settings
-try:
-    print("[RAG] Initializing Groq LLM...")
-    Settings.llm = Groq(
-        model="llama-3.3-70b-versatile", temperature=0.7, api_key=GROQ_API_KEY
+
+@lru_cache(maxsize=None)
+def get_llm(model: str, temperature: float, max_tokens: Optional[int] = None):
+    """One LLM client per generation profile (see model_router.py)."""
+    if LLM_PROVIDER == "fake":
+        from fake_llm import FakeLLM
+
+        llm = FakeLLM.from_env()
+        llm.model_name = model
+        if max_tokens:
+            llm.answer_tokens = min(llm.answer_tokens, max_tokens)
+        return llm
+
+    from llama_index.llms.groq import Groq
+
+    from llm_dispatch import LLM_TIMEOUT, DispatchedLLM, get_dispatcher
+
+    # Retries are handled by the dispatcher, which knows about rate limits
+    groq_llm = Groq(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        api_key=GROQ_API_KEY,
+        api_base=GROQ_API_BASE,
+        max_retries=0,
+        timeout=LLM_TIMEOUT,
+        http_client=http_client,
     )
+    return DispatchedLLM(groq_llm, get_dispatcher(model))
 
-    print("[RAG] Loading embedding model (this may take a moment on first run)...")
-    Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
 
-    Settings.node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=50)
+# Settings
+try:
+    if LLM_PROVIDER == "fake":
+        print("[RAG] Initializing fake LLM (offline mode)...")
+    else:
+        from llm_dispatch import make_http_client
+
+        print(f"[RAG] Initializing Groq LLM ({GROQ_API_BASE})...")
+        # Shared keep-alive pool for every model's client
+        http_client = make_http_client()
+    Settings.llm = get_llm(LEGACY_ROUTE.model, LEGACY_ROUTE.temperature)
+
+    if INDEX_SERVICE:
+        print("[RAG] Embeddings are computed by the shared index service")
+    elif EMBED_PROVIDER == "fake":
+        from fake_llm import FakeEmbedding
+
+        print("[RAG] Using fake embedding model (offline mode)")
+        Settings.embed_model = FakeEmbedding()
+    elif EMBED_PROVIDER == "onnx":
+        from onnx_embedding import OnnxEmbedding
+
+        print("[RAG] Loading ONNX embedding model...")
+        Settings.embed_model = OnnxEmbedding()
+    else:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        print("[RAG] Loading embedding model (this may take a moment on first run)...")
+        Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+
+    Settings.node_parser = make_node_parser(CHUNKING)
     print("[RAG] Settings configured successfully")
 except Exception as e:
     print(f"[ERROR] Failed to initialize RAG settings: {e}")
     raise
 
-# Init Chroma
-try:
-    print("[RAG] Initializing ChromaDB...")
-    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    chroma_collection = chroma_client.get_or_create_collection("course_materials")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    print("[RAG] ChromaDB initialized successfully")
-except Exception as e:
-    print(f"[ERROR] Failed to initialize ChromaDB: {e}")
-    raise
+# Per-course vector stores (or the shared index service, see index_service.py)
+index_client = None
+# Bumped on every ingest/delete so workers can tell the index changed
+index_version = 0
+
+
+def set_index_version(version: int):
+    global index_version
+    index_version = version
+
+
+def get_index_version() -> int:
+    return index_version
+
+
+if INDEX_SERVICE:
+    print(f"[RAG] Using shared index service at {INDEX_SERVICE}")
+    index_client = IndexClient(INDEX_SERVICE)
+    index_client.listeners.append(set_index_version)
+    index_client.subscribe()
+elif VECTOR_BACKEND == "flat":
+    from flat_store import FlatVectorStore
+
+    print(f"[RAG] Using flat vector indexes under {FLAT_INDEX_PATH}")
+else:
+    # Imported here so workers using the index service don't load Chroma
+    import chromadb
+    from chromadb.config import Settings as ChromaSettings
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    try:
+        print("[RAG] Initializing ChromaDB...")
+        cache_settings = {}
+        if CHROMA_CACHE_MB:
+            cache_settings = {
+                "chroma_segment_cache_policy": "LRU",
+                "chroma_memory_limit_bytes": CHROMA_CACHE_MB << 20,
+            }
+        chroma_client = chromadb.PersistentClient(
+            path=CHROMA_PATH, settings=ChromaSettings(**cache_settings)
+        )
+        print("[RAG] ChromaDB initialized successfully")
+    except Exception as e:
+        print(f"[ERROR] Failed to initialize ChromaDB: {e}")
+        raise
+
+
+index_versions = IndexVersions(INDEX_VERSIONS_PATH)
+
+
+def version_path(course_id: str, version: int) -> Path:
+    """Flat-index directory of one index version (0 = the unversioned one)."""
+    path = Path(FLAT_INDEX_PATH)
+    if course_id != DEFAULT_COURSE:
+        path = path / "courses" / course_id
+    return path / f"v{version}" if version else path
+
+
+class CourseIndex:
+    """Vector store, PDF directory and LlamaIndex index of one course version."""
+
+    def __init__(self, course_id: str, version: int = 0):
+        self.course_id = course_id
+        self.version = version
+        self.pdf_dir = course_dir(PDF_UPLOAD_DIR, course_id)
+        if VECTOR_BACKEND == "flat":
+            self.vector_store = FlatVectorStore(
+                str(version_path(course_id, version)), dtype=FLAT_INDEX_DTYPE
+            )
+        else:
+            self.collection = chroma_client.get_or_create_collection(
+                collection_name(course_id, version)
+            )
+            self.vector_store = ChromaVectorStore(chroma_collection=self.collection)
+        self.storage_context = StorageContext.from_defaults(
+            vector_store=self.vector_store
+        )
+        self.index = self.load()
+        print(f"[RAG] Loaded course {course_id} (index version {version})")
+
+    def load(self):
+        try:
+            return VectorStoreIndex.from_vector_store(
+                vector_store=self.vector_store,
+                storage_context=self.storage_context,
+            )
+        except Exception:
+            print(f"[RAG] Created new empty index for course {self.course_id}")
+            return VectorStoreIndex.from_documents(
+                [], storage_context=self.storage_context
+            )
+
+    def count(self) -> int:
+        if VECTOR_BACKEND == "flat":
+            return self.vector_store.count()
+        return self.collection.count()
+
 
-index = None
+courses = CourseIndexes(
+    lambda course_id: CourseIndex(course_id, index_versions.active(course_id))
+)
+
+
+def course_index(course_id: str) -> CourseIndex:
+    """The course's active version, reloaded if another ingest swapped it."""
+    return courses.get(course_id, index_versions.active(course_id))
 
 
-def get_accurate_page_number(file_path: str, content_snippet: str) -> str:
+def drop_version(course_id: str, version: int):
+    try:
+        if VECTOR_BACKEND == "flat" and version:
+            shutil.rmtree(version_path(course_id, version), ignore_errors=True)
+        elif VECTOR_BACKEND == "flat":
+            # Other courses and versions live below the unversioned directory
+            FlatVectorStore(str(version_path(course_id, 0))).clear()
+        else:
+            chroma_client.delete_collection(collection_name(course_id, version))
+        print(f"[INGEST] Dropped index version {version} of course {course_id}")
+    except Exception as e:
+        print(f"[INGEST] Could not drop version {version} of {course_id}: {e}")
+
+
+def validate_version(course: CourseIndex):
+    """Refuse to activate an index that is empty or can't answer a query."""
+    chunks = course.count()
+    if not chunks:
+        raise ValueError(f"index version {course.version} is empty")
+    probe = course.index.as_retriever(similarity_top_k=1).retrieve("course overview")
+    if not probe:
+        raise ValueError(f"index version {course.version} returned no results")
+
+
+def build_version(course_id: str, version: int, documents: list) -> CourseIndex:
+    """Ingest documents into a fresh index version, dropped if it fails."""
+    course = CourseIndex(course_id, version)
+    try:
+        course.index = VectorStoreIndex.from_documents(
+            documents, storage_context=course.storage_context, show_progress=True
+        )
+        validate_version(course)
+    except Exception:
+        drop_version(course_id, version)
+        raise
+    return course
+
+
+@lru_cache(maxsize=64)
+def read_page_texts(file_path: str, mtime: float) -> tuple:
+    """
+    Extracted text of every page, cached per (path, mtime) so citations
+    don't re-parse the PDF for each source node.
+    """
+    texts = []
+    with stage("pdf_read"), open(file_path, "rb") as pdf_file:
+        reader = pypdf.PdfReader(pdf_file)
+        for page_num, page in enumerate(reader.pages):
+            try:
+                texts.append(page.extract_text() or "")
+            except Exception as page_e:
+                print(f"[DEBUG] Error reading page {page_num}: {page_e}")
+                texts.append("")
+    return tuple(texts)
+
+
+def get_accurate_page_number(
+    file_path: str, content_snippet: str, course_id: str = DEFAULT_COURSE
+) -> str:
     """
     Get accurate page number from PDF file.
     Uses pypdf if available, otherwise falls back to page_label.
@@ -102,7 +360,9 @@ def get_accurate_page_number(file_path: str, content_snippet: str) -> str:
         # If file doesn't exist locally and S3 is enabled, try to get it from S3
         if not pdf_path.exists() and is_s3_enabled():
             filename = pdf_path.name
-            pdf_path = ensure_pdf_local(filename, Path(PDF_UPLOAD_DIR))
+            pdf_path = ensure_pdf_local(
+                filename, pdf_path.parent, prefix=s3_prefix(course_id)
+            )
             if pdf_path is None:
                 print(f"[DEBUG] PDF file not found locally or in S3: {file_path}")
                 return "?"
@@ -112,162 +372,384 @@ def get_accurate_page_number(file_path: str, content_snippet: str) -> str:
             print(f"[DEBUG] PDF file not found: {file_path}")
             return "?"
 
-        with open(pdf_path, "rb") as pdf_file:
-            reader = pypdf.PdfReader(pdf_file)
-            total_pages = len(reader.pages)
+        if not content_snippet or len(content_snippet) < 10:
+            # Not enough content to search for
+            return "?"
 
-            if not content_snippet or len(content_snippet) < 10:
-                # Not enough content to search for
-                return "?"
+        # Get first 50 characters of content to search for
+        search_text = content_snippet[:50].strip()
 
-            # Get first 50 characters of content to search for
-            search_text = content_snippet[:50].strip()
-
-            # Search for the snippet in each page
-            for page_num in range(total_pages):
-                try:
-                    page = reader.pages[page_num]
-                    text = page.extract_text()
-
-                    # Use a more flexible matching - check if any substring matches
-                    if search_text in text or text.find(search_text[:30]) >= 0:
-                        return str(page_num + 1)  # +1 because pages are 0-indexed
-                except Exception as page_e:
-                    print(f"[DEBUG] Error reading page {page_num}: {page_e}")
-                    continue
+        # Search for the snippet in each page
+        page_texts = read_page_texts(str(pdf_path), pdf_path.stat().st_mtime)
+        for page_num, text in enumerate(page_texts):
+            # Use a more flexible matching - check if any substring matches
+            if search_text in text or text.find(search_text[:30]) >= 0:
+                return str(page_num + 1)  # +1 because pages are 0-indexed
     except Exception as e:
         print(f"[DEBUG] Could not extract accurate page number from {file_path}: {e}")
 
     return "?"
 
 
-def initialize_index():
-    global index
-    try:
-        index = VectorStoreIndex.from_vector_store(
-            vector_store=vector_store,
-            storage_context=storage_context,
-        )
-        print("[RAG] Loaded existing index")
-    except Exception:
-        index = VectorStoreIndex.from_documents([], storage_context=storage_context)
-        print("[RAG] Created new empty index")
-
+def ingest_pdfs(course_id: Optional[str] = None):
+    course_id = normalize_course(course_id)
+    if index_client:
+        return index_client.call("ingest", course_id)
 
-def ingest_pdfs(pdf_directory: str = PDF_UPLOAD_DIR):
-    global index
-    print(f"[INGEST] Loading PDFs from {pdf_directory}")
+    pdf_dir = course_dir(PDF_UPLOAD_DIR, course_id)
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    print(f"[INGEST] Loading PDFs for course {course_id} from {pdf_dir}")
 
     # If S3 is enabled, sync PDFs from S3 to local directory first
     if is_s3_enabled():
         print("[INGEST] S3 enabled, syncing PDFs from S3...")
-        s3_files = list_s3_pdfs()
-        pdf_dir = Path(pdf_directory)
+        prefix = s3_prefix(course_id)
+        s3_files = list_s3_pdfs(prefix)
 
         for filename in s3_files:
             local_path = pdf_dir / filename
             if not local_path.exists():
                 print(f"[INGEST] Downloading {filename} from S3...")
-                s3_key = f"pdfs/{filename}"
+                s3_key = f"{prefix}{filename}"
                 download_file_from_s3(s3_key, local_path)
 
     try:
-        documents = SimpleDirectoryReader(pdf_directory).load_data()
+        documents = SimpleDirectoryReader(str(pdf_dir)).load_data()
         if not documents:
             return {"status": "error", "message": "No PDFs found"}
 
-        index = VectorStoreIndex.from_documents(
-            documents, storage_context=storage_context, show_progress=True
-        )
-        return {"status": "success", "document_count": len(documents)}
+        for doc in documents:
+            # Lets citations find the PDF; not part of the embedded text
+            doc.metadata["course_id"] = course_id
+            doc.excluded_embed_metadata_keys.append("course_id")
+            doc.excluded_llm_metadata_keys.append("course_id")
+
+        # Build next to the live version; queries keep using that one until
+        # the manifest flips, and a failed build never becomes active
+        with index_versions.writing() as manifest:
+            version = IndexVersions.next_version(manifest, course_id)
+            print(f"[INGEST] Building index version {version} of {course_id}")
+            course = build_version(course_id, version, documents)
+            expired = IndexVersions.activate(
+                manifest,
+                course_id,
+                version,
+                documents=len(documents),
+                chunks=course.count(),
+            )
+        courses.put(course_id, course)
+        set_index_version(index_version + 1)
+        print(f"[INGEST] Course {course_id} now serves index version {version}")
+
+        for old_version in expired:
+            drop_version(course_id, old_version)
+        return {
+            "status": "success",
+            "document_count": len(documents),
+            "version": version,
+        }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-def query_rag(
-    question: str, system_prompt: str, chat_history: list = []
-):  # <--- Added argument
-    global index
-    if index is None:
-        initialize_index()
-
-    # Format history
-    history_str = ""
-    if chat_history:
-        # DB already limits to 10, so we just join them
-        history_str = "\n".join(
-            [f"{msg['role'].upper()}: {msg['content']}" for msg in chat_history]
-        )
+def format_history(chat_history: list) -> str:
+    if not chat_history:
+        return ""
+    # DB already limits to 10, so we just join them
+    return "\n".join(
+        [f"{msg['role'].upper()}: {msg['content']}" for msg in chat_history]
+    )
 
-    try:
-        # Create engine
-        query_engine = index.as_query_engine(
-            similarity_top_k=10,
-            response_mode="compact",
-        )
 
-        # Prompt construction (Fixed to include history)
-        full_query = f"""
+def build_full_query(question: str, system_prompt: str, chat_history: list) -> str:
+    # Prompt construction (Fixed to include history)
+    return f"""
 {system_prompt}
 
 PREVIOUS CONVERSATION HISTORY:
-{history_str}
+{format_history(chat_history)}
 
 INSTRUCTION:
 Based on the course materials provided and the conversation history above, answer this question:
 {question}
 """
 
-        response = query_engine.query(full_query)
-        answer_text = str(response)
 
-        if "I cannot find this information" in answer_text:
-            citations = []
-        else:
-            # Extract Citations with accurate page numbers
-            citations = []
-            seen = set()
-            if hasattr(response, "source_nodes"):
-                for node in response.source_nodes:
-                    metadata = node.node.metadata
-                    file_name = metadata.get("file_name", "Unknown File")
-
-                    # Try to get accurate page number
-                    page_label = metadata.get("page_label", "?")
-
-                    # If we have page label, try to get accurate page from PDF
-                    if HAS_PYPDF and file_name and file_name != "Unknown File":
-                        pdf_path = Path(PDF_UPLOAD_DIR) / file_name
-                        if pdf_path.exists():
-                            # Get snippet of content to search for
-                            content_snippet = (
-                                node.get_content()
-                                if hasattr(node, "get_content")
-                                else ""
-                            )
-                            if not content_snippet:
-                                # Try alternative ways to get content
-                                if hasattr(node, "text"):
-                                    content_snippet = node.text
-                                elif hasattr(node, "content"):
-                                    content_snippet = node.content
-                                else:
-                                    content_snippet = str(node)
-
-                            accurate_page = get_accurate_page_number(
-                                str(pdf_path), content_snippet
-                            )
-                            page_label = (
-                                accurate_page if accurate_page != "?" else page_label
-                            )
-
-                    citation_key = f"{file_name}|{page_label}"
-                    if citation_key not in seen:
-                        seen.add(citation_key)
-                        citations.append(f"{file_name} (Page {page_label})")
-
-        return {"answer": answer_text, "citations": citations}
+def resolve_page_label(node) -> str:
+    """Accurate page number for a retrieved node, falling back to page_label."""
+    metadata = node.node.metadata
+    # The page-aware parser records the exact page, no PDF search needed
+    if metadata.get("page"):
+        return metadata["page"]
+
+    file_name = metadata.get("file_name", "Unknown File")
+    # Chunks ingested before course namespaces belong to the default course
+    course_id = metadata.get("course_id", DEFAULT_COURSE)
+
+    # Try to get accurate page number
+    page_label = metadata.get("page_label", "?")
+
+    # If we have page label, try to get accurate page from PDF
+    if HAS_PYPDF and file_name and file_name != "Unknown File":
+        pdf_path = course_dir(PDF_UPLOAD_DIR, course_id) / file_name
+        if pdf_path.exists():
+            # Get snippet of content to search for
+            content_snippet = node.get_content() if hasattr(node, "get_content") else ""
+            if not content_snippet:
+                # Try alternative ways to get content
+                if hasattr(node, "text"):
+                    content_snippet = node.text
+                elif hasattr(node, "content"):
+                    content_snippet = node.content
+                else:
+                    content_snippet = str(node)
+
+            accurate_page = get_accurate_page_number(
+                str(pdf_path), content_snippet, course_id
+            )
+            page_label = accurate_page if accurate_page != "?" else page_label
+    return page_label
+
+
+def extract_citations(source_nodes: list) -> list:
+    """Extract Citations with accurate page numbers"""
+    with stage("citations"):
+        return _extract_citations(source_nodes)
+
+
+def _extract_citations(source_nodes: list) -> list:
+    citations = []
+    seen = set()
+    for node in source_nodes:
+        metadata = node.node.metadata
+        file_name = metadata.get("file_name", "Unknown File")
+        # The index service resolves pages once, next to its page-text cache
+        page_label = metadata.get("resolved_page") or resolve_page_label(node)
+
+        citation_key = f"{file_name}|{page_label}"
+        if citation_key not in seen:
+            seen.add(citation_key)
+            citations.append(f"{file_name} (Page {page_label})")
+    return citations
+
+
+def retrieve(query: str, top_k: int, course_id: Optional[str] = None) -> list:
+    """
+    Top-k chunks for query from one course's index (local or via the
+    index service).
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        with stage("retrieve"):
+            nodes = index_client.retrieve(query, top_k, course_id)
+    else:
+        index = course_index(course_id).index
+        with stage("embed"):
+            embedding = embed_query(query)
+        with stage("search"):
+            nodes = index.as_retriever(similarity_top_k=top_k).retrieve(
+                QueryBundle(query, embedding=embedding)
+            )
+    note(course_id=course_id, nodes=len(nodes))
+    return nodes
+
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Query embeddings for many questions in batched model calls."""
+    model = Settings.embed_model
+    if hasattr(model, "get_query_embeddings"):
+        # OnnxEmbedding / FakeEmbedding
+        return model.get_query_embeddings(queries)
+    if EMBED_PROVIDER == "huggingface":
+        # What HuggingFaceEmbedding does per query (bge query prompt included)
+        return model._embed(queries, prompt_name="query")
+    return [model.get_query_embedding(q) for q in queries]
+
+
+# Concurrent requests' query embeddings share batched model calls
+query_batcher = EmbeddingBatcher(embed_queries) if EMBED_MICROBATCH else None
+
+
+def embed_query(query: str) -> List[float]:
+    if query_batcher:
+        return query_batcher.embed(query)
+    return Settings.embed_model.get_query_embedding(query)
+
+
+def chroma_query_batch(collection, embeddings: list, top_k: int) -> list:
+    """One Chroma query for many embeddings, scored like ChromaVectorStore."""
+    from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+    results = collection.query(query_embeddings=embeddings, n_results=top_k)
+    return [
+        VectorStoreQueryResult(
+            nodes=[metadata_dict_to_node(m, text=t) for m, t in zip(metas, texts)],
+            similarities=[math.exp(-d) for d in distances],
+            ids=ids,
+        )
+        for ids, texts, metas, distances in zip(
+            results["ids"],
+            results["documents"],
+            results["metadatas"],
+            results["distances"],
+        )
+    ]
+
+
+def retrieve_batch(
+    queries: List[str], top_k: int, course_id: Optional[str] = None
+) -> List[list]:
+    """
+    retrieve() for many queries at once: one batched embedding call and one
+    vectorized search instead of a model call and index scan per query.
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        return index_client.retrieve_batch(queries, top_k, course_id)
+
+    embeddings = embed_queries(queries)
+    course = course_index(course_id)
+    if VECTOR_BACKEND == "flat":
+        results = course.vector_store.query_batch(embeddings, top_k)
+    else:
+        results = chroma_query_batch(course.collection, embeddings, top_k)
+    return [
+        [NodeWithScore(node=n, score=s) for n, s in zip(r.nodes, r.similarities)]
+        for r in results
+    ]
+
+
+def cosine_score(score: float) -> float:
+    """
+    A retrieval score on the cosine scale, whichever store produced it.
+    FlatVectorStore scores are cosines already. Chroma's are exp(-d) of the
+    squared L2 distance d, which for our unit-length embeddings is 2 - 2cos.
+    """
+    if VECTOR_BACKEND == "flat":
+        return score
+    return 1 + math.log(score) / 2 if score > 0 else -1.0
+
+
+def route_for_nodes(mode: str, nodes: list):
+    """The final route for a mode, from the best similarity score."""
+    top_score = max((n.score for n in nodes if n.score is not None), default=None)
+    if top_score is not None:
+        top_score = cosine_score(top_score)
+    return choose_route(mode, top_score)
+
+
+def retrieve_for_mode(query: str, mode: str, course_id: Optional[str] = None):
+    """
+    Retrieve with the mode's top_k, then pick the final route from the
+    best similarity score. Overview questions are answered from the
+    precomputed document summaries instead, when the corpus has them.
+
+    Returns:
+        (nodes, route)
+    """
+    checkpoint("retrieve")
+    if SUMMARIES and looks_like_overview(query):
+        with stage("summaries"):
+            nodes = summary_store.nodes_for(query, get_corpus_version(course_id))
+        if nodes:
+            note(course_id=normalize_course(course_id), summaries=len(nodes))
+            route = base_route(mode)
+            return nodes, route._replace(name=f"{route.name}+summaries")
+    nodes = retrieve(query, base_route(mode).top_k, course_id)
+    return nodes, route_for_nodes(mode, nodes)
+
+
+def prompt_tokens_for(full_query: str, nodes: list) -> int:
+    # Token counts are estimated at ~4 characters per token
+    context_chars = sum(len(n.node.get_content()) for n in nodes)
+    return (len(full_query) + context_chars) // 4
+
+
+def llm_checkpoint(route, full_query: str, nodes: list):
+    """Stop a cancelled query before its LLM call, counting what it saves."""
+    checkpoint(
+        "llm",
+        tokens=prompt_tokens_for(full_query, nodes)
+        + (route.max_tokens or DEFAULT_OUTPUT_TOKENS),
+    )
+
 
+def record_route(route, started: float, full_query: str, nodes: list, answer: str):
+    prompt_tokens = prompt_tokens_for(full_query, nodes)
+    route_stats.record(
+        route, time.perf_counter() - started, prompt_tokens, len(answer) // 4
+    )
+    note(route=route.name, prompt_tokens=prompt_tokens, answer_tokens=len(answer) // 4)
+
+
+def excerpt_query(
+    question: str,
+    mode: str = "direct",
+    top_k: int = EXCERPT_TOP_K,
+    course_id: Optional[str] = None,
+):
+    """
+    Retrieval-only answer: the top ranked chunks with file/page citations,
+    no LLM call. Used on request and as the fallback when the LLM is
+    saturated or failing.
+    """
+    started = time.perf_counter()
+    nodes = retrieve(question, top_k, course_id)
+    return format_excerpts(nodes, started)
+
+
+def format_excerpts(nodes: list, started: float) -> dict:
+    excerpts = []
+    for node in nodes:
+        citation = extract_citations([node])[0]
+        text = " ".join(node.node.get_content().split())
+        if len(text) > EXCERPT_CHARS:
+            text = text[:EXCERPT_CHARS].rsplit(" ", 1)[0] + "..."
+        excerpts.append(
+            {
+                "citation": citation,
+                "text": text,
+                "score": round(node.score, 4) if node.score is not None else None,
+            }
+        )
+
+    if excerpts:
+        answer = "Here are the most relevant passages from the course materials:\n\n"
+        answer += "\n\n".join(f'> {e["text"]}\n— {e["citation"]}' for e in excerpts)
+    else:
+        answer = "I cannot find this information in the course materials."
+
+    route_stats.record(EXCERPT_ROUTE, time.perf_counter() - started, 0, 0)
+    return {
+        "answer": answer,
+        "citations": list(dict.fromkeys(e["citation"] for e in excerpts)),
+        "excerpts": excerpts,
+        "route": "excerpts",
+    }
+
+
+def query_rag(
+    question: str,
+    system_prompt: str,
+    chat_history: list = [],  # <--- Added argument
+    mode: str = "direct",
+    retrieval_query: Optional[str] = None,
+    course_id: Optional[str] = None,
+):
+    """
+    Answer a question from one course's materials.
+    `retrieval_query` (default: question) is what gets embedded for
+    retrieval, so the ITS instructions in `question` don't skew the search.
+    """
+    try:
+        started = time.perf_counter()
+        nodes, route = retrieve_for_mode(retrieval_query or question, mode, course_id)
+        return answer_from_nodes(
+            question, system_prompt, nodes, route, started, chat_history
+        )
+
+    except Cancelled:
+        raise
     except Exception as e:
         import traceback
 
@@ -275,39 +757,257 @@ Based on the course materials provided and the conversation history above, answe
         raise e
 
 
-def delete_pdf_from_database(pdf_filename: str):
+def answer_from_nodes(
+    question: str,
+    system_prompt: str,
+    nodes: list,
+    route,
+    started: float,
+    chat_history: list = [],
+):
+    """The LLM half of query_rag, for nodes that were already retrieved."""
+    reason = llm_saturation(route.model)
+    if reason:
+        print(f"[RAG] LLM degraded ({reason}), answering with excerpts")
+        return {
+            **format_excerpts(nodes[:EXCERPT_TOP_K], started),
+            "degraded": reason,
+        }
+
+    synthesizer = get_response_synthesizer(
+        llm=get_llm(route.model, route.temperature, route.max_tokens),
+        response_mode="compact",
+    )
+    full_query = build_full_query(question, system_prompt, chat_history)
+    llm_checkpoint(route, full_query, nodes)
+    try:
+        with stage("llm"):
+            response = synthesizer.synthesize(full_query, nodes=nodes)
+    except Cancelled:
+        raise
+    except Exception as e:
+        # Retrieval worked, so the student still gets cited material
+        print(f"[RAG] LLM call failed ({e}), answering with excerpts")
+        return {
+            **format_excerpts(nodes[:EXCERPT_TOP_K], started),
+            "degraded": "llm_error",
+        }
+    answer_text = str(response)
+    record_route(route, started, full_query, nodes, answer_text)
+    checkpoint("citations")
+
+    if "I cannot find this information" in answer_text:
+        citations = []
+    else:
+        citations = extract_citations(getattr(response, "source_nodes", []))
+
+    return {"answer": answer_text, "citations": citations, "route": route.name}
+
+
+def stream_excerpts(nodes: list, started: float):
+    result = format_excerpts(nodes[:EXCERPT_TOP_K], started)
+    yield "token", result["answer"]
+    yield "citations", result["citations"]
+
+
+def stream_excerpt_query(
+    question: str, mode: str = "direct", course_id: Optional[str] = None
+):
+    """excerpt_query in stream_query_rag's ("token"/"citations") shape."""
+    result = excerpt_query(question, mode, course_id=course_id)
+    yield "token", result["answer"]
+    yield "citations", result["citations"]
+
+
+def stream_query_rag(
+    question: str,
+    system_prompt: str,
+    chat_history: list = [],
+    mode: str = "direct",
+    retrieval_query: Optional[str] = None,
+    course_id: Optional[str] = None,
+    retrieved: Optional[tuple] = None,
+):
     """
-    Delete all embeddings of a specific PDF from the Chroma database.
-    This ensures deleted PDFs don't appear in query results.
+    Streaming variant of query_rag.
+    Yields ("token", text_delta) while the LLM generates, then a final
+    ("citations", list) once the answer is complete. A ("degraded", reason)
+    comes first when excerpts are streamed instead of an answer.
+    `retrieved` is a (nodes, route) from retrieve_for_mode already run for
+    this question.
     """
-    try:
-        collection = chroma_client.get_collection("course_materials")
+    started = time.perf_counter()
+    if retrieved is None:
+        retrieved = retrieve_for_mode(retrieval_query or question, mode, course_id)
+    nodes, route = retrieved
+
+    reason = llm_saturation(route.model)
+    if reason:
+        print(f"[RAG] LLM degraded ({reason}), streaming excerpts")
+        yield "degraded", reason
+        yield from stream_excerpts(nodes, started)
+        return
+
+    synthesizer = get_response_synthesizer(
+        llm=get_llm(route.model, route.temperature, route.max_tokens),
+        response_mode="compact",
+        streaming=True,
+    )
+    full_query = build_full_query(question, system_prompt, chat_history)
+    llm_checkpoint(route, full_query, nodes)
 
-        # Query for all documents with this file name
-        # Get all metadata to find entries for this file
-        results = collection.get(where={"file_name": pdf_filename})
+    answer_parts = []
+    try:
+        llm_started = time.perf_counter()
+        response = synthesizer.synthesize(full_query, nodes=nodes)
+        for delta in response.response_gen:
+            if not answer_parts:
+                note(
+                    first_token_ms=round((time.perf_counter() - llm_started) * 1000, 1)
+                )
+            answer_parts.append(delta)
+            yield "token", delta
+        # Includes time spent waiting on the client between chunks
+        note(llm_stream_ms=round((time.perf_counter() - llm_started) * 1000, 1))
+    except Cancelled:
+        raise
+    except Exception as e:
+        if answer_parts:
+            raise
+        # Nothing sent yet, so we can still swap in the excerpts
+        print(f"[RAG] LLM call failed ({e}), streaming excerpts")
+        yield "degraded", "llm_error"
+        yield from stream_excerpts(nodes, started)
+        return
+
+    answer_text = "".join(answer_parts)
+    record_route(route, started, full_query, nodes, answer_text)
+    checkpoint("citations")
+    if "I cannot find this information" in answer_text:
+        yield "citations", []
+    else:
+        yield "citations", extract_citations(response.source_nodes)
+
+
+def delete_pdf_from_database(pdf_filename: str, course_id: Optional[str] = None):
+    """
+    Delete all embeddings of a specific PDF from its course's collection.
+    This ensures deleted PDFs don't appear in query results.
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        try:
+            return index_client.call("delete", pdf_filename, course_id)
+        except Exception as e:
+            print(f"[DELETE ERROR] Index service could not delete {pdf_filename}: {e}")
+            return False
 
-        if results and results["ids"]:
-            # Delete all found documents
-            collection.delete(ids=results["ids"])
-            print(
-                f"[DELETE] Removed {len(results['ids'])} embeddings for {pdf_filename}"
-            )
-            return True
+    try:
+        # Edits the active version in place; the revision bump changes the
+        # corpus version so caches keyed on it are invalidated
+        with index_versions.writing() as manifest:
+            course = course_index(course_id)
+            if VECTOR_BACKEND == "flat":
+                removed = course.vector_store.delete_file(pdf_filename)
+            else:
+                # Find every chunk of this file by its metadata
+                ids = course.collection.get(where={"file_name": pdf_filename})["ids"]
+                if ids:
+                    course.collection.delete(ids=ids)
+                removed = len(ids)
+            if removed:
+                IndexVersions.bump_revision(manifest, course_id)
+
+        if removed:
+            set_index_version(index_version + 1)
+            print(f"[DELETE] Removed {removed} embeddings for {pdf_filename}")
         else:
             print(f"[DELETE] No embeddings found for {pdf_filename}")
-            return True
+        return True
     except Exception as e:
         print(f"[DELETE ERROR] Could not delete {pdf_filename} from database: {e}")
         return False
 
 
-def get_index_stats():
+def rollback_index(course_id: Optional[str] = None, version: Optional[int] = None):
+    """
+    Re-activate a kept index version (default: the one before the active
+    one). Instant, since the old collection is still there.
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        return index_client.call("rollback", course_id, version)
+
+    with index_versions.writing() as manifest:
+        entry = index_versions.course(course_id, manifest)
+        if version is None:
+            older = [
+                v["version"]
+                for v in entry["versions"]
+                if v["version"] < entry["active"]
+            ]
+            if not older:
+                raise ValueError(f"Course {course_id} has no earlier index version")
+            version = max(older)
+        IndexVersions.set_active(manifest, course_id, version)
+    set_index_version(index_version + 1)
+    print(f"[INGEST] Course {course_id} rolled back to index version {version}")
+    return {"status": "success", "course_id": course_id, "active": version}
+
+
+def get_index_versions(course_id: Optional[str] = None) -> dict:
+    course_id = normalize_course(course_id)
+    if index_client:
+        return index_client.call("versions", course_id)
+    entry = index_versions.course(course_id)
+    return {
+        "course_id": course_id,
+        "active": entry["active"],
+        "corpus_version": index_versions.corpus_version(course_id),
+        "versions": entry["versions"],
+    }
+
+
+@lru_cache(maxsize=256)
+def _shared_corpus_version(course_id: str, stamp: tuple) -> str:
+    return index_client.call("versions", course_id)["corpus_version"]
+
+
+def get_corpus_version(course_id: Optional[str] = None) -> str:
+    """
+    Identifies the content a course's queries are answered from, e.g.
+    "default@v3.1" (version 3, edited once); use it in cache keys.
+    """
+    course_id = normalize_course(course_id)
+    if index_client:
+        # Asked once per index change, which the service broadcasts
+        return _shared_corpus_version(course_id, index_client.stamp)
+    return index_versions.corpus_version(course_id)
+
+
+def get_course_stats() -> dict:
+    """Which course indexes are loaded (in the index service, if shared)."""
+    if index_client:
+        return index_client.call("courses")
+    return courses.stats()
+
+
+def get_index_stats(course_id: Optional[str] = None):
     try:
-        collection = chroma_client.get_collection("course_materials")
-        return {"status": "success", "document_count": collection.count()}
+        course_id = normalize_course(course_id)
+        if index_client:
+            return index_client.call("stats", course_id)
+        course = course_index(course_id)
+        return {
+            "status": "success",
+            "course_id": course_id,
+            "document_count": course.count(),
+            "version": course.version,
+            "corpus_version": index_versions.corpus_version(course_id),
+        }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-initialize_index()
+if not index_client:
+    course_index(DEFAULT_COURSE)
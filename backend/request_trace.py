@@ -0,0 +1,285 @@
+"""
+Per-request stage timings, a slow-query log and opt-in sampling profiles.
+
+RequestTraceMiddleware gives every /api/query and /api/query/stream request
+a RequestTrace (in a context variable, so it follows the request into the
+threadpool). The pipeline reports into it with `stage("llm")` blocks and
+`note(nodes=...)`. When the request ends, it goes into the slow-query ring
+buffer if it took longer than SLOW_QUERY_MS, or if it was profiled.
+
+Profiling is triggered per request by an `X-Profile: 1` header or by
+PROFILE_SAMPLE_RATE. A sampler thread then snapshots the stacks of the
+threads working on that request every PROFILE_INTERVAL_MS, so a 15 s query
+shows whether the time went to pypdf, Chroma, the embedding model or the
+LLM call. Questions are stored only as a hash.
+"""
+
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "5000"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# Share of traced requests profiled without asking (0.01 = 1%)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Profiles running at once; further requests asking for one aren't profiled
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+
+TRACED_PATHS = ("/api/query", "/api/query/stream")
+# Collapsed stacks kept per profile (the rest are summed into "other")
+PROFILE_MAX_STACKS = 200
+
+current: ContextVar[Optional["RequestTrace"]] = ContextVar(
+    "request_trace", default=None
+)
+
+
+def question_hash(question: str) -> str:
+    normalized = " ".join(question.lower().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()[:12]
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    return f"{path.parent.name}/{path.name}:{code.co_name}"
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stacks of a trace's active threads until stopped."""
+
+    active = 0
+    active_lock = threading.Lock()
+
+    def __init__(self, trace: "RequestTrace", interval_ms: float):
+        super().__init__(daemon=True)
+        self.trace = trace
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    @classmethod
+    def try_start(cls, trace: "RequestTrace") -> Optional["SamplingProfiler"]:
+        with cls.active_lock:
+            if cls.active >= PROFILE_MAX_CONCURRENT:
+                return None
+            cls.active += 1
+        profiler = cls(trace, PROFILE_INTERVAL_MS)
+        profiler.start()
+        return profiler
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                frames = sys._current_frames()
+                for thread_id in list(self.trace.threads):
+                    frame = frames.get(thread_id)
+                    labels = []
+                    while frame is not None:
+                        labels.append(frame_label(frame))
+                        frame = frame.f_back
+                    if labels:
+                        self.stacks[";".join(reversed(labels))] += 1
+                        self.samples += 1
+        finally:
+            with self.active_lock:
+                SamplingProfiler.active -= 1
+
+    def stop(self) -> dict:
+        self.stopped.set()
+        self.join()
+        self_time, total_time = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_time[frames[-1]] += count
+            for label in set(frames):
+                total_time[label] += count
+
+        def share(count):
+            return round(count / self.samples, 3) if self.samples else 0
+
+        stacks = dict(self.stacks.most_common(PROFILE_MAX_STACKS))
+        other = sum(self.stacks.values()) - sum(stacks.values())
+        if other:
+            stacks["other"] = other
+        return {
+            "samples": self.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            # share of samples spent in (self) / under (total) each function
+            "top_self": [[f, share(n)] for f, n in self_time.most_common(15)],
+            "top_total": [[f, share(n)] for f, n in total_time.most_common(15)],
+            # flamegraph.pl / speedscope "collapsed" format: stack -> samples
+            "stacks": stacks,
+        }
+
+
+class RequestTrace:
+    def __init__(self, request_id: str, path: str, profile: bool = False):
+        self.request_id = request_id
+        self.path = path
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.stages = Counter()
+        self.info = {}
+        self.threads = Counter()  # thread id -> open stage() blocks
+        self.finished = False
+        self.profiler = SamplingProfiler.try_start(self) if profile else None
+
+    @contextmanager
+    def stage(self, name: str, sample: bool = True):
+        """
+        Time a pipeline stage; repeated stages add up. With sample=False the
+        thread isn't profiled (for stages awaited on the event loop, which
+        runs other requests in between).
+        """
+        thread_id = threading.get_ident()
+        if sample:
+            self.threads[thread_id] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += (time.perf_counter() - started) * 1000
+            if sample:
+                self.threads[thread_id] -= 1
+                if not self.threads[thread_id]:
+                    del self.threads[thread_id]
+
+    def finish(self, status: Optional[int] = None):
+        if self.finished:
+            return
+        self.finished = True
+        total_ms = (time.perf_counter() - self.started) * 1000
+        profile = self.profiler.stop() if self.profiler else None
+        if total_ms < SLOW_QUERY_MS and profile is None:
+            return
+
+        record = {
+            "request_id": self.request_id,
+            "path": self.path,
+            "time": round(self.wall_time, 3),
+            "status": status,
+            "total_ms": round(total_ms, 1),
+            **self.info,
+            "stages_ms": {k: round(v, 1) for k, v in self.stages.items()},
+        }
+        if profile:
+            record["profile"] = profile
+        slow_queries.add(record)
+        if total_ms >= SLOW_QUERY_MS:
+            print(
+                f"[SLOW] {self.request_id} {self.path} {total_ms:.0f}ms "
+                f"{record['stages_ms']}"
+            )
+
+
+@contextmanager
+def stage(name: str, sample: bool = True):
+    """trace.stage() for the current request; a no-op outside one."""
+    trace = current.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name, sample):
+        yield
+
+
+def note(**info):
+    """Attach facts (node count, tokens, route...) to the current request."""
+    trace = current.get()
+    if trace is not None:
+        trace.info.update(info)
+
+
+class SlowQueryLog:
+    """Bounded ring buffer of slow or profiled requests."""
+
+    def __init__(self, size: int = SLOW_QUERY_LOG_SIZE):
+        self.records = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def add(self, record: dict):
+        with self.lock:
+            self.records.append(record)
+            self.total += 1
+
+    def list(self, limit: int = 50, min_ms: float = 0) -> list:
+        """Newest first, without the (large) profile stacks."""
+        with self.lock:
+            records = list(self.records)
+        return [
+            {
+                **{k: v for k, v in r.items() if k != "profile"},
+                "profiled": "profile" in r,
+            }
+            for r in reversed(records)
+            if r["total_ms"] >= min_ms
+        ][:limit]
+
+    def get(self, request_id: str) -> Optional[dict]:
+        with self.lock:
+            return next(
+                (r for r in reversed(self.records) if r["request_id"] == request_id),
+                None,
+            )
+
+
+slow_queries = SlowQueryLog()
+
+
+class RequestTraceMiddleware:
+    """
+    Pure ASGI (not BaseHTTPMiddleware) so the trace stays open until a
+    streamed response has sent its last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in TRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = (
+            headers.get(b"x-request-id", b"").decode("latin-1")[:64]
+            or uuid.uuid4().hex[:16]
+        )
+        profile = headers.get(b"x-profile", b"").lower() in (b"1", b"true") or (
+            random.random() < PROFILE_SAMPLE_RATE
+        )
+        trace = RequestTrace(request_id, scope["path"], profile)
+        token = current.set(trace)
+        status = None
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", request_id.encode("latin-1")),
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                trace.finish(status)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            # Errors and client disconnects end the trace too
+            trace.finish(status)
+            current.reset(token)
@@ -0,0 +1,380 @@
+"""
+Offline retrieval quality and latency evaluation.
+Runs a golden set of questions through the same retriever query_rag uses
+and reports recall@k, MRR and per-stage latency (query embedding, vector
+search, citation page lookup), so chunking, top_k, embedding or vector
+backend changes can be checked before they ship. No LLM is called and
+the Hugging Face hub is not contacted (the model must already be cached).
+
+Golden set (JSONL, one question per line):
+    {"question": "How is a node removed from a BST?",
+     "expected": [{"file": "lecture-07.pdf", "page": "12"}],
+     "course_id": "cs211"}
+"page" is optional (any page of the file counts) and so is "course_id"
+(default course). A chunk labelled with a page range ("4-5") matches any
+page inside it.
+
+Usage:
+    python retrieval_eval.py bootstrap ./uploaded_pdfs -o golden.jsonl
+    python retrieval_eval.py run golden.jsonl
+    python retrieval_eval.py run golden.jsonl --pdf-dir ./uploaded_pdfs \\
+        --output bench_results/eval-baseline.json
+    CHUNK_SIZE=384 python retrieval_eval.py run golden.jsonl \\
+        --pdf-dir ./uploaded_pdfs --baseline bench_results/eval-baseline.json
+    python retrieval_eval.py run golden.jsonl --min-recall 0.8 --min-mrr 0.6
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from benchmark import compare, git_commit, summarize, timed
+
+# Knobs that change retrieval; recorded with every report
+CONFIG_KEYS = [
+    "CHUNKING",
+    "CHUNK_SIZE",
+    "CHUNK_OVERLAP",
+    "MIN_CHUNK_CHARS",
+    "EMBED_PROVIDER",
+    "VECTOR_BACKEND",
+    "FLAT_INDEX_DTYPE",
+]
+
+# Bootstrapped questions are slide sentences with this share of words dropped
+DROP_WORDS = 0.3
+MIN_SENTENCE_WORDS = 8
+
+
+def load_golden(path: Path) -> List[dict]:
+    golden = []
+    for n, line in enumerate(path.read_text().splitlines(), start=1):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if not item.get("question") or not item.get("expected"):
+            raise ValueError(f"{path}:{n}: needs 'question' and 'expected'")
+        golden.append(item)
+    if not golden:
+        raise ValueError(f"{path} has no questions")
+    return golden
+
+
+def page_matches(label, page) -> bool:
+    """Does a retrieved page label ("7", "4-5") cover the expected page?"""
+    if page is None:
+        return True
+    first, _, last = str(label).partition("-")
+    try:
+        return int(first) <= int(page) <= int(last or first)
+    except ValueError:
+        return str(label) == str(page)
+
+
+def first_hits(retrieved: List[tuple], expected: List[dict]) -> List[Optional[int]]:
+    """1-based rank of the first retrieved chunk matching each expected entry."""
+    ranks = []
+    for want in expected:
+        ranks.append(
+            next(
+                (
+                    rank
+                    for rank, (file_name, label) in enumerate(retrieved, start=1)
+                    if file_name == want["file"]
+                    and page_matches(label, want.get("page"))
+                ),
+                None,
+            )
+        )
+    return ranks
+
+
+# ---------------------------------------------------------------------------
+# run
+# ---------------------------------------------------------------------------
+
+
+def configure_env(args, workdir: Path):
+    """Offline settings (and a scratch index for --pdf-dir), before importing."""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["USE_S3"] = "false"
+    os.environ["INDEX_SERVICE"] = ""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    if args.pdf_dir:
+        shutil.copytree(args.pdf_dir, workdir / "uploaded_pdfs", dirs_exist_ok=True)
+        os.environ["PDF_UPLOAD_DIR"] = str(workdir / "uploaded_pdfs")
+        os.environ["CHROMA_PATH"] = str(workdir / "chroma_db")
+        os.environ["FLAT_INDEX_PATH"] = str(workdir / "flat_index")
+        os.environ.pop("INDEX_VERSIONS_PATH", None)
+
+
+def current_config() -> dict:
+    import pdf_chunking
+    import rag_engine
+
+    return {
+        key: getattr(rag_engine, key, getattr(pdf_chunking, key, None))
+        for key in CONFIG_KEYS
+    }
+
+
+def evaluate(golden: List[dict], top_k: int, warmup: int) -> tuple:
+    """(metrics, misses) for the golden set against the configured index."""
+    from llama_index.core import QueryBundle, Settings
+
+    import rag_engine
+
+    ks = sorted({k for k in (1, 3, 5, top_k) if k <= top_k})
+    hits = {k: [] for k in ks}
+    file_hits = {k: [] for k in ks}
+    reciprocal_ranks = []
+    stages = {"embed": [], "search": [], "citations": [], "total": []}
+    misses = []
+
+    for i, item in enumerate(golden[:warmup] + golden):
+        course = rag_engine.course_index(
+            rag_engine.normalize_course(item.get("course_id"))
+        )
+        retriever = course.index.as_retriever(similarity_top_k=top_k)
+        vector, embed_ms = timed(
+            Settings.embed_model.get_query_embedding, item["question"]
+        )
+        nodes, search_ms = timed(
+            retriever.retrieve, QueryBundle(item["question"], embedding=vector)
+        )
+        retrieved, citations_ms = timed(
+            lambda: [
+                (n.node.metadata.get("file_name"), rag_engine.resolve_page_label(n))
+                for n in nodes
+            ]
+        )
+        if i < warmup:
+            continue  # model/index warm-up, not measured
+        for stage, ms in zip(stages, (embed_ms, search_ms, citations_ms)):
+            stages[stage].append(ms)
+        stages["total"].append(embed_ms + search_ms + citations_ms)
+
+        expected = item["expected"]
+        ranks = first_hits(retrieved, expected)
+        file_ranks = first_hits(
+            retrieved, [{"file": want["file"]} for want in expected]
+        )
+        for k in ks:
+            hits[k].append(sum(r is not None and r <= k for r in ranks) / len(ranks))
+            file_hits[k].append(
+                sum(r is not None and r <= k for r in file_ranks) / len(file_ranks)
+            )
+        found = [r for r in ranks if r is not None]
+        reciprocal_ranks.append(1 / min(found) if found else 0.0)
+        if not found:
+            misses.append(
+                {
+                    "question": item["question"],
+                    "expected": expected,
+                    "retrieved": [f"{f} (Page {p})" for f, p in retrieved[:3]],
+                }
+            )
+
+    n = len(golden)
+    metrics = {"questions": n, "top_k": top_k}
+    for k in ks:
+        metrics[f"recall@{k}"] = round(sum(hits[k]) / n, 4)
+        metrics[f"file_recall@{k}"] = round(sum(file_hits[k]) / n, 4)
+    metrics["mrr"] = round(sum(reciprocal_ranks) / n, 4)
+    for stage, samples in stages.items():
+        metrics.update(summarize(samples, prefix=f"{stage}_"))
+    return metrics, misses
+
+
+def quality_regressions(current: dict, baseline: dict, tolerance: float) -> list:
+    """Recall/MRR drops larger than tolerance (absolute) vs the baseline."""
+    regressions = []
+    base = baseline.get("results", {}).get("retrieval_eval", {})
+    for metric, value in current["results"]["retrieval_eval"].items():
+        if not metric.startswith(("recall@", "file_recall@", "mrr")):
+            continue
+        if metric in base and value < base[metric] - tolerance:
+            regressions.append(f"{metric}: {base[metric]} -> {value}")
+    return regressions
+
+
+def threshold_failures(metrics: dict, args) -> list:
+    failures = []
+    recall = metrics.get(f"recall@{args.top_k}")
+    if args.min_recall is not None and recall < args.min_recall:
+        failures.append(f"recall@{args.top_k} {recall} < {args.min_recall}")
+    if args.min_mrr is not None and metrics["mrr"] < args.min_mrr:
+        failures.append(f"mrr {metrics['mrr']} < {args.min_mrr}")
+    p95 = metrics.get("total_p95_ms")
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        failures.append(f"total_p95_ms {p95} > {args.max_p95_ms}")
+    return failures
+
+
+def run(args):
+    golden = load_golden(args.golden)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="tutorbot_eval_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    configure_env(args, workdir)
+
+    import rag_engine
+    from model_router import base_route
+
+    args.top_k = args.top_k or base_route(args.mode).top_k
+    metrics = {}
+    if args.pdf_dir:
+        started = time.perf_counter()
+        for course_id in sorted({item.get("course_id") or "" for item in golden}):
+            result = rag_engine.ingest_pdfs(course_id or None)
+            if result.get("status") != "success":
+                sys.exit(f"[EVAL] Ingest of {course_id or 'default'} failed: {result}")
+        metrics["ingest_seconds"] = round(time.perf_counter() - started, 3)
+
+    quality, misses = evaluate(golden, args.top_k, args.warmup)
+    metrics.update(quality)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "golden": str(args.golden),
+            "mode": args.mode,
+            "config": current_config(),
+        },
+        "results": {"retrieval_eval": metrics},
+        "misses": misses,
+    }
+    print(f"[EVAL] {json.dumps(metrics)}")
+    for miss in misses[: args.show_misses]:
+        print(f"[EVAL] MISS {miss['question']!r} -> {miss['retrieved']}")
+
+    output = args.output or (
+        Path("bench_results")
+        / f"retrieval-eval-{time.strftime('%Y%m%d-%H%M%S')}-{git_commit()}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"[EVAL] Results written to {output}")
+
+    failures = threshold_failures(metrics, args)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        failures += quality_regressions(report, baseline, args.quality_tolerance)
+        failures += compare(report, baseline, args.tolerance)
+    if failures:
+        print(f"[EVAL] {len(failures)} regression(s):")
+        for line in failures:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("[EVAL] All checks passed")
+
+
+# ---------------------------------------------------------------------------
+# bootstrap
+# ---------------------------------------------------------------------------
+
+
+def bootstrap(args):
+    """
+    Draft golden entries from slide text: a sentence from a random page, with
+    some words dropped, expected to retrieve that page. Review them (and
+    rewrite them as real student questions) before relying on the numbers.
+    """
+    import pypdf
+
+    from pdf_chunking import find_boilerplate, strip_page
+
+    rng = random.Random(args.seed)
+    entries = []
+    for pdf_path in sorted(args.pdf_dir.glob("*.pdf")):
+        pages = [page.extract_text() or "" for page in pypdf.PdfReader(pdf_path).pages]
+        lines = [text.splitlines() for text in pages]
+        boilerplate = find_boilerplate(lines)
+        candidates = []
+        for page_number, page_lines in enumerate(lines, start=1):
+            text = " ".join(strip_page(page_lines, boilerplate).split())
+            sentences = [
+                s
+                for s in re.split(r"(?<=[.!?])\s+", text)
+                if len(s.split()) >= MIN_SENTENCE_WORDS
+            ]
+            if sentences:
+                candidates.append((page_number, sentences))
+
+        for page_number, sentences in rng.sample(
+            candidates, min(args.per_doc, len(candidates))
+        ):
+            words = rng.choice(sentences).rstrip(".!?").split()
+            kept = [w for w in words if rng.random() >= DROP_WORDS] or words
+            entry = {
+                "question": " ".join(kept) + "?",
+                "expected": [{"file": pdf_path.name, "page": str(page_number)}],
+            }
+            if args.course:
+                entry["course_id"] = args.course
+            entries.append(entry)
+
+    args.output.write_text("".join(json.dumps(e) + "\n" for e in entries))
+    print(f"[EVAL] Wrote {len(entries)} draft golden entries to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Evaluate a golden set")
+    run_parser.add_argument("golden", type=Path, help="Golden set (JSONL)")
+    run_parser.add_argument(
+        "--pdf-dir",
+        type=Path,
+        help="Ingest these PDFs into a scratch index first (to test chunking "
+        "or embedding changes); default: evaluate the existing index",
+    )
+    run_parser.add_argument(
+        "--mode", default="direct", help="ITS mode whose top_k to use"
+    )
+    run_parser.add_argument("--top-k", type=int, help="Override the mode's top_k")
+    run_parser.add_argument("--warmup", type=int, default=3)
+    run_parser.add_argument("--min-recall", type=float, help="Fail below this")
+    run_parser.add_argument("--min-mrr", type=float, help="Fail below this")
+    run_parser.add_argument("--max-p95-ms", type=float, help="Fail above this")
+    run_parser.add_argument("--baseline", type=Path, help="Earlier report to compare")
+    run_parser.add_argument(
+        "--quality-tolerance",
+        type=float,
+        default=0.02,
+        help="Allowed absolute recall/MRR drop vs the baseline",
+    )
+    run_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative latency increase vs the baseline",
+    )
+    run_parser.add_argument("--show-misses", type=int, default=5)
+    run_parser.add_argument("--workdir", type=Path, help="Scratch dir (default: temp)")
+    run_parser.add_argument("--output", type=Path, help="Where to write the JSON")
+
+    boot = sub.add_parser("bootstrap", help="Draft a golden set from PDFs")
+    boot.add_argument("pdf_dir", type=Path)
+    boot.add_argument("-o", "--output", type=Path, default=Path("golden.jsonl"))
+    boot.add_argument("--per-doc", type=int, default=5)
+    boot.add_argument("--course", help="course_id to record in the entries")
+    boot.add_argument("--seed", type=int, default=211)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        bootstrap(args)
+
+
+if __name__ == "__main__":
+    main()
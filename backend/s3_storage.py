@@ -68,13 +68,18 @@ def is_s3_enabled() -> bool:
     return s3_client is not None
 
 
-def upload_file_to_s3(file_path: Path, s3_key: Optional[str] = None) -> bool:
+def upload_file_to_s3(
+    file_path: Path,
+    s3_key: Optional[str] = None,
+    content_type: str = "application/pdf",
+) -> bool:
     """
     Upload a file to S3
 
     Args:
         file_path: Local path to the file
         s3_key: S3 object key (defaults to filename)
+        content_type: Content-Type stored with the object
 
     Returns:
         True if successful, False otherwise
@@ -91,7 +96,7 @@ def upload_file_to_s3(file_path: Path, s3_key: Optional[str] = None) -> bool:
             str(file_path),
             AWS_S3_BUCKET,
             s3_key,
-            ExtraArgs={"ContentType": "application/pdf"},
+            ExtraArgs={"ContentType": content_type},
         )
         print(f"[S3] Successfully uploaded {file_path.name} to S3")
         return True
@@ -124,25 +129,31 @@ def download_file_from_s3(s3_key: str, local_path: Path) -> bool:
         return False
 
 
-def list_s3_pdfs() -> List[str]:
+def list_s3_pdfs(prefix: str = "pdfs/") -> List[str]:
     """
     List all PDF files in the S3 bucket
 
+    Args:
+        prefix: Key prefix of one course's PDFs (default: the default course)
+
     Returns:
-        List of PDF filenames (without the 'pdfs/' prefix)
+        List of PDF filenames (without the prefix)
     """
     if not is_s3_enabled():
         return []
 
     try:
-        response = s3_client.list_objects_v2(Bucket=AWS_S3_BUCKET, Prefix="pdfs/")
+        # Delimiter keeps other courses' "pdfs/<course>/" keys out of the list
+        response = s3_client.list_objects_v2(
+            Bucket=AWS_S3_BUCKET, Prefix=prefix, Delimiter="/"
+        )
 
         if "Contents" not in response:
             return []
 
-        # Extract filenames without the 'pdfs/' prefix
+        # Extract filenames without the prefix
         files = [
-            obj["Key"].replace("pdfs/", "")
+            obj["Key"][len(prefix) :]
             for obj in response["Contents"]
             if obj["Key"].endswith(".pdf")
         ]
@@ -152,12 +163,36 @@ def list_s3_pdfs() -> List[str]:
         return []
 
 
-def delete_file_from_s3(filename: str) -> bool:
+def list_s3_courses(prefix: str = "pdfs/") -> List[str]:
+    """
+    List the course folders under the PDF prefix
+
+    Returns:
+        Course ids that have a "pdfs/<course>/" folder
+    """
+    if not is_s3_enabled():
+        return []
+
+    try:
+        response = s3_client.list_objects_v2(
+            Bucket=AWS_S3_BUCKET, Prefix=prefix, Delimiter="/"
+        )
+        return [
+            p["Prefix"][len(prefix) :].rstrip("/")
+            for p in response.get("CommonPrefixes", [])
+        ]
+    except ClientError as e:
+        print(f"[S3 ERROR] Failed to list courses: {e}")
+        return []
+
+
+def delete_file_from_s3(filename: str, prefix: str = "pdfs/") -> bool:
     """
     Delete a file from S3
 
     Args:
         filename: Name of the file to delete
+        prefix: Key prefix of the file's course
 
     Returns:
         True if successful, False otherwise
@@ -167,7 +202,7 @@ def delete_file_from_s3(filename: str) -> bool:
         return False
 
     try:
-        s3_key = f"pdfs/{filename}"
+        s3_key = f"{prefix}{filename}"
         s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
         print(f"[S3] Successfully deleted {filename} from S3")
         return True
@@ -176,13 +211,16 @@ def delete_file_from_s3(filename: str) -> bool:
         return False
 
 
-def get_s3_file_url(filename: str, expiration: int = 3600) -> Optional[str]:
+def get_s3_file_url(
+    filename: str, expiration: int = 3600, prefix: str = "pdfs/"
+) -> Optional[str]:
     """
     Generate a presigned URL for accessing a file in S3
 
     Args:
         filename: Name of the file
         expiration: URL expiration time in seconds (default: 1 hour)
+        prefix: Key prefix of the file's course
 
     Returns:
         Presigned URL or None if failed
@@ -191,7 +229,7 @@ def get_s3_file_url(filename: str, expiration: int = 3600) -> Optional[str]:
         return None
 
     try:
-        s3_key = f"pdfs/{filename}"
+        s3_key = f"{prefix}{filename}"
         url = s3_client.generate_presigned_url(
             "get_object",
             Params={"Bucket": AWS_S3_BUCKET, "Key": s3_key},
@@ -238,13 +276,16 @@ def download_s3_pdf_to_temp(filename: str) -> Optional[str]:
         return None
 
 
-def ensure_pdf_local(filename: str, local_dir: Path) -> Optional[Path]:
+def ensure_pdf_local(
+    filename: str, local_dir: Path, prefix: str = "pdfs/"
+) -> Optional[Path]:
     """
     Ensure a PDF is available locally, downloading from S3 if necessary
 
     Args:
         filename: Name of the PDF file
         local_dir: Local directory to store the file
+        prefix: Key prefix of the file's course
 
     Returns:
         Path to local file or None if not available
@@ -257,7 +298,7 @@ def ensure_pdf_local(filename: str, local_dir: Path) -> Optional[Path]:
 
     # If S3 is enabled, try to download it
     if is_s3_enabled():
-        s3_key = f"pdfs/{filename}"
+        s3_key = f"{prefix}{filename}"
         if download_file_from_s3(s3_key, local_path):
             return local_path
 
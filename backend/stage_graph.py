@@ -0,0 +1,79 @@
+"""
+A small dependency graph of async request stages.
+Each stage starts as soon as the stages it depends on have finished, so
+independent work overlaps (e.g. retrieval runs while the request waits in
+the admission queue), and the graph records when every stage started and
+ended. critical_path() walks back from the last stage through whichever
+dependency finished last: that chain is what the response actually waited
+for, and the only place where speeding a stage up shortens the request.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List
+
+
+class StageGraph:
+    def __init__(self):
+        self.stages = {}  # name -> (fn, deps)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.spans = {}  # name -> (start, end), seconds since self.started
+        self.started = None
+
+    def add(self, name: str, fn: Callable[..., Awaitable], *deps: str):
+        """fn is called with the results of deps, in order."""
+        assert all(d in self.stages for d in deps), f"{name}: unknown dependency"
+        self.stages[name] = (fn, deps)
+
+    def start(self):
+        """Schedule every stage (in the order they were added)."""
+        self.started = time.perf_counter()
+        for name in self.stages:
+            self.tasks[name] = asyncio.ensure_future(self._run(name))
+
+    async def _run(self, name: str):
+        fn, deps = self.stages[name]
+        inputs = [await self.tasks[d] for d in deps]
+        began = time.perf_counter() - self.started
+        try:
+            return await fn(*inputs)
+        finally:
+            self.spans[name] = (began, time.perf_counter() - self.started)
+
+    async def result(self, name: str):
+        if self.started is None:
+            self.start()
+        return await self.tasks[name]
+
+    def cancel(self):
+        """Stop stages nobody will wait for (threadpool work still finishes)."""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # retrieved, so asyncio doesn't log it
+
+    def critical_path(self, last: str) -> List[str]:
+        path = [last]
+        while True:
+            deps = [d for d in self.stages[path[-1]][1] if d in self.spans]
+            if not deps:
+                return path[::-1]
+            path.append(max(deps, key=lambda d: self.spans[d][1]))
+
+    def timings(self, last: str) -> dict:
+        """
+        Per-stage [start, end] ms, the critical path to `last`, and how long
+        the stages would have taken back to back (the gain from overlapping).
+        """
+        spans = dict(self.spans)
+        return {
+            "graph_ms": {
+                name: [round(1000 * start, 1), round(1000 * end, 1)]
+                for name, (start, end) in spans.items()
+            },
+            "critical_path": self.critical_path(last) if last in spans else [],
+            "sequential_ms": round(
+                1000 * sum(end - start for start, end in spans.values()), 1
+            ),
+        }
@@ -0,0 +1,420 @@
+"""
+Precomputed document summaries for overview questions (SUMMARIES=true).
+"Can you summarize the material?" or "What is the main topic of the
+lecture?" retrieve ten loosely related chunks, and the LLM has to piece an
+overview together from fragments: a large prompt and a poor answer. Instead,
+after an ingest (SUMMARIES_AFTER_INGEST) or with `python summaries.py
+--course <id>`, every PDF gets a small summary tree, built once:
+  - a summary per section (consecutive pages up to SUMMARY_SECTION_CHARS)
+  - a document overview written from those section summaries
+Trees are cached by PDF content hash, so re-ingesting only summarizes new
+or changed PDFs, and each corpus version (index_versions.py) records which
+trees it contains. A PDF delete or rollback changes the corpus version;
+until that version has summaries, overview questions are retrieved as
+usual.
+
+At query time, retrieve_for_mode (rag_engine.py) answers an overview
+question from these summaries instead of the vector index:
+  - about the course as a whole: every document overview
+  - naming one document ("summarize lecture 3"): its overview plus its
+    section summaries
+Questions that name a topic ("summarize heaps") still go to retrieval.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from llama_index.core.schema import NodeWithScore, TextNode
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionRejected
+from background_jobs import BackgroundRuns
+from courses import course_dir, normalize_course
+from http_cache import pdf_version
+from model_router import FAST_MODEL
+from pdf_chunking import deck_title, strip_deck
+from prompts import DOCUMENT_SUMMARY_PROMPT, SECTION_SUMMARY_PROMPT
+
+SUMMARIES = os.getenv("SUMMARIES", "false").lower() == "true"
+SUMMARIES_AFTER_INGEST = (
+    os.getenv("SUMMARIES_AFTER_INGEST", "true").lower() == "true" and SUMMARIES
+)
+SUMMARY_DB = os.getenv("SUMMARY_DB", "summaries.db")
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", FAST_MODEL)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "250"))
+# Page text per section summary (about 1.5k tokens)
+SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "6000"))
+# LLM calls per minute a build may spend
+SUMMARY_RATE_PER_MIN = float(os.getenv("SUMMARY_RATE_PER_MIN", "30"))
+
+# Asking about the material as a whole, not about a topic in it
+OVERVIEW_PATTERN = re.compile(
+    r"\b(summar\w*|overview|outline|recap|gist|(main|key|central) "
+    r"(topic|idea|point|theme|takeaway|concept)s?|about|cover(s|ed)?)\b",
+    re.IGNORECASE,
+)
+# Words an overview question may contain besides a document's name
+OVERVIEW_WORDS = set("""
+    a about all an and are briefly can cover covered covers could course
+    deck decks do document documents does entire everything for give gist
+    i in is it its key lecture lectures main material materials me notes
+    of on outline overview pdf pdfs please point points quick recap short
+    slide slides so summarise summarize summary takeaway takeaways tell
+    the these this those to topic topics us we what whole you central
+    idea ideas theme themes concept concepts class chapter content
+    contents was were week today
+    """.split())
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text: str) -> List[str]:
+    # "03" and "3" are the same lecture number
+    return [str(int(w)) if w.isdigit() else w for w in WORD.findall(text.lower())]
+
+
+def looks_like_overview(question: str) -> bool:
+    return bool(OVERVIEW_PATTERN.search(question))
+
+
+def split_sections(pages: List[str], max_chars: int = SUMMARY_SECTION_CHARS):
+    """[(first page, last page, text)] of consecutive pages, 1-based."""
+    sections = []
+    start, parts, size = 1, [], 0
+    for number, text in enumerate(pages, 1):
+        if parts and size + len(text) > max_chars:
+            sections.append((start, number - 1, "\n\n".join(parts)))
+            start, parts, size = number, [], 0
+        parts.append(text)
+        size += len(text)
+    if any(p.strip() for p in parts):
+        sections.append((start, len(pages), "\n\n".join(parts)))
+    return [s for s in sections if s[2].strip()]
+
+
+def page_range(first: int, last: int) -> str:
+    return str(first) if first == last else f"{first}-{last}"
+
+
+class SummaryStore:
+    """
+    SQLite-backed, shared by every worker on the host:
+      documents: summary tree per (PDF content hash, model)
+      corpora:   which documents each corpus version's summaries cover
+    """
+
+    def __init__(self, path: str = SUMMARY_DB):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.Lock()
+        self.corpora = {}  # corpus_version -> documents, memoized
+        with self.lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_hash TEXT,
+                    model TEXT,
+                    title TEXT,
+                    pages INTEGER,
+                    summary TEXT,
+                    sections TEXT,
+                    created REAL,
+                    PRIMARY KEY (doc_hash, model)
+                )
+                """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS corpora (
+                    corpus_version TEXT PRIMARY KEY,
+                    course_id TEXT,
+                    model TEXT,
+                    documents TEXT,
+                    created REAL
+                )
+                """)
+            self.conn.commit()
+
+    def get_document(self, doc_hash: str, model: str = SUMMARY_MODEL):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT title, pages, summary, sections FROM documents "
+                "WHERE doc_hash = ? AND model = ?",
+                (doc_hash, model),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "title": row[0],
+            "pages": row[1],
+            "summary": row[2],
+            "sections": json.loads(row[3]),
+        }
+
+    def put_document(self, doc_hash: str, tree: dict, model: str = SUMMARY_MODEL):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    doc_hash,
+                    model,
+                    tree["title"],
+                    tree["pages"],
+                    tree["summary"],
+                    json.dumps(tree["sections"]),
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+
+    def put_corpus(self, corpus_version: str, course_id: str, documents: list):
+        """documents: [{"file_name", "doc_hash"}] in display order."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO corpora VALUES (?, ?, ?, ?, ?)",
+                (
+                    corpus_version,
+                    course_id,
+                    SUMMARY_MODEL,
+                    json.dumps(documents),
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+            self.corpora.pop(corpus_version, None)
+
+    def documents(self, corpus_version: str) -> Optional[list]:
+        """The corpus version's document trees (with file_name), or None."""
+        if corpus_version in self.corpora:
+            return self.corpora[corpus_version]
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT documents, model FROM corpora WHERE corpus_version = ?",
+                (corpus_version,),
+            ).fetchone()
+        if row is None:
+            # Not memoized: a build for this version may still be running
+            return None
+        documents = []
+        for entry in json.loads(row[0]):
+            tree = self.get_document(entry["doc_hash"], row[1])
+            if tree:
+                documents.append({**tree, "file_name": entry["file_name"]})
+        if len(self.corpora) > 64:
+            self.corpora.clear()
+        self.corpora[corpus_version] = documents
+        return documents
+
+    def nodes_for(self, question: str, corpus_version: str) -> list:
+        """
+        Summary nodes answering an overview question, or [] if the corpus
+        version has no summaries or the question is about a specific topic.
+        """
+        try:
+            documents = self.documents(corpus_version)
+        except sqlite3.Error as e:
+            logging.error("Summary lookup failed: %s", e)
+            return []
+        if not documents:
+            return []
+
+        # Whatever isn't overview phrasing has to name a document
+        rest = set(words(question)) - OVERVIEW_WORDS
+        if rest:
+            matches = [
+                (len(rest & set(words(f"{d['file_name']} {d['title']}"))), d)
+                for d in documents
+            ]
+            best, document = max(matches, key=lambda m: m[0])
+            if best < len(rest):
+                return []
+            return document_nodes(document, with_sections=True)
+        return [node for d in documents for node in document_nodes(d)]
+
+
+def document_nodes(document: dict, with_sections: bool = False) -> list:
+    """
+    NodeWithScore per summary, cited as the file's page range (resolved_page
+    is what citations read, see rag_engine._extract_citations).
+    """
+
+    def node(text: str, pages: str) -> NodeWithScore:
+        return NodeWithScore(
+            node=TextNode(
+                text=text,
+                metadata={"file_name": document["file_name"], "resolved_page": pages},
+                excluded_llm_metadata_keys=["resolved_page"],
+                excluded_embed_metadata_keys=["resolved_page"],
+            ),
+            score=1.0,
+        )
+
+    nodes = [
+        node(
+            f"Overview of {document['title']}:\n{document['summary']}",
+            page_range(1, document["pages"]),
+        )
+    ]
+    if with_sections:
+        nodes += [
+            node(f"{s['title']} (pages {s['pages']}):\n{s['summary']}", s["pages"])
+            for s in document["sections"]
+        ]
+    return nodes
+
+
+summary_store = SummaryStore() if SUMMARIES else None
+
+
+# ---------------------------------------------------------------------------
+# Building
+# ---------------------------------------------------------------------------
+
+builds = BackgroundRuns("__summaries__")
+
+
+class Summarizer:
+    """Background-priority LLM calls, paced to SUMMARY_RATE_PER_MIN."""
+
+    def __init__(self):
+        from rag_engine import get_llm
+
+        self.llm = get_llm(SUMMARY_MODEL, 0.2, SUMMARY_MAX_TOKENS)
+        self.interval = 60.0 / SUMMARY_RATE_PER_MIN
+        self.next_call = 0.0
+        self.calls = 0
+
+    async def __call__(self, prompt: str) -> str:
+        await asyncio.sleep(max(0.0, self.next_call - time.monotonic()))
+        self.next_call = time.monotonic() + self.interval
+        ticket = await builds.admit()
+        try:
+            response = await run_in_threadpool(self.llm.complete, prompt)
+        finally:
+            ticket.release()
+        self.calls += 1
+        return response.text.strip()
+
+
+async def summarize_pdf(pdf_path: Path, summarize: Summarizer) -> dict:
+    from rag_engine import read_page_texts
+
+    pages = await run_in_threadpool(
+        read_page_texts, str(pdf_path), pdf_path.stat().st_mtime
+    )
+    texts = strip_deck(pages)
+    title = deck_title(texts, pdf_path.name)
+
+    sections = []
+    for first_page, last_page, text in split_sections(texts):
+        pages_label = page_range(first_page, last_page)
+        section_title = text.strip().split("\n", 1)[0][:80]
+        summary = await summarize(
+            SECTION_SUMMARY_PROMPT.format(
+                title=section_title, pages=pages_label, text=text
+            )
+        )
+        sections.append(
+            {"title": section_title, "pages": pages_label, "summary": summary}
+        )
+    overview = await summarize(
+        DOCUMENT_SUMMARY_PROMPT.format(
+            title=title,
+            sections="\n\n".join(
+                f"{s['title']} (pages {s['pages']}): {s['summary']}" for s in sections
+            ),
+        )
+    )
+    return {
+        "title": title,
+        "pages": len(pages),
+        "summary": overview,
+        "sections": sections,
+    }
+
+
+async def build_summaries(course_id: Optional[str] = None) -> dict:
+    """Summary trees for a course's PDFs, recorded under its corpus version."""
+    from rag_engine import HAS_PYPDF, PDF_UPLOAD_DIR, get_corpus_version
+
+    course_id = normalize_course(course_id)
+    started = time.monotonic()
+    corpus_version = await run_in_threadpool(get_corpus_version, course_id)
+    result = {
+        "course_id": course_id,
+        "corpus_version": corpus_version,
+        "documents": 0,
+        "summarized": 0,
+        "reused": 0,
+        "llm_calls": 0,
+        "status": "running",
+    }
+    if not HAS_PYPDF:
+        result["status"] = "skipped (pypdf not installed)"
+        return result
+
+    summarize = Summarizer()
+    documents = []
+    try:
+        for pdf_path in sorted(course_dir(PDF_UPLOAD_DIR, course_id).glob("*.pdf")):
+            doc_hash = await run_in_threadpool(pdf_version, pdf_path)
+            if await run_in_threadpool(summary_store.get_document, doc_hash) is None:
+                if await builds.superseded(course_id, corpus_version):
+                    result["status"] = "superseded"
+                    return result
+                tree = await summarize_pdf(pdf_path, summarize)
+                await run_in_threadpool(summary_store.put_document, doc_hash, tree)
+                result["summarized"] += 1
+            else:
+                result["reused"] += 1
+            documents.append({"file_name": pdf_path.name, "doc_hash": doc_hash})
+
+        await run_in_threadpool(
+            summary_store.put_corpus, corpus_version, course_id, documents
+        )
+        result["documents"] = len(documents)
+        result["status"] = "done"
+    except AdmissionRejected:
+        result["status"] = "stopped (server busy)"
+    except Exception as e:
+        print(f"[SUMMARIES] Build for {course_id} failed: {e}")
+        result["status"] = f"failed ({e})"
+    finally:
+        result["llm_calls"] = summarize.calls
+        result["seconds"] = round(time.monotonic() - started, 1)
+        builds.last[course_id] = result
+        print(f"[SUMMARIES] {course_id}: {result}")
+    return result
+
+
+def start_summaries(course_id: Optional[str] = None) -> bool:
+    """
+    Run build_summaries in the background on the current event loop.
+    Returns False if summaries are off or the course already has a build.
+    """
+    if summary_store is None:
+        return False
+    return builds.start(normalize_course(course_id), build_summaries)
+
+
+def summary_stats() -> dict:
+    return {
+        "enabled": SUMMARIES,
+        "model": SUMMARY_MODEL,
+        "building": builds.running(),
+        "last_builds": builds.last,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a course's summary tree")
+    parser.add_argument("--course", default=None)
+    args = parser.parse_args()
+    if summary_store is None:
+        summary_store = SummaryStore()
+    print(json.dumps(asyncio.run(build_summaries(args.course)), indent=2))
@@ -0,0 +1,160 @@
+"""
+Synthetic lecture PDF generator for benchmarks.
+Writes small, valid text PDFs (no extra dependencies) that look roughly like
+CS 211 lecture slides: a title line, a repeated course header/footer and a
+few paragraphs of topic text per page.
+
+Usage:
+    python synthetic_corpus.py ./bench_pdfs --docs 20 --pages 30
+"""
+
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+TOPICS = [
+    "Linked Lists",
+    "Pointers and Memory",
+    "Dynamic Allocation",
+    "Recursion",
+    "Binary Search Trees",
+    "Hash Tables",
+    "Stacks and Queues",
+    "Templates",
+    "Classes and Constructors",
+    "Copy Semantics",
+    "Iterators",
+    "Sorting Algorithms",
+]
+
+VOCAB = (
+    "pointer node memory heap stack allocate free delete new malloc struct "
+    "class object reference value copy move constructor destructor template "
+    "iterator vector list array index loop recursion base case invariant "
+    "complexity linear constant logarithmic insert remove search traverse "
+    "head tail next previous null segfault valgrind compile link header "
+    "function parameter return scope lifetime ownership buffer overflow"
+).split()
+
+HEADER = "CS 211: Fundamentals of Computer Science II"
+FOOTER = "Northwestern University - Winter 2026"
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(lines: List[str]) -> bytes:
+    ops = ["BT", "/F1 11 Tf", "14 TL", "50 760 Td"]
+    for line in lines:
+        ops.append(f"({_escape(line)}) Tj T*")
+    ops.append("ET")
+    return "\n".join(ops).encode("latin-1", errors="replace")
+
+
+def write_pdf(path: Path, pages: List[List[str]]) -> None:
+    """Write a minimal PDF with one text stream per page."""
+    objects: List[bytes] = []
+    page_count = len(pages)
+    font_id = 3
+    first_page_id = 4
+
+    kids = " ".join(f"{first_page_id + 2 * i} 0 R" for i in range(page_count))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for i, lines in enumerate(pages):
+        content_id = first_page_id + 2 * i + 1
+        objects.append(
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                f"/Resources << /Font << /F1 {font_id} 0 R >> >> "
+                f"/Contents {content_id} 0 R >>"
+            ).encode()
+        )
+        stream = _page_stream(lines)
+        objects.append(
+            f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+        )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for obj_id, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n".encode()
+    out += b"0000000000 65535 f \n"
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+
+    path.write_bytes(bytes(out))
+
+
+def _sentence(rng: random.Random, topic: str) -> str:
+    words = rng.sample(VOCAB, rng.randint(8, 14))
+    words.insert(rng.randint(0, len(words)), topic.lower())
+    return " ".join(words).capitalize() + "."
+
+
+def make_lecture(
+    rng: random.Random, number: int, pages: int, short_slides: float = 0.0
+) -> List[List[str]]:
+    """
+    Slide text per page; a `short_slides` share of pages are title/section
+    slides with a single sentence, like real decks have.
+    """
+    topic = TOPICS[number % len(TOPICS)]
+    result = []
+    for page in range(pages):
+        lines = [HEADER, f"Lecture {number}: {topic} (slide {page + 1})", ""]
+        # Only draw when asked, so existing corpora stay byte-identical
+        short = short_slides and rng.random() < short_slides
+        sentences = 1 if short else rng.randint(6, 12)
+        for _ in range(sentences):
+            lines.append(_sentence(rng, topic))
+        lines += ["", FOOTER]
+        result.append(lines)
+    return result
+
+
+def generate_corpus(
+    out_dir: Path,
+    docs: int = 10,
+    pages: int = 20,
+    seed: int = 211,
+    short_slides: float = 0.0,
+) -> List[Path]:
+    """
+    Generate `docs` lecture PDFs of `pages` pages each into out_dir.
+
+    Returns:
+        List of generated PDF paths
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for number in range(1, docs + 1):
+        path = out_dir / f"synthetic-lecture-{number:03d}.pdf"
+        write_pdf(path, make_lecture(rng, number, pages, short_slides))
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic lecture PDFs")
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=211)
+    args = parser.parse_args()
+
+    generated = generate_corpus(args.out_dir, args.docs, args.pages, args.seed)
+    print(f"[CORPUS] Wrote {len(generated)} PDFs to {args.out_dir}")
@@ -9,6 +9,9 @@ import { useAnonUserId, useUsername, useIsAdmin } from "../../lib/auth";
 // --- CONFIGURATION ---
 // This automatically picks the right URL based on where the code is running
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
+// Retrieval prefetch while typing (backend prefetch.py)
+const PREFETCH_DEBOUNCE_MS = 400;
+const PREFETCH_MIN_CHARS = 12;
 // ---------------------
 
 type Message = {
@@ -26,6 +29,7 @@ export default function ChatPage() {
   const [files, setFiles] = useState<string[]>([]);
   const [activeFile, setActiveFile] = useState<string | null>(null);
   const [displayNames, setDisplayNames] = useState<Record<string, string>>({}); // Filename -> Display Name
+  const [fileUrls, setFileUrls] = useState<Record<string, string>>({}); // Filename -> cacheable URL
   const [editingFile, setEditingFile] = useState<string | null>(null);
   const [editingName, setEditingName] = useState("");
 
@@ -56,6 +60,8 @@ export default function ChatPage() {
 
   // References
   const chatContainerRef = useRef<HTMLDivElement>(null);
+  // In-flight /api/query, aborted on unmount so the server stops working on it
+  const queryAbortRef = useRef<AbortController | null>(null);
 
   // Handle draggable edge for chat column
   const handleMouseDown = () => {
@@ -149,6 +155,7 @@ export default function ChatPage() {
           const data = await res.json();
           setFiles(data.files || []);
           setDisplayNames(data.display_names || {});
+          setFileUrls(data.file_urls || {});
           if (data.files && data.files.length > 0 && !activeFile) {
             setActiveFile(data.files[0]);
           }
@@ -324,11 +331,8 @@ export default function ChatPage() {
 
     // Fetch History with error handling
     // UPDATED: Using API_BASE_URL
-    fetch(`${API_BASE_URL}/api/history`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ anon_user_id: anonUserId }),
-    })
+    // GET so the browser can revalidate with an ETag instead of re-downloading
+    fetch(`${API_BASE_URL}/api/history?anon_user_id=${encodeURIComponent(anonUserId)}`)
       .then((res) => {
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         return res.json();
@@ -355,6 +359,23 @@ export default function ChatPage() {
     }
   }, [messages, isLoading]);
 
+  // Prefetch retrieval for the question being typed, once typing pauses,
+  // so the answer doesn't wait on the search after send (best effort)
+  useEffect(() => {
+    const partial = input.trim();
+    if (!anonUserId || isLoading || partial.length < PREFETCH_MIN_CHARS) return;
+    const timer = setTimeout(() => {
+      fetch(`${API_BASE_URL}/api/prefetch`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ question: partial, mode, anon_user_id: anonUserId }),
+      }).catch(() => {});
+    }, PREFETCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [input, mode, anonUserId, isLoading]);
+
+  useEffect(() => () => queryAbortRef.current?.abort(), []);
+
   const handleSubmit = async () => {
     if (!input.trim() || isLoading) return;
     const userMsg: Message = { role: "user", content: input };
@@ -362,11 +383,14 @@ export default function ChatPage() {
     const question = input;
     setInput("");
     setIsLoading(true);
+    const controller = new AbortController();
+    queryAbortRef.current = controller;
 
     try {
       // UPDATED: Using API_BASE_URL
       const res = await fetch(`${API_BASE_URL}/api/query`, {
         method: "POST",
+        signal: controller.signal,
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           question: question,
@@ -374,10 +398,25 @@ export default function ChatPage() {
           anon_user_id: anonUserId,
         }),
       });
+      if (res.status === 429) {
+        // Server is shedding load or this user is asking too quickly
+        const retryAfter = res.headers.get("Retry-After") || "a few";
+        setMessages((prev) => [
+          ...prev,
+          {
+            role: "assistant",
+            content: `Lots of students are asking questions right now. Please try again in ${retryAfter} seconds.`,
+          },
+        ]);
+        return;
+      }
+      // Superseded by a newer question from this student (e.g. another tab)
+      if (res.status === 409) return;
       if (!res.ok) throw new Error(`HTTP ${res.status}`);
       const data = await res.json();
       setMessages((prev) => [...prev, data]);
     } catch (e) {
+      if (controller.signal.aborted) return;
       console.error("Query error:", e);
       setMessages((prev) => [
         ...prev,
@@ -388,6 +427,7 @@ export default function ChatPage() {
         },
       ]);
     } finally {
+      if (queryAbortRef.current === controller) queryAbortRef.current = null;
       setIsLoading(false);
     }
   };
@@ -696,7 +736,12 @@ export default function ChatPage() {
             {activeFile ? (
               <iframe
                 // UPDATED: Using API_BASE_URL
-                src={`${API_BASE_URL}/pdfs/${activeFile}`}
+                // Content-hashed URL when the API gives one, so the PDF is cached
+                src={
+                  fileUrls[activeFile]?.startsWith("http")
+                    ? fileUrls[activeFile]
+                    : `${API_BASE_URL}${fileUrls[activeFile] || `/pdfs/${activeFile}`}`
+                }
                 className="w-full h-full rounded border border-gray-300 bg-white"
               />
             ) : (